@@ -1,6 +1,7 @@
 import axios from "axios";
 
 const BASE_URL = "http://192.168.1.5:8000/";
+export const WS_URL = BASE_URL.replace(/^http/, "ws");
 
 export const endpoints = {
     'hospitals': '/hospitals/',
@@ -10,6 +11,7 @@ export const endpoints = {
     'user-doctors': '/users/doctors/',
     'doctor-detail': "/doctors/by-user/",
     'doctors': '/doctors/',
+    'autocomplete': '/autocomplete/',
     'login': '/o/token/',
     'register': '/users/',
     'reset-password-otp': "/api/password-reset/otp/",
@@ -19,8 +21,13 @@ export const endpoints = {
     'healthrecords': '/healthrecords/me/',
     'healthrecords-update': '/healthrecords/',
     'schedules': '/schedules/',
+    'availability': '/availability/',
     'notifications': '/notifications/',
+    'notifications-inbox': '/notifications/inbox/',
+    'notification_count': '/notifications/unread-count/',
+    'notifications-mark-all-read': '/notifications/mark-all-read/',
     'messages': '/messages/',
+    'messages-sync': '/messages/sync/',
     'testresults': '/testresults/',
     'reviews': '/reviews/',
     // VNPay
@@ -28,7 +35,8 @@ export const endpoints = {
     'vnpay-return': '/vnpay-return/',
     // Report
     'reportsdoctor': '/reportsdoctor/',
-    'reportsadmin': '/reportsadmin/'
+    'reportsadmin': '/reportsadmin/',
+    'reports-timeseries': '/reports/timeseries/'
 }
 
 export const authApis = (token) => {
@@ -40,6 +48,19 @@ export const authApis = (token) => {
     });
 }
 
+// Các API danh sách đều được phân trang ({results, next}): đi theo link "next" để lấy đủ dữ liệu
+export const fetchAll = async (api, url, config = {}) => {
+    let results = [];
+    while (url) {
+        const res = await api.get(url, config);
+        if (!Array.isArray(res.data?.results))
+            return res.data;
+        results = results.concat(res.data.results);
+        url = res.data.next;
+    }
+    return results;
+}
+
 export default axios.create({
     baseURL: BASE_URL
 });
\ No newline at end of file
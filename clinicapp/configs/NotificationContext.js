@@ -1,11 +1,12 @@
-import React, { createContext, useContext, useEffect, useState } from "react";
+import React, { createContext, useContext, useEffect, useRef, useState } from "react";
 import AsyncStorage from "@react-native-async-storage/async-storage";
-import Apis, { endpoints } from "../configs/Apis";
+import Apis, { endpoints, WS_URL } from "../configs/Apis";
 
 const NotificationContext = createContext();
 
 export const NotificationProvider = ({ children }) => {
   const [count, setCount] = useState(0);
+  const socket = useRef(null);
 
   const loadNotificationCount = async () => {
     try {
@@ -19,8 +20,27 @@ export const NotificationProvider = ({ children }) => {
     }
   };
 
+  // Nhận thông báo mới qua WebSocket ngay khi được gửi để cập nhật số chưa đọc
+  const connectSocket = async () => {
+    const token = await AsyncStorage.getItem("token");
+    if (!token)
+      return;
+    const ws = new WebSocket(`${WS_URL}ws/notifications/`, null, {
+      headers: { 'Authorization': `Bearer ${token}` }
+    });
+    ws.onopen = () => loadNotificationCount();
+    ws.onmessage = () => setCount((c) => c + 1);
+    socket.current = ws;
+  };
+
   useEffect(() => {
     loadNotificationCount(); // tự gọi khi provider được mount
+    connectSocket();
+
+    return () => {
+      if (socket.current)
+        socket.current.close();
+    };
   }, []);
 
   return (
@@ -2,8 +2,8 @@ import { FlatList, StyleSheet, View, Text, TouchableOpacity, KeyboardAvoidingVie
 import { SafeAreaView } from "react-native-safe-area-context";
 import MessageBubble from "../../components/MessageBubble";
 import Header from "../../components/Header";
-import { useEffect, useState } from "react";
-import Apis, { authApis, endpoints } from "../../configs/Apis";
+import { useEffect, useRef, useState } from "react";
+import Apis, { authApis, endpoints, WS_URL } from "../../configs/Apis";
 import AsyncStorage from "@react-native-async-storage/async-storage";
 import { TextInput } from "react-native-paper";
 import { useRoute } from "@react-navigation/native";
@@ -15,16 +15,51 @@ const ChatScreen = () => {
   const [message, setMessage] = useState('');
   const [token, setToken] = useState("");
   const { selectedUser } = route.params;
+  // id tin nhắn mới nhất đã nhận, mỗi lần đồng bộ chỉ lấy các tin nhắn sau id này
+  const lastId = useRef(0);
+  const users = useRef({ [selectedUser.id]: selectedUser });
+  const syncing = useRef(false);
+  const socket = useRef(null);
+
+  // Thêm tin nhắn mới vào cuối danh sách, bỏ qua tin đã có (WebSocket và đồng bộ có thể trả về cùng một tin)
+  const appendMessages = (newMessages) => {
+    setMessages(prev => {
+      let ids = new Set(prev.map(m => m.id));
+      let added = newMessages.filter(m => !ids.has(m.id));
+      return added.length > 0 ? [...prev, ...added].sort((a, b) => a.id - b.id) : prev;
+    });
+  };
 
   const loadMessage = async () => {
+    // Tránh 2 lần đồng bộ chạy chồng lên nhau (gây trùng tin nhắn)
+    if (syncing.current) return;
+    syncing.current = true;
+    try {
+      await syncMessages();
+    } finally {
+      syncing.current = false;
+    }
+  };
+
+  const syncMessages = async () => {
     let token = await AsyncStorage.getItem("token");
     setToken(token);
     let user = await AsyncStorage.getItem("currentUser");
     user = JSON.parse(user);
     setCurrentUserId(user.id);
+    users.current[user.id] = user;
 
-    let res = await authApis(token).get(`${endpoints['messages']}?participant_id=${selectedUser.id}`);
-    setMessages(res.data);
+    let hasMore = true;
+    while (hasMore) {
+      let res = await authApis(token).get(
+        `${endpoints['messages-sync']}?participant_id=${selectedUser.id}&after_id=${lastId.current}`);
+      let newMessages = res.data.messages.map(m => ({ ...m, sender: users.current[m.sender] }));
+      if (newMessages.length > 0) {
+        lastId.current = Math.max(lastId.current, res.data.last_id);
+        appendMessages(newMessages);
+      }
+      hasMore = res.data.has_more;
+    }
   };
 
   const sendMessage = async () => {
@@ -38,16 +73,48 @@ const ChatScreen = () => {
       }
     });
     setMessage("");
-    loadMessage();
+    if (!isSocketOpen())
+      loadMessage();
+  };
+
+  const isSocketOpen = () => socket.current && socket.current.readyState === WebSocket.OPEN;
+
+  // Kết nối WebSocket để nhận tin nhắn mới ngay khi có, không cần tải lại định kỳ
+  const connectSocket = async () => {
+    let token = await AsyncStorage.getItem("token");
+    let user = JSON.parse(await AsyncStorage.getItem("currentUser"));
+    users.current[user.id] = user;
+    let ws = new WebSocket(`${WS_URL}ws/chat/${selectedUser.id}/`, null, {
+      headers: { 'Authorization': `Bearer ${token}` }
+    });
+    // Đồng bộ lại các tin nhắn có thể bị lỡ trong lúc mất kết nối
+    ws.onopen = () => loadMessage();
+    ws.onmessage = (e) => {
+      let m = JSON.parse(e.data);
+      appendMessages([{ ...m, sender: users.current[m.sender] }]);
+    };
+    socket.current = ws;
   };
 
   useEffect(() => {
     loadMessage();
+    connectSocket();
+    // Khi mất kết nối WebSocket: đồng bộ mỗi 3 giây và thử kết nối lại
     const interval = setInterval(() => {
-      loadMessage(); // tải lại mỗi 3 giây
+      if (!isSocketOpen()) {
+        loadMessage();
+        if (!socket.current || socket.current.readyState === WebSocket.CLOSED)
+          connectSocket();
+      }
     }, 3000);
 
-    return () => clearInterval(interval); // dọn dẹp khi unmount
+    return () => {
+      clearInterval(interval); // dọn dẹp khi unmount
+      if (socket.current) {
+        socket.current.onclose = null;
+        socket.current.close();
+      }
+    };
   }, []);
 
   return (
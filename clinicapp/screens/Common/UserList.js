@@ -3,7 +3,7 @@ import { SafeAreaView } from "react-native-safe-area-context";
 import Header from "../../components/Header";
 import { useEffect, useState } from "react";
 import AsyncStorage from "@react-native-async-storage/async-storage";
-import Apis, { endpoints } from "../../configs/Apis";
+import Apis, { endpoints, fetchAll } from "../../configs/Apis";
 import { useNavigation } from "@react-navigation/native";
 import { Image } from "react-native";
 
@@ -16,16 +16,16 @@ const UserList = () => {
 
     const loadUser = async () => {
         let currentUser = await AsyncStorage.getItem('currentUser');
-        let res;
+        let users;
         currentUser = JSON.parse(currentUser);
 
         if (currentUser.role === 'patient') {
-            res = await Apis.get(endpoints['user-doctors']);
+            users = await fetchAll(Apis, endpoints['user-doctors']);
         } else {
-            res = await Apis.get(endpoints['user-patients']);
+            users = await fetchAll(Apis, endpoints['user-patients']);
         }
-        setUser(res.data);
-        console.log(res.data);
+        setUser(users);
+        console.log(users);
     };
 
     useEffect(() => {
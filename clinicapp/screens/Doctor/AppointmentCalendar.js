@@ -3,7 +3,7 @@ import { View, FlatList, StyleSheet } from "react-native";
 import { Calendar } from "react-native-calendars";
 import { Text, Card } from "react-native-paper";
 import { SafeAreaView } from "react-native-safe-area-context";
-import { authApis, endpoints } from "../../configs/Apis";
+import { authApis, endpoints, fetchAll } from "../../configs/Apis";
 import AsyncStorage from "@react-native-async-storage/async-storage";
 import { MyUserContext } from "../../configs/MyContexts";
 import Header from "../../components/Header";
@@ -17,8 +17,8 @@ const AppointmentCalendar = () => {
     const loadAppointments = async () => {
         try {
             const token = await AsyncStorage.getItem("token");
-            const res = await authApis(token).get(endpoints["appointments"]);
-            setAppointments(res.data);
+            const appointments = await fetchAll(authApis(token), endpoints["appointments"]);
+            setAppointments(appointments);
         } catch (err) {
             console.error("Lỗi khi tải lịch khám:", err);
         }
@@ -5,7 +5,7 @@ import { SafeAreaView } from "react-native-safe-area-context";
 import { useNavigation, useFocusEffect } from "@react-navigation/native";
 import AsyncStorage from "@react-native-async-storage/async-storage";
 import { MyUserContext } from "../../configs/MyContexts";
-import { authApis, endpoints } from "../../configs/Apis";
+import { authApis, endpoints, fetchAll } from "../../configs/Apis";
 
 const statusList = [
     { label: "Chưa thanh toán", value: "unpaid" },
@@ -37,8 +37,8 @@ const DoctorAppointments = () => {
         try {
             if (isRefresh) setRefreshing(true);
             const token = await AsyncStorage.getItem("token");
-            const res = await authApis(token).get(endpoints["appointments"]);
-            setAppointments(res.data);
+            const appointments = await fetchAll(authApis(token), endpoints["appointments"]);
+            setAppointments(appointments);
         } catch (error) {
             console.error("Lỗi khi tải lịch khám của bác sĩ:", error);
         } finally {
@@ -2,7 +2,7 @@ import React, { useState, useEffect, useContext } from "react";
 import { View, Text, StyleSheet, ScrollView, TouchableOpacity } from "react-native";
 import { Button, Card, Icon, useTheme } from "react-native-paper";
 import { SafeAreaView } from "react-native-safe-area-context";
-import Apis, { authApis, endpoints } from "../../configs/Apis";
+import Apis, { authApis, endpoints, fetchAll } from "../../configs/Apis";
 import AsyncStorage from "@react-native-async-storage/async-storage";
 import { MyUserContext } from "../../configs/MyContexts";
 import { useNavigation } from "@react-navigation/native";
@@ -48,8 +48,7 @@ const DoctorHome = ({ navigation }) => {
     const loadTodayAppointmentsCount = async () => {
         try {
             const token = await AsyncStorage.getItem("token");
-            const res = await authApis(token).get(endpoints["appointments"]);
-            const appointments = res.data;
+            const appointments = await fetchAll(authApis(token), endpoints["appointments"]);
 
             const today = new Date();
             const count = appointments.filter(item => {
@@ -75,8 +74,7 @@ const DoctorHome = ({ navigation }) => {
     const loadPatientsExaminedmedicalResultsCreatedCount = async () => {
         try {
             const token = await AsyncStorage.getItem("token");
-            const res = await authApis(token).get(endpoints["appointments"]);
-            const appointments = res.data;
+            const appointments = await fetchAll(authApis(token), endpoints["appointments"]);
 
             const completedCount = appointments.filter(item => item.status === "completed").length;
             setStats(prev => ({
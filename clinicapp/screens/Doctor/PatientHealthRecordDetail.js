@@ -1,7 +1,7 @@
 import React, { useEffect, useState } from "react";
 import { View, Text, StyleSheet, TextInput, Button, Alert, ScrollView, SafeAreaView, RefreshControl } from "react-native";
 import AsyncStorage from "@react-native-async-storage/async-storage";
-import Apis, { endpoints } from "../../configs/Apis";
+import Apis, { endpoints, fetchAll } from "../../configs/Apis";
 import { useNavigation } from "@react-navigation/native";
 import TestResultCard from "../../components/TestResultCard";
 import he from "he";
@@ -21,12 +21,12 @@ const PatientHealthRecordDetail = ({ route }) => {
   const loadTestResults = async () => {
     try {
       const token = await AsyncStorage.getItem("token");
-      const res = await Apis.get(
+      const results = await fetchAll(Apis,
         `${endpoints["testresults"]}?health_record=${record.id}`,
         {
           headers: { Authorization: `Bearer ${token}` },
         });
-      setTestResults(res.data);
+      setTestResults(results);
     } catch (err) {
       console.error("Lỗi khi tải kết quả xét nghiệm:", err);
     }
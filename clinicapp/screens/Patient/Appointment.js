@@ -3,7 +3,7 @@ import { View, StyleSheet, FlatList } from "react-native";
 import { Button, Card, Chip, Text } from "react-native-paper";
 import { SafeAreaView } from "react-native-safe-area-context";
 import { MyDispatchContext, MyUserContext } from "../../configs/MyContexts";
-import { authApis, endpoints } from "../../configs/Apis";
+import { authApis, endpoints, fetchAll } from "../../configs/Apis";
 import AsyncStorage from "@react-native-async-storage/async-storage";
 import { useNavigation, useFocusEffect } from "@react-navigation/native";
 
@@ -38,13 +38,13 @@ const Appointment = () => {
             if (isRefresh) setRefreshing(true);
             const token = await AsyncStorage.getItem("token");
 
-            const [appointmentsRes, doctorsRes] = await Promise.all([
-                authApis(token).get(endpoints["appointments"]),
-                authApis(token).get(endpoints["doctors"]),
+            const [appointments, doctors] = await Promise.all([
+                fetchAll(authApis(token), endpoints["appointments"]),
+                fetchAll(authApis(token), endpoints["doctors"]),
             ]);
 
-            setAppointments(appointmentsRes.data);
-            setDoctors(doctorsRes.data);
+            setAppointments(appointments);
+            setDoctors(doctors);
         } catch (error) {
             console.error("Lỗi khi tải lịch khám hoặc bác sĩ:", error);
         } finally {
@@ -4,7 +4,7 @@ import { Text, Card, Button, TextInput } from "react-native-paper";
 import { Modal } from "react-native";
 import { useRoute, useNavigation } from "@react-navigation/native";
 import AsyncStorage from "@react-native-async-storage/async-storage";
-import Apis, { authApis, endpoints } from "../../configs/Apis";
+import Apis, { authApis, endpoints, fetchAll } from "../../configs/Apis";
 import Header from "../../components/Header"
 import DateTimePicker from '@react-native-community/datetimepicker';
 import { Platform } from 'react-native';
@@ -100,8 +100,8 @@ const AppointmentDetails = () => {
         const date = selectedDate.toISOString().split("T")[0];  // Format date: YYYY-MM-DD
         // Gọi API để lấy 
         let url = `${endpoints['schedules']}?date=${date}&doctor_id=${doctor.user.id}`;
-        let res = await Apis.get(url);
-        setSchedules(res.data);
+        let schedules = await fetchAll(Apis, url);
+        setSchedules(schedules);
 
     };
 
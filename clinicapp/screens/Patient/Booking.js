@@ -1,11 +1,11 @@
 import { SafeAreaView } from "react-native-safe-area-context";
 import Header from "../../components/Header";
 import { useNavigation, useRoute } from "@react-navigation/native";
-import { Button, Card, List, Modal, Portal, RadioButton, Text, TextInput } from "react-native-paper";
+import { Button, Card, Chip, List, Modal, Portal, RadioButton, Text, TextInput } from "react-native-paper";
 import { useEffect, useState } from "react";
-import { Alert, Platform, TouchableOpacity, View } from "react-native";
+import { Alert, Platform, ScrollView, TouchableOpacity, View } from "react-native";
 import DateTimePicker from "@react-native-community/datetimepicker";
-import Apis, { authApis, endpoints } from "../../configs/Apis";
+import Apis, { authApis, endpoints, fetchAll } from "../../configs/Apis";
 import AsyncStorage from "@react-native-async-storage/async-storage";
 import { Picker } from "@react-native-picker/picker";
 
@@ -27,6 +27,7 @@ const Booking = () => {
     const [selectedDisease, setSelectedDisease] = useState(null);
     const [symptoms, setSymptoms] = useState("");
     const [appointmentId, setAppointmentId] = useState("");
+    const [availableDays, setAvailableDays] = useState([]);
 
 
     const diseaseType = [
@@ -53,10 +54,20 @@ const Booking = () => {
         const date = formatDate(selectedDate);   // Format date: YYYY-MM-DD
         // Gọi API để lấy 
         let url = `${endpoints['schedules']}?date=${date}&doctor_id=${doctor.user.id}`;
-        let res = await Apis.get(url);
+        let schedules = await fetchAll(Apis, url);
         console.log("-------------", url);
-        console.log(res.data);
-        setSchedules(res.data);
+        console.log(schedules);
+        setSchedules(schedules);
+    };
+
+    // Lấy các ngày còn chỗ trống của bác sĩ trong 30 ngày tới (một lần gọi API)
+    const loadAvailability = async () => {
+        try {
+            let res = await Apis.get(`${endpoints['availability']}?doctor_id=${doctor.user.id}&days=30`);
+            setAvailableDays(res.data.doctors.length > 0 ? res.data.doctors[0].days : []);
+        } catch (error) {
+            console.error("Lỗi khi tải lịch trống:", error);
+        }
     };
 
     const loadHealthRecord = async () => {
@@ -115,6 +126,7 @@ const Booking = () => {
 
     useEffect(() => {
         loadHealthRecord();
+        loadAvailability();
     }, []);
 
     return (
@@ -146,6 +158,17 @@ const Booking = () => {
                 onPress={() => setShowDatePicker(true)}
             />
 
+            {/* Các ngày còn trống */}
+            <ScrollView horizontal showsHorizontalScrollIndicator={false} style={{ paddingHorizontal: 16, marginBottom: 8 }}>
+                {availableDays.map(day => (
+                    <Chip key={day.date} style={{ marginRight: 8 }}
+                        selected={formatDate(selectedDate) === day.date}
+                        onPress={() => setSelectedDate(new Date(`${day.date}T00:00:00`))}>
+                        {`${day.date.slice(8, 10)}/${day.date.slice(5, 7)} (${day.free_slots})`}
+                    </Chip>
+                ))}
+            </ScrollView>
+
             {showDatePicker && (
                 <DateTimePicker
                     value={selectedDate}
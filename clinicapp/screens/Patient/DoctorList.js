@@ -1,7 +1,7 @@
 import { useEffect, useState, useCallback } from "react";
 import { FlatList, Image, StyleSheet, Text, View, TouchableOpacity } from "react-native";
 import { SafeAreaView } from "react-native-safe-area-context";
-import Apis, { endpoints } from "../../configs/Apis";
+import Apis, { endpoints, fetchAll } from "../../configs/Apis";
 import { Button, Card, Searchbar, List, Icon } from "react-native-paper";
 import { useNavigation } from "@react-navigation/native";
 import Header from "../../components/Header";
@@ -14,14 +14,16 @@ const DoctorList = () => {
   const [selectedHospital, setSelectedHospital] = useState(null);
   const [specializations, setSpecializations] = useState([]);
   const [name, setName] = useState("");
+  const [keyword, setKeyword] = useState("");
+  const [suggestions, setSuggestions] = useState([]);
   const [selectedSpecialization, setSelectedSpecialization] = useState(null);
   const [expandedHospital, setExpandedHospital] = useState(false);
   const [expandedSpecialization, setExpandedSpecialization] = useState(false);
 
   const loadHospital = async () => {
     try {
-      let res = await Apis.get(endpoints["hospitals"]);
-      setHospital(res.data);
+      let hospitals = await fetchAll(Apis, endpoints["hospitals"]);
+      setHospital(hospitals);
     } catch (err) {
       console.error(err);
     }
@@ -34,8 +36,8 @@ const DoctorList = () => {
       if (specializationId) url += `specialization=${specializationId}&`;
       if (name) url += `name=${encodeURIComponent(name)}&`;
 
-      const res = await Apis.get(url);
-      setDoctor(res.data);
+      const doctors = await fetchAll(Apis, url);
+      setDoctor(doctors);
     } catch (err) {
       console.error(err);
     }
@@ -43,8 +45,8 @@ const DoctorList = () => {
 
   const loadSpecializations = async () => {
     try {
-      let res = await Apis.get(endpoints["specializations"]);
-      setSpecializations(res.data);
+      let specializations = await fetchAll(Apis, endpoints["specializations"]);
+      setSpecializations(specializations);
     } catch (err) {
       console.error(err);
     }
@@ -64,6 +66,62 @@ const DoctorList = () => {
     return () => clearTimeout(timer);
   }, [selectedHospital, selectedSpecialization, name]);
 
+  // Gợi ý khi đang gõ (API /autocomplete/ đọc từ bộ nhớ server), danh sách bác sĩ chỉ tải lại khi chọn gợi ý hoặc bấm tìm
+  useEffect(() => {
+    if (!keyword.trim()) {
+      setSuggestions([]);
+      return;
+    }
+
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const res = await Apis.get(endpoints["autocomplete"], { params: { q: keyword } });
+        if (!cancelled)
+          setSuggestions(res.data.results);
+      } catch (err) {
+        console.error(err);
+      }
+    }, 150);
+
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [keyword]);
+
+  const search = () => {
+    setSuggestions([]);
+    setName(keyword.trim());
+  };
+
+  const selectSuggestion = (item) => {
+    setSuggestions([]);
+    if (item.type === "doctor") {
+      setKeyword(item.name);
+      setName(item.name);
+    } else {
+      setKeyword("");
+      setName("");
+      if (item.type === "hospital")
+        setSelectedHospital(item.id);
+      else
+        setSelectedSpecialization(item.id);
+    }
+  };
+
+  const clearSearch = () => {
+    setKeyword("");
+    setSuggestions([]);
+    setName("");
+  };
+
+  const suggestionIcons = {
+    doctor: "doctor",
+    hospital: "hospital-building",
+    specialization: "stethoscope",
+  };
+
   const renderDoctor = useCallback((dr) => (
     <Card style={styles.cards} key={dr.id}>
 
@@ -160,10 +218,27 @@ const DoctorList = () => {
 
       <Searchbar
         style={[styles.search, { textDecorationColor: 'black' }]}
-        placeholder="Nhập tên bác sĩ cần tìm..."
-        onChangeText={(value) => setName(value)}
+        placeholder="Nhập tên bác sĩ, cơ sở y tế, chuyên khoa..."
+        value={keyword}
+        onChangeText={setKeyword}
+        onSubmitEditing={search}
+        onIconPress={search}
+        onClearIconPress={clearSearch}
       />
 
+      {suggestions.length > 0 && (
+        <View style={styles.suggestions}>
+          {suggestions.map(item => (
+            <List.Item
+              key={`${item.type}-${item.id}`}
+              title={item.name}
+              left={props => <List.Icon {...props} icon={suggestionIcons[item.type]} />}
+              onPress={() => selectSuggestion(item)}
+            />
+          ))}
+        </View>
+      )}
+
       <FlatList
         data={doctor}
         renderItem={({ item }) => renderDoctor(item)}
@@ -216,6 +291,11 @@ const styles = StyleSheet.create({
     marginBottom: 10,
     backgroundColor: "#17A2F3",
   },
+  suggestions: {
+    marginBottom: 10,
+    backgroundColor: "#f0f0f0",
+    borderRadius: 10,
+  },
   accordion: {
     backgroundColor: "#f0f0f0",
     borderRadius: 10,
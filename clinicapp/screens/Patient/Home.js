@@ -2,7 +2,7 @@ import { useEffect, useState } from "react";
 import { FlatList, Image, TouchableOpacity, View, StyleSheet, Dimensions, ScrollView, StatusBar } from "react-native";
 import { Button, Card, List, Text } from "react-native-paper";
 import { SafeAreaView } from "react-native-safe-area-context";
-import Apis, { endpoints } from "../../configs/Apis";
+import Apis, { endpoints, fetchAll } from "../../configs/Apis";
 import Carousel from 'react-native-reanimated-carousel';
 import MyStyles from "../../styles/MyStyles";
 import { useNavigation } from "@react-navigation/native";
@@ -42,14 +42,14 @@ const Home = () => {
 
 
   const loadSpecialization = async () => {
-    let res = await Apis.get(endpoints['specializations']);
-    setSpecialization(res.data);
+    let specializations = await fetchAll(Apis, endpoints['specializations']);
+    setSpecialization(specializations);
   };
 
   const loadingHospital = async () => {
     try {
-      const res = await Apis.get(endpoints['hospitals']);
-      setHospital(res.data);
+      const hospitals = await fetchAll(Apis, endpoints['hospitals']);
+      setHospital(hospitals);
     } catch (err) {
       console.error("Failed to load hospitals:", err);
     }
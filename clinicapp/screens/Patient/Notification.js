@@ -3,7 +3,8 @@ import { View, StyleSheet, FlatList, Platform, StatusBar, Image } from "react-na
 import { Card, Text } from "react-native-paper";
 import { SafeAreaView } from "react-native-safe-area-context";
 import { MyDispatchContext, MyUserContext } from "../../configs/MyContexts";
-import Apis, { endpoints } from "../../configs/Apis";
+import AsyncStorage from "@react-native-async-storage/async-storage";
+import { authApis, endpoints } from "../../configs/Apis";
 import { useNotification } from "../../configs/NotificationContext";
 import RenderHTML from "react-native-render-html";
 
@@ -11,16 +12,22 @@ const Notification = () => {
     const [notifications, setNotifications] = useState([]);
     const [loading, setLoading] = useState(true);
     const [refreshing, setRefreshing] = useState(false);
+    const [next, setNext] = useState(null);
     const { setCount } = useNotification();
 
+    // Hộp thư phân trang theo cursor: mở màn hình chỉ tải trang đầu, cuộn xuống cuối mới tải tiếp
     const loadNotification = async (isRefresh = false) => {
         try {
             if (isRefresh) setRefreshing(true);
             else setLoading(true);
 
-            const res = await Apis.get(endpoints["notifications"]);
-            setNotifications(res.data);
-            setCount(res.data.length);
+            const token = await AsyncStorage.getItem("token");
+            const res = await authApis(token).get(endpoints["notifications-inbox"]);
+            setNotifications(res.data.results);
+            setNext(res.data.next);
+
+            await authApis(token).post(endpoints["notifications-mark-all-read"]);
+            setCount(0);
         } catch (err) {
             console.error("Lỗi khi load thông báo: ", err);
         } finally {
@@ -29,6 +36,18 @@ const Notification = () => {
         }
     };
 
+    const loadMore = async () => {
+        if (!next || loading) return;
+        try {
+            const token = await AsyncStorage.getItem("token");
+            const res = await authApis(token).get(next);
+            setNotifications(current => [...current, ...res.data.results]);
+            setNext(res.data.next);
+        } catch (err) {
+            console.error("Lỗi khi load thông báo: ", err);
+        }
+    };
+
 
     useEffect(() => {
         loadNotification();
@@ -66,6 +85,7 @@ const Notification = () => {
                 renderItem={renderItem}
                 refreshing={refreshing} // <-- hiệu ứng vòng quay
                 onRefresh={() => loadNotification(true)} // <-- gọi lại API
+                onEndReached={loadMore}
                 ListEmptyComponent={<Text>Không có thông báo nào.</Text>}
             />
 
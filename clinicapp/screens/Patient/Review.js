@@ -2,7 +2,7 @@ import React, { useEffect, useState } from "react";
 import { View, Text, StyleSheet, TextInput, Alert, Image, ScrollView } from "react-native";
 import { Button, Card } from "react-native-paper";
 import { useRoute } from "@react-navigation/native";
-import Apis, { authApis, endpoints } from "../../configs/Apis";
+import Apis, { authApis, endpoints, fetchAll } from "../../configs/Apis";
 import StarRating from "react-native-star-rating-widget";
 import { SafeAreaView } from "react-native-safe-area-context";
 import Header from "../../components/Header";
@@ -21,9 +21,9 @@ const Review = () => {
         let token = await AsyncStorage.getItem('token');
         setToken(token);
         let url = `${endpoints['reviews']}?doctor=${doctor.user.id}`
-        let res = await Apis.get(url);
+        let reviews = await fetchAll(Apis, url);
         console.info('----TB---', typeof (doctor.average_rating));
-        setReviews(res.data);
+        setReviews(reviews);
     }
 
     const submitReview = async () => {
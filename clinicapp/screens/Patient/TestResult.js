@@ -1,7 +1,7 @@
 import React, { useEffect, useState } from "react";
 import { View, FlatList, Text, StyleSheet, RefreshControl } from "react-native";
 import AsyncStorage from "@react-native-async-storage/async-storage";
-import Apis, { endpoints } from "../../configs/Apis";
+import Apis, { endpoints, fetchAll } from "../../configs/Apis";
 import TestResultCard from "../../components/TestResultCard";
 import Header from "../../components/Header";
 import he from "he";
@@ -20,10 +20,10 @@ const TestResult = ({ route }) => {
   const loadTestResults = async () => {
     try {
       const token = await AsyncStorage.getItem("token");
-      const res = await Apis.get(`${endpoints.testresults}?health_record=${healthRecordId}`, {
+      const results = await fetchAll(Apis, `${endpoints.testresults}?health_record=${healthRecordId}`, {
         headers: { Authorization: `Bearer ${token}` },
       });
-      setResults(res.data);
+      setResults(results);
     } catch (error) {
       console.error("Lỗi khi tải kết quả xét nghiệm:", error);
     }
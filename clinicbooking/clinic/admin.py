@@ -1,5 +1,10 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.http import HttpResponseRedirect
 from django.utils import timezone
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.db.models import Count, Sum
 from django.template.response import TemplateResponse
 from django.urls import path
@@ -7,16 +12,32 @@ from django.utils.timezone import now, localtime
 
 from clinic.models import (User, Doctor, HealthRecord, Schedule,
                            Appointment, Review, Message,
-                           Payment, TestResult, Notification, Hospital, Specialization, PasswordResetOTP)
+                           Payment, TestResult, Notification, Hospital, Specialization, PasswordResetOTP,
+                           DoctorRatingStats, EmailOutbox, MediaUpload, DoctorAvailability, ScheduleTemplate,
+                           DoctorDailyReport, StatsSnapshot)
+from clinic import booking, scheduling, overlaps, reports, serializers, notifications, media
+from clinic.ratings import get_rating_stats
 from oauth2_provider.models import Application, AccessToken
 from django.utils.html import mark_safe
 from ckeditor_uploader.widgets import CKEditorUploadingWidget
 from django import forms
+from rest_framework.exceptions import ValidationError
 
 
 class MyAppointmentAdmin(admin.ModelAdmin):
     list_display = ['id', 'healthrecord', 'schedule', 'disease_type', 'amount', 'status', 'cancel']
 
+    # Lịch hẹn sửa trực tiếp trên trang admin không đi qua clinic/booking.py nên cần đếm lại sum_booking
+    def save_model(self, request, obj, form, change):
+        old_schedule_id = form.initial.get('schedule')
+        obj.active_booking = None if obj.cancel else True
+        super().save_model(request, obj, form, change)
+        booking.sync_booking_counts({obj.schedule_id, old_schedule_id} - {None})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        booking.sync_booking_counts([obj.schedule_id])
+
     def amount(self, appointment):
         amount = appointment.schedule.doctor.doctor.consultation_fee
         return f"{amount:,.0f} ₫"
@@ -28,9 +49,11 @@ class AppointmentInline(admin.StackedInline):
 
 
 class MyDoctorAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'doctor_fullname', 'license_number', 'hospital_name', 'specialization', 'active']
+    list_display = ['id', 'user', 'doctor_fullname', 'license_number', 'hospital_name', 'specialization',
+                    'average_rating', 'active']
     search_fields = ['id', 'doctor_fullname', 'license_number']
     list_filter = ['hospital', 'specialization']
+    list_select_related = ['user__rating_stats', 'hospital', 'specialization']
     readonly_fields = ['license_image_view']
 
     # Lọc user có role là doctor
@@ -45,9 +68,15 @@ class MyDoctorAdmin(admin.ModelAdmin):
     def hospital_name(self, hospital):
         return hospital.hospital.name
 
+    def average_rating(self, doctor):
+        stats = get_rating_stats(doctor.user)
+        return f"{stats.average_rating}⭐ ({stats.review_count})" if stats else "Chưa có đánh giá"
+
+    average_rating.short_description = "Đánh giá"
+
     def license_image_view(self, doctorinfo):
         if doctorinfo.license_image:
-            return mark_safe(f"<img src='{doctorinfo.license_image.url}' width=250 />")
+            return mark_safe(f"<img src='{media.image_url(doctorinfo.license_image, 'card')}' width=250 />")
         return "Không có ảnh đại diện"
 
     # avatar_view.short_description = "Ảnh đại diện"
@@ -98,7 +127,7 @@ class MyUserAdmin(admin.ModelAdmin):
 
     def avatar_view(self, user):
         if user.avatar:
-            return mark_safe(f"<img src='{user.avatar.url}' width=200 />")
+            return mark_safe(f"<img src='{media.image_url(user.avatar, 'card')}' width=200 />")
         return "Không có ảnh đại diện"
 
     avatar_view.short_description = "Ảnh đại diện"
@@ -112,7 +141,25 @@ class MyUserAdmin(admin.ModelAdmin):
             super().save_model(request, user, form, change)
 
 
+class ScheduleForm(forms.ModelForm):
+    class Meta:
+        model = Schedule
+        fields = '__all__'
+
+    def clean(self):
+        data = super().clean()
+        doctor, day = data.get('doctor'), data.get('date')
+        start_time, end_time = data.get('start_time'), data.get('end_time')
+        if doctor and day and start_time and end_time:
+            try:
+                overlaps.check_schedule(doctor.pk, day, start_time, end_time, exclude_id=self.instance.pk)
+            except ValidationError as ex:
+                raise forms.ValidationError(ex.detail)
+        return data
+
+
 class MyScheduleAdmin(admin.ModelAdmin):
+    form = ScheduleForm
     list_display = ['id', 'doctor_id', 'doctor_name', 'date', 'start_time', 'end_time', 'capacity', 'sum_booking',
                     'active']
     list_filter = ['doctor__full_name']
@@ -127,6 +174,29 @@ class MyScheduleAdmin(admin.ModelAdmin):
     def doctor_name(self, doctor):
         return doctor.doctor.full_name
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        booking.sync_booking_counts([form.instance.pk])
+
+
+class ScheduleTemplateAdmin(admin.ModelAdmin):
+    list_display = ['id', 'doctor', 'weekday', 'start_time', 'end_time', 'slot_minutes', 'capacity', 'active']
+    list_filter = ['weekday', 'active']
+    list_select_related = ['doctor']
+    actions = ['generate_four_weeks']
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "doctor":
+            kwargs["queryset"] = User.objects.filter(role="doctor", doctor__isnull=False)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    @admin.action(description="Sinh lịch khám 4 tuần tới từ các lịch mẫu đã chọn")
+    def generate_four_weeks(self, request, queryset):
+        start = timezone.localdate() + timedelta(days=1)
+        created, skipped = scheduling.generate_schedules(queryset.filter(active=True), start,
+                                                         start + timedelta(days=27))
+        self.message_user(request, f"Đã tạo {created} lịch khám, bỏ qua {skipped} lượt trùng giờ.")
+
 
 class MyPaymentAdmin(admin.ModelAdmin):
     list_display = ['id', 'appointment_id', 'schedule', 'health_record', 'amount', 'method', 'status', 'created_date',
@@ -148,7 +218,7 @@ class MyTestResultAdmin(admin.ModelAdmin):
 
     def image_view(self, test_result):
         if test_result.image:
-            return mark_safe(f"<img src='{test_result.image.url}' width=200 />")
+            return mark_safe(f"<img src='{media.image_url(test_result.image, 'card')}' width=200 />")
         return "Không có ảnh đại diện"
 
     image_view.short_description = "Ảnh đại diện"
@@ -173,7 +243,16 @@ class MyMessageAdmin(admin.ModelAdmin):
 
 class MyNotificationAdmin(admin.ModelAdmin):
     forms = NotificationForm
-    list_display = ['id', 'title', 'content', 'send_at', 'created_date', 'updated_date']
+    list_display = ['id', 'title', 'type', 'send_at', 'published_at', 'delivered_count', 'emailed_count',
+                    'pushed_count', 'failed_count', 'dispatch_ms']
+    readonly_fields = ['published_at', 'delivered_count', 'emailed_count', 'pushed_count', 'failed_count',
+                       'dispatch_ms']
+    actions = ['publish_now']
+
+    @admin.action(description="Gửi ngay các thông báo đã chọn")
+    def publish_now(self, request, queryset):
+        delivered = sum(notifications.publish(notification) for notification in queryset)
+        self.message_user(request, f"Đã gửi thông báo tới {delivered} người nhận.")
 
 
 class ReviewAdmin(admin.ModelAdmin):
@@ -182,6 +261,67 @@ class ReviewAdmin(admin.ModelAdmin):
     list_filter = ['doctor']
 
 
+class DoctorRatingStatsAdmin(admin.ModelAdmin):
+    list_display = ['doctor', 'review_count', 'average_rating', 'star_1', 'star_2', 'star_3', 'star_4', 'star_5',
+                    'last_review_at']
+    list_select_related = ['doctor']
+    readonly_fields = ['doctor', 'review_count', 'rating_sum', 'star_1', 'star_2', 'star_3', 'star_4', 'star_5',
+                       'last_review_at']
+
+
+class DoctorAvailabilityAdmin(admin.ModelAdmin):
+    list_display = ['doctor', 'date', 'free_slots', 'slot_count', 'free_capacity', 'capacity', 'updated_date']
+    list_filter = ['date']
+    list_select_related = ['doctor']
+    readonly_fields = ['doctor', 'date', 'free_slots', 'slot_count', 'free_capacity', 'capacity']
+
+
+class DoctorDailyReportAdmin(admin.ModelAdmin):
+    list_display = ['doctor', 'date', 'booked', 'completed', 'paid', 'cancelled', 'revenue', 'paid_amount',
+                    'updated_date']
+    list_filter = ['date']
+    list_select_related = ['doctor']
+    readonly_fields = ['doctor', 'date', 'booked', 'completed', 'paid', 'cancelled', 'revenue', 'paid_amount',
+                       'disease_counts']
+
+
+class StatsSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['id', 'start', 'end', 'granularity', 'computed_at', 'duration_ms']
+    readonly_fields = ['start', 'end', 'granularity', 'data', 'computed_at', 'duration_ms']
+    actions = ['refresh']
+
+    @admin.action(description="Tính lại số liệu thống kê đã chọn")
+    def refresh(self, request, queryset):
+        for snapshot in queryset:
+            snapshot = reports.refresh_snapshot(snapshot.start, snapshot.end, snapshot.granularity)
+            self.message_user(request, f"{snapshot}: {snapshot.duration_ms} ms")
+
+
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['id', 'subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_date']
+    list_filter = ['status']
+    # Không hiển thị nội dung email (có thể chứa mã OTP đặt lại mật khẩu)
+    exclude = ['body', 'html_body']
+    actions = ['retry']
+
+    @admin.action(description="Gửi lại các email đã chọn")
+    def retry(self, request, queryset):
+        queryset.exclude(status=EmailOutbox.Status.SENT).update(status=EmailOutbox.Status.PENDING, attempts=0,
+                                                                next_attempt_at=timezone.now())
+
+
+class MediaUploadAdmin(admin.ModelAdmin):
+    list_display = ['id', 'model', 'object_id', 'field', 'status', 'attempts', 'original_bytes', 'stored_bytes',
+                    'next_attempt_at', 'uploaded_at', 'created_date']
+    list_filter = ['status', 'model']
+    actions = ['retry']
+
+    @admin.action(description="Tải lên lại các file đã chọn")
+    def retry(self, request, queryset):
+        queryset.exclude(status=MediaUpload.Status.UPLOADED).update(status=MediaUpload.Status.PENDING, attempts=0,
+                                                                    next_attempt_at=timezone.now())
+
+
 class MonthYearForm(forms.Form):
     year = forms.IntegerField(
         label='Năm',
@@ -214,22 +354,42 @@ class ClinicAdminSite(admin.AdminSite):
         return super().index(request, extra_context=extra_context)
 
     def get_urls(self):
-        return [path('clinics-stats/', self.clinic_stats_view)] + super().get_urls()
+        return [path('clinics-stats/', self.admin_view(self.clinic_stats_view))] + super().get_urls()
 
     def clinic_stats_view(self, request):
-        stats = Appointment.objects.values('disease_type').annotate(appointment_count=Count('id'))
-
-        # Tổng số lượt khám
-        total_appointments = Appointment.objects.count()
-
-        # Doanh thu: trong Payment
-        total_revenue = Payment.objects.aggregate(total=Sum('amount'))['total'] or 0
-        total_revenue = f"{total_revenue:,.0f}"
+        # Dùng chung tham số với API /reports/timeseries/, số liệu đọc từ bản tính sẵn (StatsSnapshot)
+        params = serializers.ReportQuerySerializer(data=request.GET)
+        if not params.is_valid():
+            messages.error(request, ' '.join(str(error) for errors in params.errors.values() for error in errors))
+            params = serializers.ReportQuerySerializer(data={})
+            params.is_valid()
+        data = params.validated_data
+
+        if request.method == 'POST':
+            snapshot = reports.get_snapshot(data['start'], data['end'], data['granularity'], refresh=True)
+            messages.success(request, f"Đã tính lại số liệu trong {snapshot.duration_ms} ms.")
+            return HttpResponseRedirect(request.get_full_path())
+
+        snapshot = reports.get_snapshot(data['start'], data['end'], data['granularity'])
+        stats = snapshot.data
+        series = stats['series']
 
         return TemplateResponse(request, 'admin/stats.html', {
-            'stats': stats,
-            'total_appointments': total_appointments,
-            'total_revenue': total_revenue,
+            **self.each_context(request),
+            'params': data,
+            'granularities': reports.GRANULARITIES,
+            'snapshot': snapshot,
+            'max_age_minutes': settings.ADMIN_STATS_MAX_AGE // 60,
+            'stats': stats['top_diseases'],
+            'hospitals': stats['hospitals'],
+            'specializations': stats['specializations'],
+            'chart': {
+                'labels': [row['period'] for row in series],
+                'appointments': [row['completed'] for row in series],
+                'revenue': [float(row['paid_amount']) for row in series],
+            },
+            'total_appointments': stats['total_appointments'],
+            'total_revenue': f"{Decimal(stats['total_revenue']):,.0f}",
         })
 
 
@@ -239,10 +399,17 @@ admin_site.register(User, MyUserAdmin)
 admin_site.register(Doctor, MyDoctorAdmin)
 admin_site.register(HealthRecord, MyHealthRecordAdmin)
 admin_site.register(Schedule, MyScheduleAdmin)
+admin_site.register(ScheduleTemplate, ScheduleTemplateAdmin)
 admin_site.register(TestResult, MyTestResultAdmin)
 admin_site.register(Message, MyMessageAdmin)
 admin_site.register(Appointment, MyAppointmentAdmin)
 admin_site.register(Review, ReviewAdmin)
+admin_site.register(DoctorRatingStats, DoctorRatingStatsAdmin)
+admin_site.register(EmailOutbox, EmailOutboxAdmin)
+admin_site.register(MediaUpload, MediaUploadAdmin)
+admin_site.register(DoctorAvailability, DoctorAvailabilityAdmin)
+admin_site.register(DoctorDailyReport, DoctorDailyReportAdmin)
+admin_site.register(StatsSnapshot, StatsSnapshotAdmin)
 admin_site.register(Payment, MyPaymentAdmin)
 admin_site.register(Notification, MyNotificationAdmin)
 admin_site.register(Hospital, MyHospitalAdmin)
@@ -6,4 +6,5 @@ class ClinicConfig(AppConfig):
     name = 'clinic'
 
     def ready(self):
+        import clinic.checks
         import clinic.signals
\ No newline at end of file
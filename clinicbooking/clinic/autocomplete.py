@@ -0,0 +1,226 @@
+import heapq
+import logging
+import pickle
+import threading
+import zlib
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from clinic import caching, search
+from clinic.models import SearchEntry
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = 'autocomplete:snapshot'
+CHANGE_KEY = 'autocomplete:change:{}'
+# Tiền tố khớp nhiều hơn MEMO_THRESHOLD khoá (vd: 'ng') thì ghi nhớ kết quả cho tới khi có mục liên quan thay đổi
+MEMO_THRESHOLD = 1000
+MEMO_SIZE = 5000
+# Mỗi tiền tố giữ sẵn tối đa MAX_LIMIT gợi ý
+MAX_LIMIT = 50
+# Ký tự lớn hơn mọi ký tự của tên đã chuẩn hoá (a-z, 0-9, khoảng trắng), dùng làm cận trên khi bisect
+KEY_END = '~'
+
+FIELDS = ('kind', 'object_id', 'name', 'normalized', 'popularity', 'rating')
+
+
+def _keys(normalized):
+    # Mỗi vị trí bắt đầu một từ là một khoá: 'nguyen van an' -> 'nguyen van an', 'van an', 'an'
+    words = normalized.split()
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class PrefixIndex:
+    """
+    Cây gợi ý dạng mảng đã sắp xếp (key, kind, object_id): tìm các khoá bắt đầu bằng tiền tố bằng bisect,
+    gõ họ, tên đệm hay tên đều ra gợi ý. Không sửa tại chỗ, mỗi lần thay đổi tạo index mới rồi thay thế
+    nên các request đang đọc không bị ảnh hưởng.
+    """
+
+    def __init__(self, items, keys=None, memo=None):
+        self.items = items
+        self.keys = keys if keys is not None else sorted(
+            (key, kind, object_id) for (kind, object_id), row in items.items() for key in _keys(row[3]))
+        self._memo = memo or {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls({(row[0], row[1]): tuple(row) for row in rows})
+
+    def updated(self, rows, targets):
+        """
+        :param rows: Các dòng SearchEntry mới của các mục thay đổi (mục đã xoá không có dòng)
+        :param targets: Tất cả các (kind, object_id) thay đổi
+        :return: PrefixIndex mới
+        """
+        items, keys = dict(self.items), list(self.keys)
+        changed_keys = set()
+        for target in targets:
+            old = items.pop(target, None)
+            for key in _keys(old[3]) if old else ():
+                del keys[bisect_left(keys, (key, *target))]
+                changed_keys.add(key)
+        for row in rows:
+            target = (row[0], row[1])
+            items[target] = tuple(row)
+            for key in _keys(row[3]):
+                insort(keys, (key, *target))
+                changed_keys.add(key)
+        # Giữ lại kết quả đã ghi nhớ của các tiền tố không liên quan tới mục thay đổi
+        memo = {memo_key: top for memo_key, top in self._memo.items()
+                if not any(key.startswith(memo_key[0]) for key in changed_keys)}
+        return PrefixIndex(items, keys, memo)
+
+    def _top(self, prefix, kinds):
+        memo_key = (prefix, kinds)
+        if memo_key in self._memo:
+            return self._memo[memo_key]
+
+        start = bisect_left(self.keys, (prefix,))
+        end = bisect_left(self.keys, (prefix + KEY_END,))
+        # Tên bắt đầu bằng tiền tố xếp trước tên chỉ có một từ ở giữa bắt đầu bằng tiền tố
+        matched = {}
+        for key, kind, object_id in self.keys[start:end]:
+            if kinds and kind not in kinds:
+                continue
+            row = self.items[(kind, object_id)]
+            matched[(kind, object_id)] = matched.get((kind, object_id)) or key == row[3]
+        top = heapq.nsmallest(MAX_LIMIT, matched.items(), key=lambda match: (
+            not match[1], -self.items[match[0]][4], -self.items[match[0]][5], self.items[match[0]][2]))
+        top = [self.items[target] for target, _ in top]
+
+        if end - start > MEMO_THRESHOLD:
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[memo_key] = top
+        return top
+
+    def suggest(self, text, kinds=None, limit=None):
+        prefix = search.normalize(text)
+        if not prefix:
+            return []
+        # Giữ khoảng trắng cuối: 'nguyen ' chỉ gợi ý tên có từ 'nguyen' trọn vẹn
+        if text[-1:].isspace():
+            prefix += ' '
+        rows = self._top(prefix, tuple(sorted(kinds)) if kinds else None)
+        return [{'type': row[0], 'id': row[1], 'name': row[2]} for row in rows[:limit or settings.AUTOCOMPLETE_LIMIT]]
+
+
+_state = {'index': None, 'version': None}
+_lock = threading.Lock()
+
+
+def _encode(index):
+    # Lưu cả mảng khoá đã sắp xếp để tiến trình mới không phải sắp xếp lại
+    return zlib.compress(pickle.dumps((list(index.items.values()), index.keys), pickle.HIGHEST_PROTOCOL))
+
+
+def _decode(data):
+    rows, keys = pickle.loads(zlib.decompress(data))
+    return PrefixIndex({(row[0], row[1]): row for row in rows}, keys)
+
+
+def _pending(since, version):
+    """
+    Các mục thay đổi sau phiên bản since (đọc từ cache)
+    :return: tập (kind, object_id) hoặc None nếu không còn đủ nhật ký thay đổi
+    """
+    if version - since > settings.AUTOCOMPLETE_MAX_PENDING_CHANGES or version < since:
+        return None
+    keys = [CHANGE_KEY.format(number) for number in range(since + 1, version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return None
+    return {tuple(target) for targets in changes.values() for target in targets}
+
+
+def _rows(targets):
+    condition = Q()
+    for kind, object_id in targets:
+        condition |= Q(kind=kind, object_id=object_id)
+    return list(SearchEntry.objects.filter(condition).values_list(*FIELDS)) if targets else []
+
+
+def _load(version):
+    # Tải từ snapshot trong cache rồi áp dụng các thay đổi sau snapshot,
+    # snapshot quá cũ (hoặc chưa có) thì đọc lại SearchEntry và lưu snapshot mới cho các tiến trình khác
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is not None:
+        targets = _pending(snapshot['version'], version)
+        if targets is not None:
+            return _decode(snapshot['data']).updated(_rows(targets), targets)
+
+    index = PrefixIndex.from_rows(SearchEntry.objects.values_list(*FIELDS))
+    cache.set(SNAPSHOT_KEY, {'version': version, 'data': _encode(index)}, timeout=None)
+    return index
+
+
+def get_index():
+    """
+    Cây gợi ý của tiến trình. Mỗi lần gọi chỉ đọc số phiên bản trong cache; có thay đổi thì chỉ đọc lại
+    các mục thay đổi, không đọc database.
+    :return: PrefixIndex
+    """
+    version = caching.get_version(caching.AUTOCOMPLETE)
+    if _state['version'] == version:
+        return _state['index']
+
+    with _lock:
+        if _state['version'] != version:
+            targets = _pending(_state['version'], version) if _state['index'] is not None else None
+            if targets is None:
+                _state['index'] = _load(version)
+            else:
+                _state['index'] = _state['index'].updated(_rows(targets), targets)
+            _state['version'] = version
+    return _state['index']
+
+
+def suggest(text, kinds=None, limit=None):
+    """
+    Gợi ý tên bác sĩ, bệnh viện, chuyên khoa bắt đầu bằng chuỗi đang gõ (không phân biệt dấu),
+    xếp theo số lượt đặt khám rồi số sao
+    :param text: Chuỗi đang gõ, vd: 'nguyen v'
+    :param kinds: Danh sách loại cần gợi ý, mặc định cả 3 loại
+    :param limit: Số gợi ý tối đa, mặc định AUTOCOMPLETE_LIMIT
+    :return: danh sách dict type, id, name
+    """
+    return get_index().suggest(text, kinds, min(limit or settings.AUTOCOMPLETE_LIMIT, MAX_LIMIT))
+
+
+def _publish(targets):
+    version = caching.bump(caching.AUTOCOMPLETE)
+    cache.set(CHANGE_KEY.format(version), targets, settings.AUTOCOMPLETE_CHANGE_TTL)
+
+
+def changed(kind, ids):
+    """
+    Ghi nhận các mục vừa được cập nhật trong SearchEntry để mọi tiến trình cập nhật cây gợi ý
+    (sau khi transaction commit)
+    """
+    targets = [(kind, object_id) for object_id in ids]
+    if targets:
+        transaction.on_commit(lambda: _publish(targets))
+
+
+def reset():
+    """
+    Bỏ snapshot và buộc mọi tiến trình tải lại toàn bộ (sau khi tạo lại chỉ mục tìm kiếm)
+    """
+    cache.delete(SNAPSHOT_KEY)
+    # Phiên bản mới không có nhật ký thay đổi nên các tiến trình sẽ tải lại từ đầu
+    caching.bump(caching.AUTOCOMPLETE)
+
+
+def warm_up():
+    """
+    Tạo cây gợi ý khi tiến trình khởi động (asgi.py/wsgi.py) để request đầu tiên không phải chờ
+    """
+    try:
+        get_index()
+    except Exception:
+        logger.exception("Không thể tạo cây gợi ý tìm kiếm")
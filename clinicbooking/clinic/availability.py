@@ -0,0 +1,104 @@
+from django.db import transaction
+from django.db.models import Count, Sum, Q, F, Value
+from django.db.models.functions import Greatest
+from django.utils.dateparse import parse_date
+
+from clinic.models import Schedule, DoctorAvailability, Doctor
+from clinic.upsert import upsert
+
+SUMMARY_FIELDS = ['free_slots', 'slot_count', 'free_capacity', 'capacity']
+
+
+def summarize(schedules):
+    """
+    Gom các lịch khám theo (bác sĩ, ngày) và tính số khung giờ/số chỗ còn trống
+    :param schedules: QuerySet Schedule cần tổng hợp
+    :return: QuerySet các dict {doctor_id, date, free_slots, slot_count, free_capacity, capacity}
+    """
+    # capacity phải được annotate sau cùng, nếu không F('capacity') sẽ trỏ tới giá trị Sum thay vì cột
+    return (schedules.values('doctor_id', 'date')
+            .annotate(slot_count=Count('id'),
+                      free_slots=Count('id', filter=Q(sum_booking__lt=F('capacity'))),
+                      free_capacity=Sum(Greatest(F('capacity') - F('sum_booking'), Value(0))),
+                      capacity=Sum('capacity'))
+            .order_by())
+
+
+def refresh_days(days):
+    """
+    Tính lại dòng tổng hợp của các ngày được chỉ định (chỉ đọc lịch khám của đúng các ngày đó)
+    :param days: danh sách (doctor_id, date)
+    """
+    days = {(doctor_id, parse_date(day) if isinstance(day, str) else day) for doctor_id, day in days}
+    if not days:
+        return
+    condition = Q()
+    for doctor_id, day in days:
+        condition |= Q(doctor_id=doctor_id, date=day)
+
+    rows = [DoctorAvailability(**row) for row in summarize(Schedule.objects.filter(condition))]
+    upsert(DoctorAvailability, rows, ['doctor', 'date'], SUMMARY_FIELDS + ['updated_date'])
+    # Ngày không còn lịch khám nào thì xoá dòng tổng hợp
+    empty = days - {(row.doctor_id, row.date) for row in rows}
+    if empty:
+        condition = Q()
+        for doctor_id, day in empty:
+            condition |= Q(doctor_id=doctor_id, date=day)
+        DoctorAvailability.objects.filter(condition).delete()
+
+
+def refresh_schedules(schedule_ids):
+    """
+    Tính lại dòng tổng hợp của các ngày chứa các lịch khám được chỉ định
+    """
+    refresh_days(Schedule.objects.filter(pk__in=schedule_ids).values_list('doctor_id', 'date').distinct())
+
+
+def refresh_range(doctor_ids, start, end):
+    """
+    Tính lại dòng tổng hợp của nhiều bác sĩ trong khoảng ngày [start, end] bằng một truy vấn gom nhóm,
+    dùng sau khi tạo/xoá lịch khám hàng loạt
+    """
+    summaries = DoctorAvailability.objects.filter(doctor_id__in=doctor_ids, date__range=(start, end))
+    rows = [DoctorAvailability(**row)
+            for row in summarize(Schedule.objects.filter(doctor_id__in=doctor_ids, date__range=(start, end)))]
+    kept = {(row.doctor_id, row.date) for row in rows}
+    stale = [pk for pk, doctor_id, day in summaries.values_list('pk', 'doctor_id', 'date')
+             if (doctor_id, day) not in kept]
+    if stale:
+        DoctorAvailability.objects.filter(pk__in=stale).delete()
+    upsert(DoctorAvailability, rows, ['doctor', 'date'], SUMMARY_FIELDS + ['updated_date'], batch_size=1000)
+
+
+@transaction.atomic
+def rebuild():
+    """
+    Xoá và tính lại toàn bộ bảng DoctorAvailability từ bảng Schedule
+    :return: số dòng tổng hợp được tạo
+    """
+    DoctorAvailability.objects.all().delete()
+    rows = DoctorAvailability.objects.bulk_create(
+        [DoctorAvailability(**row) for row in summarize(Schedule.objects.all())], batch_size=1000)
+    return len(rows)
+
+
+def available_days(start, end, doctor_id=None, specialization_id=None, hospital_id=None):
+    """
+    Lấy các ngày còn chỗ trống trong khoảng [start, end] bằng một truy vấn trên bảng tổng hợp
+    :param doctor_id: id user của bác sĩ
+    :param specialization_id: lấy tất cả bác sĩ thuộc chuyên khoa
+    :param hospital_id: lấy tất cả bác sĩ thuộc bệnh viện
+    :return: QuerySet các dict {doctor_id, date, free_slots, slot_count, free_capacity}
+    """
+    queryset = DoctorAvailability.objects.filter(date__range=(start, end), free_slots__gt=0)
+    if doctor_id:
+        queryset = queryset.filter(doctor_id=doctor_id)
+    if specialization_id or hospital_id:
+        doctors = Doctor.objects.filter(active=True)
+        if specialization_id:
+            doctors = doctors.filter(specialization_id=specialization_id)
+        if hospital_id:
+            doctors = doctors.filter(hospital_id=hospital_id)
+        queryset = queryset.filter(doctor_id__in=doctors.values('user_id'))
+    return (queryset.order_by('doctor_id', 'date')
+            .values('doctor_id', 'date', 'free_slots', 'slot_count', 'free_capacity'))
@@ -0,0 +1,276 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, BooleanField, ExpressionWrapper, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from clinic import availability, overlaps, reports
+from clinic.models import Appointment, Schedule, HealthRecord, Payment
+
+
+def _refresh_active(schedule_ids):
+    """
+    Cập nhật trạng thái còn trống (active) của lịch theo sum_booking/capacity ngay trên database,
+    đồng thời cập nhật bảng tổng hợp lịch trống theo ngày của bác sĩ
+    """
+    Schedule.objects.filter(pk__in=schedule_ids).update(
+        active=ExpressionWrapper(Q(sum_booking__lt=F('capacity')), output_field=BooleanField()))
+    availability.refresh_schedules(schedule_ids)
+
+
+def reserve_seat(schedule_id):
+    """
+    Giữ một chỗ trong lịch khám bằng một câu UPDATE có điều kiện:
+    UPDATE schedule SET sum_booking = sum_booking + 1 WHERE id = ... AND sum_booking < capacity
+    Câu lệnh này đồng thời khoá dòng schedule đến hết transaction.
+    :param schedule_id: id lịch khám
+    :return: True nếu giữ chỗ thành công, False nếu lịch đã đầy
+    """
+    updated = Schedule.objects.filter(pk=schedule_id, sum_booking__lt=F('capacity')) \
+        .update(sum_booking=F('sum_booking') + 1)
+    if updated:
+        _refresh_active([schedule_id])
+    return bool(updated)
+
+
+def release_seat(schedule_id):
+    """
+    Trả lại một chỗ trong lịch khám (không để sum_booking âm)
+    """
+    Schedule.objects.filter(pk=schedule_id, sum_booking__gt=0).update(sum_booking=F('sum_booking') - 1)
+    _refresh_active([schedule_id])
+
+
+def _check_duplicate(healthrecord, schedule, exclude_id=None):
+    duplicates = Appointment.objects.filter(healthrecord=healthrecord, schedule=schedule, cancel=False)
+    if exclude_id:
+        duplicates = duplicates.exclude(pk=exclude_id)
+    if duplicates.exists():
+        raise ValidationError("Bạn đã có lịch khám này rồi!")
+
+
+def _check_patient_overlap(healthrecord_id, schedule, exclude_id=None):
+    # Khoá dòng hồ sơ để 2 yêu cầu đặt 2 lịch trùng giờ (ở 2 bác sĩ khác nhau) của cùng một hồ sơ
+    # phải chờ nhau, yêu cầu sau sẽ thấy lịch hẹn của yêu cầu trước
+    list(HealthRecord.objects.select_for_update().filter(pk=healthrecord_id).values_list('pk'))
+    overlaps.check_patient(healthrecord_id, schedule, exclude_id)
+
+
+@transaction.atomic
+def book_appointment(schedule, healthrecord, **data):
+    """
+    Đặt lịch khám: giữ chỗ trong lịch rồi tạo Appointment trong cùng một transaction
+    :param schedule: Lịch khám
+    :param healthrecord: Hồ sơ sức khoẻ của bệnh nhân
+    :param data: Các thông tin khác của Appointment (disease_type, symptoms,...)
+    :return: Appointment vừa tạo
+    """
+    if not reserve_seat(schedule.pk):
+        raise ValidationError("Lịch khám đã đầy.")
+
+    # Dòng schedule đang bị khoá nên việc kiểm tra trùng lịch không bị tranh chấp,
+    # kiểm tra trùng giờ với lịch hẹn ở bác sĩ khác thì khoá thêm dòng hồ sơ
+    _check_duplicate(healthrecord, schedule)
+    _check_patient_overlap(healthrecord.pk, schedule)
+    try:
+        with transaction.atomic():
+            appointment = Appointment.objects.create(schedule=schedule, healthrecord=healthrecord,
+                                                     status='unpaid', **data)
+    except IntegrityError:
+        raise ValidationError("Bạn đã có lịch khám này rồi!")
+
+    schedule.refresh_from_db(fields=['sum_booking', 'active'])
+    return appointment
+
+
+@transaction.atomic
+def cancel_appointment(appointment, reason=None):
+    """
+    Huỷ lịch khám và trả lại chỗ cho lịch
+    :param appointment: Lịch hẹn cần huỷ
+    :param reason: Lý do huỷ
+    :return: Appointment sau khi huỷ
+    """
+    appointment = Appointment.objects.select_for_update().get(pk=appointment.pk)
+    if appointment.cancel:
+        raise ValidationError("Lịch khám này đã bị huỷ")
+
+    appointment.cancel = True
+    appointment.status = 'cancelled'
+    appointment.reason = reason
+    appointment.active_booking = None
+    appointment.save(update_fields=['cancel', 'status', 'reason', 'active_booking', 'updated_date'])
+
+    release_seat(appointment.schedule_id)
+    return appointment
+
+
+@transaction.atomic
+def reschedule_appointment(appointment, new_schedule):
+    """
+    Đổi lịch khám sang lịch mới: giữ chỗ ở lịch mới, trả chỗ ở lịch cũ
+    :param appointment: Lịch hẹn cần đổi
+    :param new_schedule: Lịch khám mới
+    :return: Appointment sau khi đổi
+    """
+    appointment = Appointment.objects.select_for_update().get(pk=appointment.pk)
+    if appointment.cancel:
+        raise ValidationError("Lịch khám đã bị huỷ")
+    old_schedule_id = appointment.schedule_id
+    if old_schedule_id == new_schedule.pk:
+        raise ValidationError("Lịch khám mới trùng với lịch hiện tại.")
+
+    # Khoá cả 2 lịch theo thứ tự id để 2 yêu cầu đổi chéo nhau không bị deadlock
+    list(Schedule.objects.select_for_update().filter(pk__in=[old_schedule_id, new_schedule.pk]).order_by('pk'))
+
+    if not reserve_seat(new_schedule.pk):
+        raise ValidationError("Lịch khám mới đã đầy.")
+    _check_duplicate(appointment.healthrecord_id, new_schedule, exclude_id=appointment.pk)
+    _check_patient_overlap(appointment.healthrecord_id, new_schedule, exclude_id=appointment.pk)
+
+    appointment.schedule = new_schedule
+    try:
+        with transaction.atomic():
+            appointment.save(update_fields=['schedule', 'updated_date'])
+    except IntegrityError:
+        raise ValidationError("Bạn đã có lịch khám trong khoảng thời gian này.")
+
+    release_seat(old_schedule_id)
+    return appointment
+
+
+def sync_booking_counts(schedule_ids):
+    """
+    Đếm lại sum_booking từ bảng Appointment cho các lịch được chỉ định.
+    Dùng khi lịch hẹn được sửa trực tiếp (vd: trang admin) thay vì qua các hàm ở trên.
+    """
+    Appointment.objects.filter(schedule_id__in=schedule_ids, cancel=True).update(active_booking=None)
+    for schedule_id in schedule_ids:
+        count = Appointment.objects.filter(schedule_id=schedule_id, cancel=False).count()
+        Schedule.objects.filter(pk=schedule_id).update(sum_booking=count)
+    _refresh_active(schedule_ids)
+
+
+def expire_unpaid_appointments(batch_size=None, now=None):
+    """
+    Huỷ một lô lịch hẹn chưa thanh toán quá APPOINTMENT_PAYMENT_TIMEOUT phút để trả chỗ cho lịch khám:
+    - tìm theo index (status, created_date), khoá bằng SELECT ... FOR UPDATE SKIP LOCKED nên chạy được nhiều worker
+    - huỷ lịch hẹn và chuyển hoá đơn đang xử lý sang thất bại bằng các câu UPDATE hàng loạt
+    - trả chỗ: các lịch cùng số chỗ được trả dùng chung một câu UPDATE sum_booking = sum_booking - n
+    :param batch_size: Số lịch hẹn tối đa trong một lô, mặc định APPOINTMENT_EXPIRY_BATCH_SIZE
+    :return: dict số lịch hẹn đã huỷ, số hoá đơn thất bại, số lịch khám và số chỗ được trả lại
+    """
+    batch_size = batch_size or settings.APPOINTMENT_EXPIRY_BATCH_SIZE
+    now = now or timezone.now()
+    cutoff = now - timedelta(minutes=settings.APPOINTMENT_PAYMENT_TIMEOUT)
+
+    with transaction.atomic():
+        expired = list(Appointment.objects.select_for_update(skip_locked=True)
+                       .filter(status='unpaid', created_date__lt=cutoff)
+                       .order_by('status', 'created_date')
+                       .values_list('id', 'schedule_id')[:batch_size])
+        if not expired:
+            return {'expired': 0, 'payments_failed': 0, 'schedules': 0, 'seats': 0}
+        ids = [appointment_id for appointment_id, _ in expired]
+        released = Counter(schedule_id for _, schedule_id in expired)
+
+        Appointment.objects.filter(pk__in=ids).update(status='cancelled', cancel=True, active_booking=None,
+                                                      reason='Quá hạn thanh toán', updated_date=now)
+        payments_failed = Payment.objects.filter(appointment_id__in=ids, status=Payment.PaymentStatus.PENDING) \
+            .update(status=Payment.PaymentStatus.FAILED, updated_date=now)
+
+        by_count = defaultdict(list)
+        for schedule_id, count in released.items():
+            by_count[count].append(schedule_id)
+        for count, schedule_ids in by_count.items():
+            Schedule.objects.filter(pk__in=schedule_ids).update(
+                sum_booking=Greatest(F('sum_booking') - count, Value(0)))
+        _refresh_active(list(released))
+        reports.refresh_appointments(ids)
+
+    return {'expired': len(ids), 'payments_failed': payments_failed, 'schedules': len(released),
+            'seats': sum(released.values())}
+
+
+def _payable(appointment):
+    return not appointment.cancel and appointment.status == 'unpaid'
+
+
+@transaction.atomic
+def start_payment(appointment, amount, method=Payment.PaymentMethod.VNPAY):
+    """
+    Tạo hoá đơn đang xử lý cho lịch hẹn chưa thanh toán (dùng lại hoá đơn cũ nếu lần thanh toán trước thất bại)
+    :param appointment: Lịch hẹn cần thanh toán
+    :param amount: Số tiền
+    :return: Payment
+    """
+    appointment = Appointment.objects.select_for_update().get(pk=appointment.pk)
+    if not _payable(appointment):
+        raise ValidationError("Lịch hẹn đã bị huỷ hoặc không còn chờ thanh toán.")
+
+    payment = Payment.objects.select_for_update().filter(appointment=appointment).first()
+    if payment is None:
+        return Payment.objects.create(appointment=appointment, method=method, amount=amount,
+                                      status=Payment.PaymentStatus.PENDING)
+    if payment.status == Payment.PaymentStatus.PAID:
+        raise ValidationError("Hóa đơn đã được thanh toán trước đó.")
+    payment.method, payment.amount, payment.status = method, amount, Payment.PaymentStatus.PENDING
+    payment.save(update_fields=['method', 'amount', 'status', 'updated_date'])
+    return payment
+
+
+def _lock_payment(payment_id):
+    # Khoá lịch hẹn trước rồi mới khoá hoá đơn, cùng thứ tự với expire_unpaid_appointments để không bị deadlock
+    appointment_id = Payment.objects.filter(pk=payment_id).values_list('appointment_id', flat=True).first()
+    if appointment_id is None:
+        raise Payment.DoesNotExist
+    appointment = Appointment.objects.select_for_update().get(pk=appointment_id)
+    payment = Payment.objects.select_for_update().get(pk=payment_id)
+    return appointment, payment
+
+
+@transaction.atomic
+def confirm_payment(payment_id, transaction_id=None, refund_if_unpayable=False):
+    """
+    Ghi nhận thanh toán thành công: hoá đơn và lịch hẹn chuyển sang đã thanh toán.
+    Lịch hẹn đã bị huỷ (vd: quá hạn thanh toán, chỗ đã được trả lại) hoặc hoá đơn không còn đang xử lý
+    thì không được ghi nhận: báo lỗi, hoặc chuyển hoá đơn sang chờ hoàn tiền nếu refund_if_unpayable
+    (cổng thanh toán báo thành công muộn, tiền đã bị trừ).
+    :param payment_id: id hoá đơn
+    :param transaction_id: Mã giao dịch của cổng thanh toán
+    :return: Payment sau khi cập nhật
+    """
+    appointment, payment = _lock_payment(payment_id)
+    if payment.status == Payment.PaymentStatus.PAID:
+        raise ValidationError("Hóa đơn đã được thanh toán trước đó.")
+
+    payment.transaction_id = transaction_id
+    if not _payable(appointment) or payment.status != Payment.PaymentStatus.PENDING:
+        if not refund_if_unpayable:
+            raise ValidationError("Lịch hẹn đã bị huỷ hoặc hoá đơn không còn chờ thanh toán.")
+        payment.status = Payment.PaymentStatus.REFUND
+        payment.save(update_fields=['status', 'transaction_id', 'updated_date'])
+        return payment
+
+    payment.status = Payment.PaymentStatus.PAID
+    payment.save(update_fields=['status', 'transaction_id', 'updated_date'])
+    appointment.status = 'paid'
+    appointment.save(update_fields=['status', 'updated_date'])
+    return payment
+
+
+@transaction.atomic
+def fail_payment(payment_id):
+    """
+    Ghi nhận thanh toán thất bại, chỉ áp dụng cho hoá đơn đang xử lý
+    :return: Payment
+    """
+    _, payment = _lock_payment(payment_id)
+    if payment.status == Payment.PaymentStatus.PENDING:
+        payment.status = Payment.PaymentStatus.FAILED
+        payment.save(update_fields=['status', 'updated_date'])
+    return payment
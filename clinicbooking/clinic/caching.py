@@ -0,0 +1,138 @@
+import hashlib
+import json
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+HOSPITALS = 'hospitals'
+SPECIALIZATIONS = 'specializations'
+DOCTORS = 'doctors'
+# Từ điển tìm kiếm (clinic/search.py), chỉ đổi phiên bản khi có từ mới hoặc từ bị xoá khỏi chỉ mục
+SEARCH_TERMS = 'search_terms'
+# Cây gợi ý tìm kiếm (clinic/autocomplete.py), mỗi phiên bản ứng với một lần thay đổi
+AUTOCOMPLETE = 'autocomplete'
+
+
+# Cache chỉ nằm trong một tiến trình: tăng phiên bản ở worker này thì các worker khác không biết
+LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+def is_shared():
+    """
+    Cache mặc định có dùng chung giữa các tiến trình không (Redis, Memcached, database,...)
+    """
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_BACKENDS
+
+
+def require_shared():
+    """
+    Gọi khi tiến trình server khởi động (asgi.py/wsgi.py): khi không ở chế độ DEBUG, cache trong bộ nhớ tiến trình
+    làm các worker khác tiếp tục trả response danh mục, ETag và cây gợi ý cũ sau khi dữ liệu thay đổi
+    """
+    if not settings.DEBUG and not is_shared():
+        raise ImproperlyConfigured("Cần cache dùng chung giữa các worker (đặt CACHE_REDIS_URL) khi DEBUG=False.")
+
+
+def _version_key(namespace):
+    return f'catalog:{namespace}:version'
+
+
+def _new_version():
+    # Lấy theo thời gian để khi key phiên bản bị xoá/đẩy khỏi cache thì không quay lại phiên bản cũ
+    return int(time.time() * 1000)
+
+
+def get_version(namespace):
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        cache.add(_version_key(namespace), _new_version(), timeout=None)
+        version = cache.get(_version_key(namespace))
+    return version
+
+
+def bump(namespace):
+    """
+    Tăng số phiên bản của namespace
+    :return: phiên bản mới
+    """
+    try:
+        return cache.incr(_version_key(namespace))
+    except ValueError:
+        version = _new_version()
+        cache.set(_version_key(namespace), version, timeout=None)
+        return version
+
+
+def invalidate(*namespaces):
+    """
+    Làm mất hiệu lực toàn bộ response đã cache của các danh mục bằng cách tăng số phiên bản
+    (các key cũ không còn được đọc và sẽ tự hết hạn theo TTL)
+    :param namespaces: HOSPITALS, SPECIALIZATIONS, DOCTORS
+    """
+    for namespace in namespaces:
+        bump(namespace)
+
+
+def invalidate_on_commit(*namespaces):
+    """
+    Xoá cache ngay lập tức và xoá thêm lần nữa sau khi transaction commit,
+    tránh trường hợp một request đọc dữ liệu cũ rồi cache lại trước khi transaction kết thúc
+    """
+    invalidate(*namespaces)
+    transaction.on_commit(lambda: invalidate(*namespaces))
+
+
+def make_key(namespace, request):
+    # Link phân trang (next/previous) chứa host nên host cũng là một phần của key
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    raw = f'{request.get_host()}{request.path}?{query}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'catalog:{namespace}:{get_version(namespace)}:{digest}'
+
+
+def cached_response(namespace, request, build_response):
+    """
+    Đọc response từ cache (read-through), nếu chưa có thì gọi build_response() rồi lưu lại kèm ETag.
+    Client gửi If-None-Match trùng ETag sẽ nhận 304 không có body.
+    :param namespace: tên danh mục (HOSPITALS, SPECIALIZATIONS, DOCTORS)
+    :param request: request của DRF
+    :param build_response: hàm tạo Response khi cache chưa có
+    :return: Response
+    """
+    key = make_key(namespace, request)
+    entry = cache.get(key)
+    if entry is None:
+        response = build_response()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        body = json.dumps(response.data, cls=JSONEncoder, ensure_ascii=False)
+        entry = {
+            'etag': quote_etag(hashlib.md5(body.encode()).hexdigest()),
+            'data': json.loads(body),
+        }
+        cache.set(key, entry, settings.CATALOG_CACHE_TTL)
+
+    headers = {'ETag': entry['etag'], 'Cache-Control': 'no-cache'}
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if entry['etag'] in if_none_match or '*' in if_none_match:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(entry['data'], headers=headers)
+
+
+class CatalogCacheMixin:
+    """
+    Cache API danh sách của viewset theo query params, dùng cho các danh mục ít thay đổi
+    """
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        build = super().list
+        return cached_response(self.cache_namespace, request, lambda: build(request, *args, **kwargs))
@@ -0,0 +1,12 @@
+from django.core.checks import Error, Tags, register
+
+from clinic import caching
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    # python manage.py check --deploy: cache danh mục, ETag và cây gợi ý cần dùng chung giữa các worker
+    if caching.is_shared():
+        return []
+    return [Error("Cache mặc định chỉ nằm trong bộ nhớ của từng tiến trình.",
+                  hint="Đặt CACHE_REDIS_URL để các worker dùng chung cache.", id='clinic.E001')]
@@ -0,0 +1,96 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+
+from clinic.models import User
+
+logger = logging.getLogger(__name__)
+
+
+def conversation_group(user_id, participant_id):
+    """
+    Tên group của cuộc trò chuyện giữa 2 người (không phụ thuộc ai là người gửi)
+    """
+    first, second = sorted([int(user_id), int(participant_id)])
+    return f'chat_{first}_{second}'
+
+
+def notification_group(user_id):
+    """
+    Tên group nhận thông báo đẩy (push) của một user
+    """
+    return f'notifications_{int(user_id)}'
+
+
+def broadcast_message(message):
+    """
+    Đẩy tin nhắn mới đến những client đang kết nối vào cuộc trò chuyện.
+    Lỗi channel layer (vd: Redis không chạy) chỉ được ghi log, client vẫn có thể đồng bộ qua /messages/sync/
+    :param message: Message vừa tạo
+    """
+    from clinic.serializers import MessageSyncSerializer
+
+    if not (message.sender_id and message.receiver_id):
+        return
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            conversation_group(message.sender_id, message.receiver_id),
+            {'type': 'chat.message', 'message': MessageSyncSerializer(message).data})
+    except Exception:
+        logger.exception("Không thể đẩy tin nhắn #%s qua WebSocket", message.pk)
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Kênh WebSocket của một cuộc trò chuyện: ws/chat/<participant_id>/
+    Server đẩy các tin nhắn mới (cùng định dạng với /messages/sync/) đến cả 2 người tham gia.
+    """
+
+    async def connect(self):
+        user = self.scope['user']
+        participant_id = self.scope['url_route']['kwargs']['participant_id']
+        if not user.is_authenticated or user.id == participant_id or not await self.user_exists(participant_id):
+            await self.close()
+            return
+
+        self.group_name = conversation_group(user.id, participant_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def chat_message(self, event):
+        await self.send_json(event['message'])
+
+    @database_sync_to_async
+    def user_exists(self, user_id):
+        return User.objects.filter(pk=user_id, is_active=True).exists()
+
+
+class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Kênh WebSocket nhận thông báo đẩy của user đăng nhập: ws/notifications/
+    Server đẩy thông báo mới (cùng định dạng với /notifications/inbox/) khi thông báo được gửi.
+    """
+
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_name = notification_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification_push(self, event):
+        await self.send_json(event['notification'])
@@ -1,5 +1,100 @@
-from django.core.mail import EmailMultiAlternatives
-from clinicbooking import settings
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from clinic.models import EmailOutbox
+
+
+def queue_email(subject, text_content, to, html_content='', from_email=None):
+    """
+    Đưa email vào hàng đợi EmailOutbox thay vì gửi SMTP ngay trong request
+    :param subject: Tiêu đề
+    :param text_content: Nội dung dạng text
+    :param to: Danh sách email người nhận
+    :param html_content: Nội dung dạng HTML (nếu có)
+    :param from_email: Email người gửi (mặc định DEFAULT_FROM_EMAIL)
+    :return: EmailOutbox
+    """
+    return EmailOutbox.objects.create(subject=subject, body=text_content, html_body=html_content,
+                                      from_email=from_email or settings.DEFAULT_FROM_EMAIL, to=list(to))
+
+
+def _build_message(email, connection):
+    msg = EmailMultiAlternatives(email.subject, email.body, email.from_email, email.to, connection=connection)
+    if email.html_body:
+        msg.attach_alternative(email.html_body, "text/html")
+    return msg
+
+
+def _mark_failed(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = EmailOutbox.Status.DEAD
+    else:
+        delay = settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS * 2 ** (email.attempts - 1)
+        email.next_attempt_at = now + timedelta(seconds=delay)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def _mark_sent(email):
+    # Xoá nội dung email đã gửi: nội dung có thể chứa mã OTP hay thông tin cá nhân
+    email.status = EmailOutbox.Status.SENT
+    email.attempts += 1
+    email.sent_at = timezone.now()
+    email.body = email.html_body = ''
+    email.save(update_fields=['status', 'attempts', 'sent_at', 'body', 'html_body'])
+
+
+def send_queued_emails(batch_size=None):
+    """
+    Gửi một lô email đến hạn trong hàng đợi qua một kết nối SMTP dùng chung.
+    Email gửi lỗi được thử lại sau (thời gian chờ tăng gấp đôi), quá số lần cho phép thì chuyển sang DEAD.
+    Các dòng được nhận bằng SELECT ... FOR UPDATE SKIP LOCKED rồi giữ trong EMAIL_OUTBOX_LEASE_SECONDS giây
+    (dời next_attempt_at) nên có thể chạy nhiều worker cùng lúc; việc gửi SMTP chạy ngoài transaction,
+    worker bị dừng giữa chừng thì email được gửi lại khi hết hạn giữ.
+    Email gửi thành công chỉ giữ lại tiêu đề, người nhận và trạng thái, nội dung bị xoá.
+    :param batch_size: Số email tối đa trong một lô
+    :return: (số email gửi thành công, số email gửi lỗi)
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    now = timezone.now()
+
+    with transaction.atomic():
+        emails = list(EmailOutbox.objects.select_for_update(skip_locked=True)
+                      .filter(status=EmailOutbox.Status.PENDING, next_attempt_at__lte=now)
+                      .order_by('next_attempt_at', 'id')[:batch_size])
+        if not emails:
+            return 0, 0
+        EmailOutbox.objects.filter(pk__in=[email.pk for email in emails]).update(
+            next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS))
+
+    errors = {}
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as ex:
+        errors = dict.fromkeys(emails, ex)
+    else:
+        try:
+            for email in emails:
+                try:
+                    _build_message(email, connection).send()
+                except Exception as ex:
+                    errors[email] = ex
+        finally:
+            connection.close()
+
+    with transaction.atomic():
+        for email in emails:
+            if email in errors:
+                _mark_failed(email, errors[email], now)
+            else:
+                _mark_sent(email)
+    return len(emails) - len(errors), len(errors)
 
 
 def send_appointment_successfull_email(appointment):
@@ -49,9 +144,7 @@ def send_appointment_successfull_email(appointment):
     <p style="margin-top:20px;">Trân trọng,<br><em>Đội ngũ Clinic Booking</em></p>
     """
 
-    msg = EmailMultiAlternatives(subject, text_content, from_email, to_email)
-    msg.attach_alternative(html_content, "text/html")
-    msg.send()
+    queue_email(subject, text_content, to_email, html_content, from_email)
 
 
 def send_otp_email(user, otp):
@@ -99,6 +192,20 @@ def send_otp_email(user, otp):
     </html>
     """
 
-    msg = EmailMultiAlternatives(subject, text_content, from_email, to)
-    msg.attach_alternative(html_content, "text/html")
-    msg.send()
+    queue_email(subject, text_content, to, html_content, from_email)
+
+
+def send_payment_success_email(payment):
+    subject = 'Xác nhận thanh toán thành công'
+    message = f"""
+    Kính gửi {payment.appointment.healthrecord.full_name},
+
+    Thanh toán của bạn cho lịch hẹn #{payment.appointment.id} đã được thực hiện thành công.
+    - Số tiền: {payment.amount} VND
+    - Mã giao dịch: {payment.transaction_id}
+    - Thời gian: {payment.created_date.strftime('%d/%m/%Y %H:%M:%S')}
+
+    Cảm ơn bạn đã sử dụng dịch vụ của chúng tôi!
+    """
+    recipient_list = [payment.appointment.healthrecord.email]
+    queue_email(subject, message, recipient_list)
@@ -0,0 +1,141 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_fields(value):
+    """
+    Chuyển '?fields=id,user.full_name,user.avatar' thành cây {'id': {}, 'user': {'full_name': {}, 'avatar': {}}}
+    """
+    tree = {}
+    for path in filter(None, (item.strip() for item in value.split(','))):
+        node = tree
+        for part in path.split('.'):
+            node = node.setdefault(part, {})
+    return tree
+
+
+def _prune(serializer, tree):
+    # Bỏ các trường không được chọn, với serializer lồng nhau thì tiếp tục lọc theo nhánh con
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    for name in list(serializer.fields):
+        if name not in tree:
+            serializer.fields.pop(name)
+        elif tree[name] and isinstance(serializer.fields[name], serializers.BaseSerializer):
+            _prune(serializer.fields[name], tree[name])
+
+
+class DynamicFieldsMixin:
+    """
+    Cho phép client chọn trường trả về và mở rộng quan hệ qua query params (chỉ với request GET):
+    - ?fields=id,full_name,user.avatar: chỉ trả về các trường được chọn (dấu chấm cho serializer lồng nhau)
+    - ?expand=user: trả về object lồng nhau thay vì id cho các quan hệ khai báo trong expandable_fields
+    Trường tính bằng SerializerMethodField cần khai báo cột sử dụng trong Meta.field_sources
+    để view có thể thu gọn queryset (xem optimize_queryset).
+    """
+    # {tên trường: (tên serializer trong clinic.serializers, tham số khởi tạo)}
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        # Chỉ serializer gốc (được view truyền context) mới đọc query params
+        if request is None or 'context' not in kwargs or request.method not in SAFE_METHODS:
+            return
+
+        params = request.query_params
+        for name in params.get('expand', '').split(','):
+            if name in self.expandable_fields:
+                serializer_name, options = self.expandable_fields[name]
+                from clinic import serializers as clinic_serializers
+                self.fields[name] = getattr(clinic_serializers, serializer_name)(read_only=True, **options)
+
+        if params.get('fields'):
+            _prune(self, parse_fields(params['fields']))
+
+    @property
+    def is_sparse(self):
+        request = self.context.get('request')
+        return request is not None and bool(request.query_params.get('fields') or request.query_params.get('expand'))
+
+
+def _collect(serializer, model, prefix, plan):
+    """
+    Duyệt các trường của serializer để biết cần select_related/prefetch_related/only những gì.
+    :return: False nếu có trường không xác định được cột sử dụng
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    field_sources = getattr(getattr(serializer, 'Meta', None), 'field_sources', {})
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if name in field_sources:
+            sources = field_sources[name]
+        elif field.source == '*':
+            return False
+        else:
+            sources = ['__'.join(field.source_attrs)]
+
+        nested = isinstance(field, serializers.BaseSerializer)
+        for source in sources:
+            current, path = model, prefix
+            parts = source.split('__')
+            for i, part in enumerate(parts):
+                try:
+                    model_field = current._meta.get_field(part)
+                except FieldDoesNotExist:
+                    if i == 0:
+                        return False  # property/thuộc tính của model, không biết dùng cột nào
+                    break  # thuộc tính của giá trị (vd: avatar.url)
+                last = i == len(parts) - 1
+
+                if not model_field.is_relation:
+                    plan['only'].add(path + part)
+                    break
+                if model_field.many_to_many or model_field.one_to_many:
+                    plan['prefetch'].add(path + part)
+                    break
+                if model_field.concrete:
+                    plan['only'].add(path + model_field.name)
+                if last and not nested:
+                    break  # chỉ cần id của quan hệ
+                plan['select'].add(path + model_field.name)
+                current, path = model_field.related_model, f'{path}{model_field.name}__'
+            else:
+                if nested and not _collect(field, current, path, plan):
+                    return False
+    return True
+
+
+def optimize_queryset(queryset, serializer):
+    """
+    Thu gọn queryset theo các trường serializer thực sự trả về:
+    chỉ JOIN các quan hệ cần thiết, chỉ SELECT các cột cần thiết.
+    Trả về queryset ban đầu nếu không xác định được các cột cần dùng.
+    """
+    plan = {'select': set(), 'prefetch': set(), 'only': set()}
+    if not _collect(serializer, queryset.model, '', plan):
+        return queryset
+    queryset = queryset.select_related(None)
+    if plan['select']:
+        queryset = queryset.select_related(*sorted(plan['select']))
+    if plan['prefetch']:
+        queryset = queryset.prefetch_related(*sorted(plan['prefetch']))
+    return queryset.only(*sorted(plan['only']))
+
+
+class SparseQuerysetMixin:
+    """
+    Mixin cho viewset: khi client dùng ?fields=/?expand= thì thu gọn queryset theo serializer tương ứng
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method in SAFE_METHODS:
+            serializer = self.get_serializer()
+            if getattr(serializer, 'is_sparse', False):
+                queryset = optimize_queryset(queryset, serializer)
+        return queryset
@@ -0,0 +1,62 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Chưa cài Pillow: ảnh được tải lên nguyên bản
+    Image = ImageOps = None
+
+_pool = None
+
+
+def available():
+    return Image is not None
+
+
+def process_pool(workers):
+    """
+    Process pool dùng chung của worker tải ảnh (tạo một lần, dùng lại cho các lô sau)
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers)
+    return _pool
+
+
+def _save_jpeg(image, path, quality):
+    # Lưu không kèm EXIF (vị trí GPS, thông tin máy chụp,...)
+    image.save(path, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return os.path.getsize(path)
+
+
+def compress(path, max_size, quality, thumbnail_size):
+    """
+    Chuẩn hoá ảnh chụp trước khi tải lên (chạy trong process pool):
+    xoay ảnh theo EXIF, bỏ metadata, thu nhỏ cạnh dài nhất về max_size, nén lại dạng JPEG và tạo ảnh thu nhỏ.
+    Hàm chỉ nhận/trả về kiểu dữ liệu đơn giản để gửi qua process khác.
+    :param path: File ảnh đã lưu tạm
+    :return: dict (path, original_bytes, stored_bytes, thumbnail) hoặc None nếu không đọc được ảnh
+    """
+    original_bytes = os.path.getsize(path)
+    try:
+        with Image.open(path) as source:
+            has_metadata = bool(source.info.get('exif') or source.getexif())
+            image = ImageOps.exif_transpose(source)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.thumbnail((max_size, max_size))
+
+            base = os.path.splitext(path)[0]
+            output = f'{base}.min.jpg'
+            stored_bytes = _save_jpeg(image, output, quality)
+            image.thumbnail((thumbnail_size, thumbnail_size))
+            thumbnail = f'{base}.thumb.jpg'
+            _save_jpeg(image, thumbnail, quality)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    # Ảnh đã nhỏ và không có metadata thì giữ nguyên file gốc
+    if stored_bytes >= original_bytes and not has_metadata:
+        os.remove(output)
+        output, stored_bytes = path, original_bytes
+    return {'path': output, 'original_bytes': original_bytes, 'stored_bytes': stored_bytes, 'thumbnail': thumbnail}
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from clinic import reports
+
+
+class Command(BaseCommand):
+    help = 'Tính lại bảng thống kê theo ngày của bác sĩ (DoctorDailyReport) từ bảng Appointment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='Ngày bắt đầu (YYYY-MM-DD), mặc định là toàn bộ')
+        parser.add_argument('--end', help='Ngày kết thúc (YYYY-MM-DD), mặc định là toàn bộ')
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start']) if options['start'] else None
+        end = parse_date(options['end']) if options['end'] else None
+        if (options['start'] and not start) or (options['end'] and not end):
+            raise CommandError('Ngày phải có dạng YYYY-MM-DD')
+
+        count = reports.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Đã tính lại {count} dòng thống kê.'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from clinic.notifications import dispatch_due
+
+
+class Command(BaseCommand):
+    help = 'Gửi các thông báo đã tới send_at vào hộp thư, email và push của người nhận'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Chạy liên tục như một worker')
+        parser.add_argument('--interval', type=float, default=30,
+                            help='Số giây nghỉ khi không có thông báo đến hạn (mặc định 30)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Số thông báo tối đa trong một lô')
+
+    def handle(self, *args, **options):
+        while True:
+            dispatched, delivered = dispatch_due(options['batch_size'])
+            if dispatched:
+                self.stdout.write(f'Đã gửi {dispatched} thông báo tới {delivered} người nhận.')
+            if not options['loop']:
+                break
+            if not dispatched:
+                time.sleep(options['interval'])
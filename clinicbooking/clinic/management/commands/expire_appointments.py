@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from clinic.booking import expire_unpaid_appointments
+
+
+class Command(BaseCommand):
+    help = 'Huỷ các lịch hẹn chưa thanh toán quá hạn và trả lại chỗ cho lịch khám'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Chạy liên tục như một worker')
+        parser.add_argument('--interval', type=float, default=60,
+                            help='Số giây nghỉ khi không có lịch hẹn quá hạn (mặc định 60)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Số lịch hẹn tối đa trong một lô')
+
+    def handle(self, *args, **options):
+        while True:
+            result = expire_unpaid_appointments(options['batch_size'])
+            if result['expired']:
+                self.stdout.write(f"Đã huỷ {result['expired']} lịch hẹn quá hạn thanh toán, "
+                                  f"trả lại {result['seats']} chỗ ở {result['schedules']} lịch khám, "
+                                  f"{result['payments_failed']} hoá đơn chuyển sang thất bại.")
+            if not options['loop']:
+                break
+            if not result['expired']:
+                time.sleep(options['interval'])
@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from clinic import scheduling
+from clinic.models import ScheduleTemplate
+
+
+class Command(BaseCommand):
+    help = 'Sinh lịch khám (Schedule) từ lịch làm việc mẫu hằng tuần (ScheduleTemplate)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='Ngày bắt đầu (YYYY-MM-DD), mặc định là ngày mai')
+        parser.add_argument('--days', type=int, default=28, help='Số ngày cần sinh lịch (mặc định 28)')
+        parser.add_argument('--doctor', type=int, help='Chỉ sinh lịch cho bác sĩ (id user)')
+        parser.add_argument('--hospital', type=int, help='Chỉ sinh lịch cho các bác sĩ thuộc bệnh viện')
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start']) if options['start'] else timezone.localdate() + timedelta(days=1)
+        if not start:
+            raise CommandError('--start phải có dạng YYYY-MM-DD')
+        end = start + timedelta(days=options['days'] - 1)
+
+        templates = ScheduleTemplate.objects.filter(active=True)
+        if options['doctor']:
+            templates = templates.filter(doctor_id=options['doctor'])
+        if options['hospital']:
+            templates = templates.filter(doctor__doctor__hospital_id=options['hospital'])
+
+        try:
+            created, skipped = scheduling.generate_schedules(templates, start, end)
+        except ValidationError as e:
+            raise CommandError(e.detail[0])
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã tạo {created} lịch khám từ {start} đến {end}, bỏ qua {skipped} lượt trùng giờ.'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from clinic.uploads import process_uploads, compression_stats
+
+
+class Command(BaseCommand):
+    help = 'Tải các ảnh đang chờ trong hàng đợi MediaUpload lên Cloudinary'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Chạy liên tục như một worker')
+        parser.add_argument('--interval', type=float, default=2, help='Số giây nghỉ khi hàng đợi trống (mặc định 2)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Số file tối đa trong một lô')
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = process_uploads(options['batch_size'])
+            if done or failed:
+                self.stdout.write(f'Đã tải lên {done} file, lỗi {failed} file.')
+                stats = compression_stats()
+                if stats['files']:
+                    self.stdout.write(f"Đã nén {stats['files']} ảnh: {stats['original_bytes']:,} -> "
+                                      f"{stats['stored_bytes']:,} bytes (tiết kiệm {stats['saved_bytes']:,} bytes).")
+            if not options['loop']:
+                break
+            if not (done or failed):
+                time.sleep(options['interval'])
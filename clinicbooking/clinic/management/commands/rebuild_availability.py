@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from clinic import availability
+
+
+class Command(BaseCommand):
+    help = 'Tính lại bảng tổng hợp lịch trống theo ngày (DoctorAvailability) từ bảng Schedule'
+
+    def handle(self, *args, **options):
+        count = availability.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Đã tính lại {count} dòng lịch trống.'))
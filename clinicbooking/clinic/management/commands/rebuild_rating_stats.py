@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from clinic import ratings
+
+
+class Command(BaseCommand):
+    help = 'Tính lại bảng thống kê đánh giá bác sĩ (DoctorRatingStats) từ bảng Review'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Chỉ kiểm tra và báo cáo các dòng thống kê bị lệch, không ghi lại')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drift = ratings.find_drift()
+            for row in drift:
+                self.stdout.write(f"Bác sĩ #{row['doctor_id']} - {row['field']}: "
+                                  f"đang lưu {row['stored']}, thực tế {row['expected']}")
+            if drift:
+                self.stdout.write(self.style.WARNING(f'Có {len(drift)} giá trị thống kê bị lệch.'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Thống kê đánh giá khớp với dữ liệu Review.'))
+            return
+
+        count = ratings.rebuild_stats()
+        self.stdout.write(self.style.SUCCESS(f'Đã tính lại thống kê đánh giá cho {count} bác sĩ.'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from clinic import search, autocomplete
+
+
+class Command(BaseCommand):
+    help = 'Tạo lại chỉ mục tìm kiếm bác sĩ, bệnh viện, chuyên khoa và độ phổ biến (số lượt đặt khám)'
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        autocomplete.reset()
+        self.stdout.write(self.style.SUCCESS(f'Đã tạo lại chỉ mục tìm kiếm cho {count} mục.'))
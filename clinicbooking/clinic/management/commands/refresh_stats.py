@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from clinic import reports
+from clinic.models import StatsSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Tính lại số liệu mặc định (12 tháng gần nhất) của trang thống kê admin (StatsSnapshot)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Chạy liên tục như một worker')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Số giây giữa 2 lần tính (mặc định ADMIN_STATS_MAX_AGE / 2)')
+        parser.add_argument('--keep-days', type=int, default=7,
+                            help='Xoá số liệu của các khoảng thời gian khác mặc định cũ hơn số ngày này')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or settings.ADMIN_STATS_MAX_AGE / 2
+        while True:
+            end = timezone.localdate()
+            start = reports.months_before(end, 11)
+            snapshot = reports.refresh_snapshot(start, end, 'month')
+            self.stdout.write(f'Đã tính lại số liệu {start} - {end} trong {snapshot.duration_ms} ms.')
+
+            # Các khoảng thời gian admin tự chọn được tính khi xem trang, lâu không được xem lại thì xoá
+            StatsSnapshot.objects.filter(computed_at__lt=timezone.now() - timedelta(days=options['keep_days'])) \
+                .exclude(pk=snapshot.pk).delete()
+            if not options['loop']:
+                break
+            time.sleep(interval)
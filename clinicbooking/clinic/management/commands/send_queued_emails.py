@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from clinic.email import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Gửi các email đang chờ trong hàng đợi EmailOutbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Chạy liên tục như một worker')
+        parser.add_argument('--interval', type=float, default=5, help='Số giây nghỉ khi hàng đợi trống (mặc định 5)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Số email tối đa trong một lô')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued_emails(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Đã gửi {sent} email, lỗi {failed} email.')
+            if not options['loop']:
+                break
+            if not (sent or failed):
+                time.sleep(options['interval'])
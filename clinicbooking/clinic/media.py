@@ -0,0 +1,75 @@
+from functools import lru_cache
+
+import cloudinary
+from cloudinary.utils import cloudinary_url
+from django.conf import settings
+from rest_framework import serializers
+
+# Các kích thước ảnh trả về cho client. 'full' giữ nguyên URL ảnh gốc như trước,
+# các kích thước nhỏ để Cloudinary tự chọn định dạng/chất lượng phù hợp với thiết bị
+VARIANTS = {
+    'thumbnail': {'width': 150, 'height': 150, 'crop': 'fill', 'quality': 'auto', 'fetch_format': 'auto'},
+    'card': {'width': 480, 'crop': 'limit', 'quality': 'auto', 'fetch_format': 'auto'},
+    'full': {},
+}
+DEFAULT_VARIANT = 'full'
+
+
+@lru_cache(maxsize=settings.MEDIA_URL_CACHE_SIZE)
+def _build_url(cloud_name, public_id, format, version, type, resource_type, variant):
+    options = dict(VARIANTS[variant], format=format, version=version, type=type,
+                   resource_type=resource_type or 'image')
+    return cloudinary_url(public_id, **options)[0]
+
+
+def image_url(resource, variant=DEFAULT_VARIANT):
+    """
+    URL của ảnh Cloudinary theo kích thước, được ghi nhớ trong LRU cache (MEDIA_URL_CACHE_SIZE URL)
+    theo public_id + version + kích thước nên mỗi ảnh chỉ phải dựng URL một lần mỗi tiến trình.
+    Ảnh được tải lại sẽ có version mới nên không bị trả URL cũ.
+    :param resource: Giá trị của CloudinaryField
+    :param variant: 'thumbnail', 'card' hoặc 'full'
+    :return: URL hoặc None nếu không có ảnh
+    """
+    if not resource:
+        return None
+    if not isinstance(resource, cloudinary.CloudinaryResource):
+        return str(resource)
+    return _build_url(cloudinary.config().cloud_name, resource.public_id, resource.format, resource.version,
+                      resource.type, resource.resource_type, variant if variant in VARIANTS else DEFAULT_VARIANT)
+
+
+image_url.cache_info = _build_url.cache_info
+image_url.cache_clear = _build_url.cache_clear
+
+
+class ImageURLField(serializers.Field):
+    """
+    Trường chỉ đọc trả về URL ảnh Cloudinary theo kích thước được view chọn (context['image_variant'])
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return image_url(value, self.context.get('image_variant', DEFAULT_VARIANT))
+
+
+class ImageVariantMixin:
+    """
+    Mixin cho viewset: chọn kích thước ảnh theo action (image_variants, vd: {'list': 'thumbnail'}),
+    client có thể chọn kích thước khác qua ?image=thumbnail|card|full
+    """
+    image_variants = {}
+
+    def get_image_variant(self):
+        variant = self.request.query_params.get('image') if self.request else None
+        if variant in VARIANTS:
+            return variant
+        return self.image_variants.get(self.action, DEFAULT_VARIANT)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['image_variant'] = self.get_image_variant()
+        return context
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def populate_rating_stats(apps, schema_editor):
+    Review = apps.get_model('clinic', 'Review')
+    DoctorRatingStats = apps.get_model('clinic', 'DoctorRatingStats')
+    stars = {f'star_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)}
+    rows = (Review.objects.filter(doctor__isnull=False).values('doctor_id')
+            .annotate(review_count=Count('id'), rating_sum=Sum('rating'), last_review_at=Max('created_date'), **stars)
+            .order_by())
+    DoctorRatingStats.objects.bulk_create([DoctorRatingStats(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0008_doctor_is_verified_alter_doctor_license_image_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorRatingStats',
+            fields=[
+                ('doctor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('star_1', models.PositiveIntegerField(default=0)),
+                ('star_2', models.PositiveIntegerField(default=0)),
+                ('star_3', models.PositiveIntegerField(default=0)),
+                ('star_4', models.PositiveIntegerField(default=0)),
+                ('star_5', models.PositiveIntegerField(default=0)),
+                ('last_review_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_rating_stats, migrations.RunPython.noop),
+    ]
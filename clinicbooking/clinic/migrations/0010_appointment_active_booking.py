@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:08
+
+from django.db import migrations, models
+
+
+def clear_cancelled_bookings(apps, schema_editor):
+    Appointment = apps.get_model('clinic', 'Appointment')
+    Appointment.objects.filter(cancel=True).update(active_booking=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0009_doctorratingstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='active_booking',
+            field=models.BooleanField(default=True, editable=False, null=True),
+        ),
+        migrations.RunPython(clear_cancelled_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('healthrecord', 'schedule', 'active_booking'), name='unique_active_booking'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0011_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['schedule', 'status'], name='appointment_schedule_status'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'receiver', 'created_date'], name='message_conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['doctor', 'date', 'active'], name='schedule_doctor_date_active'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Greatest
+
+
+def populate_availability(apps, schema_editor):
+    Schedule = apps.get_model('clinic', 'Schedule')
+    DoctorAvailability = apps.get_model('clinic', 'DoctorAvailability')
+    rows = (Schedule.objects.values('doctor_id', 'date')
+            .annotate(slot_count=Count('id'),
+                      free_slots=Count('id', filter=Q(sum_booking__lt=F('capacity'))),
+                      free_capacity=Sum(Greatest(F('capacity') - F('sum_booking'), Value(0))),
+                      capacity=Sum('capacity'))
+            .order_by())
+    DoctorAvailability.objects.bulk_create([DoctorAvailability(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0012_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('free_slots', models.PositiveIntegerField(default=0)),
+                ('slot_count', models.PositiveIntegerField(default=0)),
+                ('free_capacity', models.PositiveIntegerField(default=0)),
+                ('capacity', models.PositiveIntegerField(default=0)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_days', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'date'), name='unique_doctor_day_availability')],
+            },
+        ),
+        migrations.RunPython(populate_availability, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+
+def populate_inbox(apps, schema_editor):
+    # Các thông báo đã gửi trước đây: đưa vào hộp thư của những người nhận đã chọn
+    Notification = apps.get_model('clinic', 'Notification')
+    UserNotification = apps.get_model('clinic', 'UserNotification')
+    NotificationCounter = apps.get_model('clinic', 'NotificationCounter')
+    now = timezone.now()
+    for notification in Notification.objects.filter(send_at__lte=now).prefetch_related('users'):
+        UserNotification.objects.bulk_create(
+            [UserNotification(user=user, notification=notification) for user in notification.users.all()],
+            batch_size=1000, ignore_conflicts=True)
+    Notification.objects.filter(send_at__lte=now).update(published_at=now)
+    counts = UserNotification.objects.values('user_id').annotate(unread=Count('id')).order_by()
+    NotificationCounter.objects.bulk_create([NotificationCounter(**row) for row in counts], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0016_statssnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notification_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='published_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='users',
+            field=models.ManyToManyField(blank=True, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='UserNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_read', models.BooleanField(default=False)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='clinic.notification')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'id'], name='inbox_user_id'), models.Index(fields=['user', 'is_read'], name='inbox_user_unread')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'notification'), name='unique_user_notification')],
+            },
+        ),
+        migrations.RunPython(populate_inbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0018_notification_dispatch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'created_date'], name='appointment_status_created'),
+        ),
+    ]
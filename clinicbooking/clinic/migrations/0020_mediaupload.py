@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0019_appointment_status_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.PositiveIntegerField()),
+                ('field', models.CharField(max_length=50)),
+                ('path', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Chờ tải lên'), ('uploaded', 'Đã tải lên'), ('dead', 'Tải lên thất bại')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('uploaded_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='media_upload_due_idx'), models.Index(fields=['model', 'object_id', 'field'], name='media_upload_target_idx')],
+            },
+        ),
+    ]
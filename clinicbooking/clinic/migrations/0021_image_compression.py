@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:52
+
+import cloudinary.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0020_mediaupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaupload',
+            name='original_bytes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediaupload',
+            name='stored_bytes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='testresult',
+            name='thumbnail',
+            field=cloudinary.models.CloudinaryField(blank=True, max_length=255, null=True),
+        ),
+    ]
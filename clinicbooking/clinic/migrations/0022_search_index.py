@@ -0,0 +1,96 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:58
+
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+# kind: (model, trường tên, điều kiện lọc thêm, đường dẫn từ DoctorDailyReport tới đối tượng)
+SOURCES = {
+    'doctor': ('Doctor', 'user__full_name', {'user__is_active': True}, 'doctor__doctor'),
+    'hospital': ('Hospital', 'name', {}, 'doctor__doctor__hospital'),
+    'specialization': ('Specialization', 'name', {}, 'doctor__doctor__specialization'),
+}
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFD', (text or '').replace('đ', 'd').replace('Đ', 'D'))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def populate_search_index(apps, schema_editor):
+    # Tạo chỉ mục tìm kiếm cho các bác sĩ, bệnh viện, chuyên khoa đang hoạt động,
+    # độ phổ biến là tổng số lượt đặt khám trong DoctorDailyReport
+    SearchEntry = apps.get_model('clinic', 'SearchEntry')
+    SearchWord = apps.get_model('clinic', 'SearchWord')
+    SearchTerm = apps.get_model('clinic', 'SearchTerm')
+    DoctorDailyReport = apps.get_model('clinic', 'DoctorDailyReport')
+    entries, words, terms = [], [], Counter()
+    for kind, (model_name, name_field, filters, report_path) in SOURCES.items():
+        objects = apps.get_model('clinic', model_name).objects.filter(active=True, **filters)
+        popularity = dict(DoctorDailyReport.objects.values_list(report_path).annotate(total=Sum('booked')).order_by())
+        for object_id, name in objects.values_list('pk', name_field):
+            normalized = normalize(name)[:255]
+            entry_words = list(dict.fromkeys(word[:50] for word in normalized.split()))
+            if not entry_words:
+                continue
+            score = popularity.get(object_id) or 0
+            entries.append(SearchEntry(kind=kind, object_id=object_id, name=name[:255], normalized=normalized,
+                                       popularity=score))
+            words += [SearchWord(word=word, kind=kind, object_id=object_id, popularity=score) for word in entry_words]
+            terms.update(entry_words)
+
+    SearchEntry.objects.bulk_create(entries, batch_size=1000)
+    SearchWord.objects.bulk_create(words, batch_size=1000)
+    SearchTerm.objects.bulk_create([SearchTerm(word=word, entries=count) for word, count in terms.items()],
+                                   batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0021_image_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=50, unique=True)),
+                ('entries', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('doctor', 'Bác sĩ'), ('hospital', 'Bệnh viện'), ('specialization', 'Chuyên khoa')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('normalized', models.CharField(max_length=255)),
+                ('popularity', models.PositiveIntegerField(default=0)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_search_entry')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=50)),
+                ('kind', models.CharField(choices=[('doctor', 'Bác sĩ'), ('hospital', 'Bệnh viện'), ('specialization', 'Chuyên khoa')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('popularity', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['word', 'popularity', 'kind', 'object_id'], name='search_word_idx'), models.Index(fields=['kind', 'object_id', 'word'], name='search_word_target_idx')],
+            },
+        ),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
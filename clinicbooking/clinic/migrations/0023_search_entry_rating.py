@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+def populate_rating(apps, schema_editor):
+    # Số sao trung bình của các bác sĩ đã có đánh giá (lấy từ DoctorRatingStats)
+    SearchEntry = apps.get_model('clinic', 'SearchEntry')
+    Doctor = apps.get_model('clinic', 'Doctor')
+    DoctorRatingStats = apps.get_model('clinic', 'DoctorRatingStats')
+    ratings = {doctor_id: round(rating_sum / review_count, 2) for doctor_id, rating_sum, review_count
+               in DoctorRatingStats.objects.filter(review_count__gt=0)
+               .values_list('doctor_id', 'rating_sum', 'review_count')}
+    doctors = dict(Doctor.objects.filter(user_id__in=ratings).values_list('pk', 'user_id'))
+    entries = list(SearchEntry.objects.filter(kind='doctor', object_id__in=doctors))
+    for entry in entries:
+        entry.rating = ratings[doctors[entry.object_id]]
+    SearchEntry.objects.bulk_update(entries, ['rating'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0022_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchentry',
+            name='rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(populate_rating, migrations.RunPython.noop),
+    ]
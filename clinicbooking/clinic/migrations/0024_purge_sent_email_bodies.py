@@ -0,0 +1,20 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:05
+
+from django.db import migrations
+
+
+def purge_sent_bodies(apps, schema_editor):
+    # Xoá nội dung các email đã gửi trước đây (có thể chứa mã OTP đặt lại mật khẩu)
+    EmailOutbox = apps.get_model('clinic', 'EmailOutbox')
+    EmailOutbox.objects.filter(status='sent').update(body='', html_body='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0023_search_entry_rating'),
+    ]
+
+    operations = [
+        migrations.RunPython(purge_sent_bodies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0024_purge_sent_email_bodies'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Đang xử lý'), ('paid', 'Đã thanh toán'), ('failed', 'Thất bại'), ('refund', 'Chờ hoàn tiền')], default='pending', max_length=20),
+        ),
+    ]
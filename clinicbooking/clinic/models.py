@@ -59,6 +59,16 @@ class Specialization(BaseModel):
         return self.name
 
 
+class DoctorQuerySet(models.QuerySet):
+    def with_rating_stats(self):
+        """
+        Lấy kèm thống kê đánh giá (DoctorRatingStats) của bác sĩ ngay trong câu truy vấn
+        (tránh mỗi bác sĩ phải truy vấn thêm bảng Review)
+        :return: QuerySet đã select_related user__rating_stats
+        """
+        return self.select_related('user__rating_stats')
+
+
 class Doctor(BaseModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     license_number = models.CharField(max_length=20, unique=True, null=True, blank=True)
@@ -71,6 +81,8 @@ class Doctor(BaseModel):
                                            )
     is_verified = models.BooleanField(default=False)
 
+    objects = DoctorQuerySet.as_manager()
+
     def __str__(self):
         return (f"BS {self.user.full_name} - BV {self.hospital.name} - {self.specialization.name}")
 
@@ -122,13 +134,72 @@ class Notification(BaseModel):
     type = models.CharField(max_length=20, choices=NotifyType, default=NotifyType.UU_DAI)
     send_at = models.DateTimeField(null=False)
     is_read = models.BooleanField(default=False)
-    users = models.ManyToManyField('User')
+    # Người nhận; bỏ trống là gửi cho tất cả bệnh nhân
+    users = models.ManyToManyField('User', blank=True)
+    # Thời điểm đã đưa vào hộp thư của người nhận (clinic/notifications.py)
+    published_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Worker nhận gửi thông báo lúc nào (worker bị dừng giữa chừng thì worker khác nhận lại sau một thời gian)
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Thống kê gửi: số người nhận vào hộp thư, số email đưa vào hàng đợi, số push gửi được/lỗi
+    delivered_count = models.PositiveIntegerField(default=0, editable=False)
+    emailed_count = models.PositiveIntegerField(default=0, editable=False)
+    pushed_count = models.PositiveIntegerField(default=0, editable=False)
+    failed_count = models.PositiveIntegerField(default=0, editable=False)
+    dispatch_ms = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Worker tìm các thông báo đến hạn gửi: published_at IS NULL AND send_at <= now
+            models.Index(fields=['published_at', 'send_at'], name='notification_due_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
+class UserNotification(models.Model):
+    """
+    Hộp thư thông báo của từng người nhận, được thêm hàng loạt khi thông báo được gửi (clinic/notifications.py).
+    Mỗi người đọc/chưa đọc độc lập với nhau thay vì dùng chung Notification.is_read.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox')
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='deliveries')
+    is_read = models.BooleanField(default=False)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'notification'], name='unique_user_notification'),
+        ]
+        indexes = [
+            # Hộp thư của user theo thứ tự mới nhất (phân trang keyset theo id)
+            models.Index(fields=['user', 'id'], name='inbox_user_id'),
+            # Đánh dấu đã đọc tất cả
+            models.Index(fields=['user', 'is_read'], name='inbox_user_unread'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.notification}"
+
+
+class NotificationCounter(models.Model):
+    """
+    Số thông báo chưa đọc của từng user, cập nhật cùng lúc với hộp thư để API đếm không phải COUNT
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.unread} chưa đọc"
 
 
 class TestResult(BaseModel):
     test_name = models.CharField(max_length=255, null=False)
     description = models.CharField(max_length=255, null=True)
     image = CloudinaryField(null=False)
+    # Ảnh thu nhỏ tạo khi tải ảnh lên (clinic/imaging.py)
+    thumbnail = CloudinaryField(null=True, blank=True)
     health_record = models.ForeignKey(HealthRecord, on_delete=models.PROTECT, null=False)
 
     def __str__(self):
@@ -142,6 +213,12 @@ class Message(BaseModel):
     receiver = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='received_messages', null=True)
     test_result = models.OneToOneField(TestResult, on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Tin nhắn của một cuộc trò chuyện theo thời gian (MessageViewSet)
+            models.Index(fields=['sender', 'receiver', 'created_date'], name='message_conversation'),
+        ]
+
     def __str__(self):
         return (f"{self.sender} - {self.receiver}")
 
@@ -161,6 +238,36 @@ class Review(BaseModel):
         return f"Review by {self.patient} for {self.doctor}: {self.rating}⭐ - {self.comment} - {self.reply if self.reply else 'None'}"
 
 
+class DoctorRatingStats(models.Model):
+    """
+    Thống kê đánh giá của từng bác sĩ, được cập nhật mỗi khi Review thay đổi
+    (signal của Review trong clinic/signals.py) để không phải tính AVG/COUNT trên toàn bảng Review.
+    Có thể tính lại toàn bộ bằng lệnh: python manage.py rebuild_rating_stats
+    """
+    doctor = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rating_stats')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    # Số lượt đánh giá theo từng mức sao
+    star_1 = models.PositiveIntegerField(default=0)
+    star_2 = models.PositiveIntegerField(default=0)
+    star_3 = models.PositiveIntegerField(default=0)
+    star_4 = models.PositiveIntegerField(default=0)
+    star_5 = models.PositiveIntegerField(default=0)
+    last_review_at = models.DateTimeField(null=True, blank=True)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_rating(self):
+        return round(self.rating_sum / self.review_count, 1) if self.review_count else 0
+
+    @property
+    def histogram(self):
+        return {star: getattr(self, f'star_{star}') for star in range(1, 6)}
+
+    def __str__(self):
+        return f"{self.doctor} - {self.average_rating}⭐ ({self.review_count})"
+
+
 class Schedule(BaseModel):
     doctor = models.ForeignKey(User, on_delete=models.CASCADE)
     date = models.DateField()
@@ -182,12 +289,74 @@ class Schedule(BaseModel):
     class Meta:
         # Tránh bác sĩ bị trùng ngày và giờ bắt đầu
         unique_together = ('doctor', 'date', 'start_time')
+        indexes = [
+            # Lọc lịch còn trống của bác sĩ theo ngày (ScheduleViewSet, lịch khả dụng)
+            models.Index(fields=['doctor', 'date', 'active'], name='schedule_doctor_date_active'),
+        ]
 
     def __str__(self):
         return (f"ID {self.pk} - {self.doctor.username} - ngày {self.date.strftime('%d/%m/%Y')}: "
                 f"{self.start_time.strftime('%H:%M')} - {self.end_time.strftime('%H:%M')}")
 
 
+class ScheduleTemplate(BaseModel):
+    """
+    Lịch làm việc lặp lại hằng tuần của bác sĩ (vd: Thứ 2, 08:00 - 11:00, mỗi lượt 30 phút).
+    Dùng để sinh hàng loạt các Schedule cho một khoảng ngày (clinic/scheduling.py)
+    """
+
+    class Weekday(models.IntegerChoices):
+        MONDAY = 0, 'Thứ 2'
+        TUESDAY = 1, 'Thứ 3'
+        WEDNESDAY = 2, 'Thứ 4'
+        THURSDAY = 3, 'Thứ 5'
+        FRIDAY = 4, 'Thứ 6'
+        SATURDAY = 5, 'Thứ 7'
+        SUNDAY = 6, 'Chủ nhật'
+
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='schedule_templates')
+    weekday = models.PositiveSmallIntegerField(choices=Weekday.choices)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    slot_minutes = models.PositiveSmallIntegerField(default=30, help_text="Thời lượng mỗi lượt khám (phút)")
+    capacity = models.PositiveIntegerField(default=1, help_text="Số bệnh nhân tối đa mỗi lượt khám")
+
+    def clean(self):
+        if self.start_time and self.end_time and self.start_time >= self.end_time:
+            raise ValidationError("Giờ bắt đầu phải trước giờ kết thúc.")
+        if not self.slot_minutes or not self.capacity:
+            raise ValidationError("Thời lượng và số bệnh nhân mỗi lượt khám phải lớn hơn 0.")
+
+    def __str__(self):
+        return (f"{self.doctor.username} - {self.get_weekday_display()}: {self.start_time.strftime('%H:%M')} - "
+                f"{self.end_time.strftime('%H:%M')} ({self.slot_minutes} phút)")
+
+
+class DoctorAvailability(models.Model):
+    """
+    Tổng hợp số chỗ còn trống của mỗi bác sĩ theo từng ngày, được cập nhật mỗi khi lịch khám
+    hoặc số lượt đặt thay đổi (clinic/availability.py) để API lịch trống chỉ cần đọc một bảng nhỏ.
+    Có thể tính lại toàn bộ bằng lệnh: python manage.py rebuild_availability
+    """
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='availability_days')
+    date = models.DateField()
+    # Số khung giờ còn trống / tổng số khung giờ trong ngày
+    free_slots = models.PositiveIntegerField(default=0)
+    slot_count = models.PositiveIntegerField(default=0)
+    # Tổng số chỗ còn trống / tổng sức chứa trong ngày
+    free_capacity = models.PositiveIntegerField(default=0)
+    capacity = models.PositiveIntegerField(default=0)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date'], name='unique_doctor_day_availability'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor.username} - {self.date.strftime('%d/%m/%Y')}: còn {self.free_slots}/{self.slot_count} khung giờ"
+
+
 class Appointment(BaseModel):
     STATUS_CHOICES = [
         ('unpaid', 'Chưa thanh toán'),
@@ -215,15 +384,85 @@ class Appointment(BaseModel):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='unpaid')
     reason = models.CharField(max_length=150, blank=True, null=True)
     cancel = models.BooleanField(default=False)
+    # True khi lịch hẹn còn giữ chỗ, NULL khi đã huỷ (NULL không bị ràng buộc unique nên huỷ rồi đặt lại được)
+    active_booking = models.BooleanField(null=True, default=True, editable=False)
 
     class Meta:
         ordering = ['-id']
-        # unique_together = ('healthrecord', 'schedule')
+        # Một hồ sơ chỉ được giữ 1 chỗ (chưa huỷ) trong cùng một lịch khám
+        # (index của ràng buộc này cũng phục vụ việc kiểm tra trùng lịch theo healthrecord + schedule)
+        constraints = [
+            models.UniqueConstraint(fields=['healthrecord', 'schedule', 'active_booking'],
+                                    name='unique_active_booking'),
+        ]
+        indexes = [
+            # Thống kê lịch khám theo bác sĩ + trạng thái (DoctorReportViewSet, AdminReportViewSet)
+            models.Index(fields=['schedule', 'status'], name='appointment_schedule_status'),
+            # Tìm lịch hẹn chưa thanh toán quá hạn (booking.expire_unpaid_appointments)
+            models.Index(fields=['status', 'created_date'], name='appointment_status_created'),
+        ]
 
     def __str__(self):
         return f"{self.healthrecord} - {self.schedule}"
 
 
+class DoctorDailyReport(models.Model):
+    """
+    Số liệu thống kê của mỗi bác sĩ theo từng ngày khám, được tính lại cho đúng ngày bị ảnh hưởng mỗi khi
+    lịch hẹn hoặc hoá đơn thay đổi (clinic/reports.py). API thống kê theo tháng/quý/năm chỉ cần cộng vài chục dòng.
+    Có thể tính lại bằng lệnh: python manage.py backfill_reports
+    """
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_reports')
+    date = models.DateField()
+    # Lịch hẹn chưa huỷ / đã khám / đã thanh toán nhưng chưa khám / đã huỷ
+    booked = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    paid = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+    # Doanh thu theo phí khám của bác sĩ (tại thời điểm tính) trên các lịch hẹn đã khám
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Tổng tiền các hoá đơn đã thanh toán
+    paid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Số lịch hẹn đã khám theo loại bệnh {disease_type: số lượng}
+    disease_counts = models.JSONField(default=dict, blank=True)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date'], name='unique_doctor_daily_report'),
+        ]
+        indexes = [
+            # Thống kê toàn hệ thống theo khoảng ngày (AdminReportViewSet)
+            models.Index(fields=['date'], name='daily_report_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor.username} - {self.date.strftime('%d/%m/%Y')}: {self.completed}/{self.booked} đã khám"
+
+
+class StatsSnapshot(models.Model):
+    """
+    Số liệu đã tính sẵn của trang thống kê admin cho một khoảng thời gian (clinic/reports.py).
+    Trang thống kê chỉ đọc dòng này, quá ADMIN_STATS_MAX_AGE giây thì mới tính lại.
+    """
+    start = models.DateField()
+    end = models.DateField()
+    granularity = models.CharField(max_length=10)
+    data = models.JSONField(default=dict)
+    computed_at = models.DateTimeField()
+    # Thời gian tính số liệu của lần cập nhật gần nhất (ms)
+    duration_ms = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['start', 'end', 'granularity'], name='unique_stats_snapshot'),
+        ]
+
+    def __str__(self):
+        return (f"{self.start.strftime('%d/%m/%Y')} - {self.end.strftime('%d/%m/%Y')} ({self.granularity}): "
+                f"cập nhật {self.computed_at.strftime('%d/%m/%Y %H:%M')}")
+
+
 class Payment(BaseModel):
     class PaymentMethod(models.TextChoices):
         MOMO = 'momo', 'MoMo'
@@ -233,6 +472,8 @@ class Payment(BaseModel):
         PENDING = 'pending', 'Đang xử lý'
         PAID = 'paid', 'Đã thanh toán'
         FAILED = 'failed', 'Thất bại'
+        # Cổng thanh toán báo thành công sau khi lịch hẹn đã bị huỷ, cần hoàn tiền cho bệnh nhân
+        REFUND = 'refund', 'Chờ hoàn tiền'
 
     method = models.CharField(max_length=20, choices=PaymentMethod)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -253,4 +494,136 @@ class PasswordResetOTP(models.Model):
         return timezone.now() > self.created_at + timedelta(minutes=10)
 
     def __str__(self):
-        return(f"username: {self.user} - OTP Code:{self.otp_code}")
\ No newline at end of file
+        return(f"username: {self.user} - OTP Code:{self.otp_code}")
+
+
+class MediaUpload(models.Model):
+    """
+    Hàng đợi tải ảnh lên Cloudinary: request chỉ lưu file tạm trên ổ đĩa (MEDIA_STAGING_ROOT) và ghi vào bảng này,
+    worker (python manage.py process_uploads) sẽ tải lên rồi cập nhật trường ảnh của đối tượng
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Chờ tải lên'
+        UPLOADED = 'uploaded', 'Đã tải lên'
+        DEAD = 'dead', 'Tải lên thất bại'
+
+    # Đối tượng và trường ảnh cần cập nhật (vd: clinic.user, 12, avatar)
+    model = models.CharField(max_length=100)
+    object_id = models.PositiveIntegerField()
+    field = models.CharField(max_length=50)
+    path = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=Status, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # Dung lượng trước/sau khi nén (chỉ với ảnh được nén, clinic/imaging.py)
+    original_bytes = models.PositiveIntegerField(null=True, blank=True)
+    stored_bytes = models.PositiveIntegerField(null=True, blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    uploaded_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='media_upload_due_idx'),
+            models.Index(fields=['model', 'object_id', 'field'], name='media_upload_target_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} #{self.object_id}.{self.field} - {self.status}"
+
+
+class EmailOutbox(models.Model):
+    """
+    Hàng đợi email gửi đi: request chỉ ghi email vào bảng này,
+    worker (python manage.py send_queued_emails) sẽ gửi ở background.
+    Nội dung email được xoá sau khi gửi thành công.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Chờ gửi'
+        SENT = 'sent', 'Đã gửi'
+        DEAD = 'dead', 'Gửi thất bại'
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255, null=True, blank=True)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=Status, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='email_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} - {', '.join(self.to)} - {self.status}"
+
+
+class SearchEntry(models.Model):
+    """
+    Chỉ mục tìm kiếm bác sĩ, bệnh viện, chuyên khoa (clinic/search.py, clinic/autocomplete.py): tên đã bỏ dấu,
+    chữ thường, độ phổ biến (số lượt đặt khám) và số sao, được cập nhật mỗi khi đối tượng được lưu.
+    Có thể tính lại toàn bộ bằng lệnh: python manage.py rebuild_search_index
+    """
+
+    class Kind(models.TextChoices):
+        DOCTOR = 'doctor', 'Bác sĩ'
+        HOSPITAL = 'hospital', 'Bệnh viện'
+        SPECIALIZATION = 'specialization', 'Chuyên khoa'
+
+    kind = models.CharField(max_length=20, choices=Kind)
+    object_id = models.PositiveIntegerField()
+    name = models.CharField(max_length=255)
+    # vd: 'Nguyễn Văn Đức' -> 'nguyen van duc'
+    normalized = models.CharField(max_length=255)
+    popularity = models.PositiveIntegerField(default=0)
+    # Số sao trung bình (chỉ với bác sĩ)
+    rating = models.FloatField(default=0)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_search_entry'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.object_id} - {self.name}"
+
+
+class SearchWord(models.Model):
+    """
+    Mỗi từ (đã chuẩn hoá) trong tên của một mục tìm kiếm, tra theo index search_word_idx
+    thay vì LIKE '%...%' trên toàn bảng
+    """
+    word = models.CharField(max_length=50)
+    kind = models.CharField(max_length=20, choices=SearchEntry.Kind)
+    object_id = models.PositiveIntegerField()
+    # Sao chép từ SearchEntry để sắp xếp ứng viên ngay trên index
+    popularity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['word', 'popularity', 'kind', 'object_id'], name='search_word_idx'),
+            models.Index(fields=['kind', 'object_id', 'word'], name='search_word_target_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.word} - {self.kind} #{self.object_id}"
+
+
+class SearchTerm(models.Model):
+    """
+    Từ điển các từ có trong chỉ mục kèm số mục chứa từ đó, dùng để sửa lỗi gõ sai và gợi ý theo tiền tố
+    """
+    word = models.CharField(max_length=50, unique=True)
+    entries = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.word} ({self.entries})"
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+
+from clinic.consumers import notification_group
+from clinic.models import Notification, UserNotification, NotificationCounter, User, EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+# Số người nhận được thêm vào hộp thư trong một lô
+BATCH_SIZE = 5000
+
+
+def recipients(notification):
+    """
+    Id của những người nhận thông báo: những user được chọn, bỏ trống là tất cả bệnh nhân
+    :return: QuerySet id user
+    """
+    if notification.users.exists():
+        return notification.users.filter(is_active=True).values_list('id', flat=True)
+    return User.objects.filter(role='patient', is_active=True).values_list('id', flat=True)
+
+
+class ChannelsPushBackend:
+    """
+    Đẩy thông báo qua WebSocket (ws/notifications/) đến các user đang kết nối
+    """
+
+    def send(self, user_ids, payload):
+        """
+        :param user_ids: Danh sách id user nhận
+        :param payload: Nội dung thông báo (cùng định dạng với hộp thư)
+        :return: số user gửi lỗi
+        """
+        async def send_all(layer):
+            results = await asyncio.gather(
+                *(layer.group_send(notification_group(user_id), {'type': 'notification.push', 'notification': payload})
+                  for user_id in user_ids), return_exceptions=True)
+            return sum(isinstance(result, Exception) for result in results)
+
+        try:
+            return async_to_sync(send_all)(get_channel_layer())
+        except Exception:
+            logger.exception("Không thể đẩy thông báo tới %s user", len(user_ids))
+            return len(user_ids)
+
+
+def push_backend():
+    return import_string(settings.NOTIFICATION_PUSH_BACKEND)()
+
+
+def _deliver(notification, user_ids):
+    # Bỏ qua người đã có thông báo trong hộp thư để gửi lại không bị trùng và không đếm thừa
+    existing = set(UserNotification.objects.filter(notification=notification, user_id__in=user_ids)
+                   .values_list('user_id', flat=True))
+    new_ids = [user_id for user_id in user_ids if user_id not in existing]
+    if not new_ids:
+        return new_ids
+    UserNotification.objects.bulk_create(
+        [UserNotification(user_id=user_id, notification=notification) for user_id in new_ids],
+        batch_size=BATCH_SIZE)
+    NotificationCounter.objects.bulk_create([NotificationCounter(user_id=user_id) for user_id in new_ids],
+                                            batch_size=BATCH_SIZE, ignore_conflicts=True)
+    NotificationCounter.objects.filter(user_id__in=new_ids).update(unread=F('unread') + 1)
+    return new_ids
+
+
+def _queue_emails(notification, user_ids):
+    # Email được đưa vào hàng đợi EmailOutbox (gửi bởi send_queued_emails) cùng transaction với hộp thư
+    emails = User.objects.filter(id__in=user_ids).exclude(email='').values_list('email', flat=True)
+    body = strip_tags(notification.content)
+    outbox = [EmailOutbox(subject=notification.title, body=body, html_body=notification.content,
+                          from_email=settings.DEFAULT_FROM_EMAIL, to=[email]) for email in emails]
+    EmailOutbox.objects.bulk_create(outbox, batch_size=BATCH_SIZE)
+    return len(outbox)
+
+
+def _payload(notification):
+    from clinic.serializers import InboxSerializer
+
+    return InboxSerializer(UserNotification(notification=notification, created_date=timezone.now())).data
+
+
+def publish(notification, channels=None):
+    """
+    Đưa thông báo vào hộp thư của tất cả người nhận bằng các lô bulk insert (mỗi lô BATCH_SIZE người),
+    đồng thời tăng bộ đếm chưa đọc của họ, xếp email vào hàng đợi và đẩy push cho đúng những người mới nhận.
+    Gọi lại nhiều lần (kể cả khi lần trước bị dừng giữa chừng) không bị gửi trùng.
+    Thống kê gửi được cộng dồn vào các trường *_count của thông báo.
+    :param notification: Notification cần gửi
+    :param channels: Các kênh gửi ngoài hộp thư ('email', 'push'), mặc định NOTIFICATION_CHANNELS
+    :return: số người nhận mới
+    """
+    channels = settings.NOTIFICATION_CHANNELS if channels is None else channels
+    started = time.monotonic()
+    pusher = push_backend() if 'push' in channels else None
+    payload = _payload(notification) if pusher else None
+    delivered = 0
+
+    def flush(batch):
+        with transaction.atomic():
+            new_ids = _deliver(notification, batch)
+            if not new_ids:
+                return 0
+            emailed = _queue_emails(notification, new_ids) if 'email' in channels else 0
+            Notification.objects.filter(pk=notification.pk).update(
+                delivered_count=F('delivered_count') + len(new_ids), emailed_count=F('emailed_count') + emailed)
+        if pusher:
+            failed = pusher.send(new_ids, payload)
+            Notification.objects.filter(pk=notification.pk).update(
+                pushed_count=F('pushed_count') + len(new_ids) - failed, failed_count=F('failed_count') + failed)
+        return len(new_ids)
+
+    batch = []
+    for user_id in recipients(notification).order_by('id').iterator(chunk_size=BATCH_SIZE):
+        batch.append(user_id)
+        if len(batch) == BATCH_SIZE:
+            delivered += flush(batch)
+            batch = []
+    delivered += flush(batch)
+    Notification.objects.filter(pk=notification.pk).update(
+        published_at=timezone.now(), dispatch_ms=int((time.monotonic() - started) * 1000))
+    return delivered
+
+
+def due_notifications(now=None):
+    """
+    Các thông báo đã tới send_at nhưng chưa gửi (tìm theo index notification_due_idx)
+    :return: QuerySet Notification
+    """
+    return Notification.objects.filter(published_at__isnull=True, send_at__lte=now or timezone.now(), active=True)
+
+
+def claim_due(limit=None, now=None):
+    """
+    Nhận một lô thông báo đến hạn gửi.
+    Các dòng được khoá bằng SELECT ... FOR UPDATE SKIP LOCKED rồi đánh dấu claimed_at nên nhiều worker
+    chạy cùng lúc không nhận trùng; thông báo bị nhận quá NOTIFICATION_CLAIM_TIMEOUT giây mà chưa gửi xong
+    (worker bị dừng) sẽ được nhận lại.
+    :param limit: Số thông báo tối đa, mặc định NOTIFICATION_DISPATCH_BATCH_SIZE
+    :return: danh sách Notification
+    """
+    limit = limit or settings.NOTIFICATION_DISPATCH_BATCH_SIZE
+    now = now or timezone.now()
+    stale = now - timedelta(seconds=settings.NOTIFICATION_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        due = list(due_notifications(now).select_for_update(skip_locked=True)
+                   .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale))
+                   .order_by('send_at', 'id')[:limit])
+        Notification.objects.filter(pk__in=[notification.pk for notification in due]).update(claimed_at=now)
+    return due
+
+
+def dispatch_due(limit=None):
+    """
+    Gửi một lô thông báo đến hạn (python manage.py dispatch_notifications)
+    :param limit: Số thông báo tối đa trong một lô
+    :return: (số thông báo đã gửi, tổng số người nhận mới)
+    """
+    due = claim_due(limit)
+    delivered = 0
+    for notification in due:
+        try:
+            delivered += publish(notification)
+        except Exception:
+            # Thông báo lỗi giữ claimed_at, sẽ được thử lại sau NOTIFICATION_CLAIM_TIMEOUT giây
+            logger.exception("Không thể gửi thông báo #%s", notification.pk)
+    return len(due), delivered
+
+
+def unread_count(user):
+    return NotificationCounter.objects.filter(user=user).values_list('unread', flat=True).first() or 0
+
+
+@transaction.atomic
+def mark_read(user, notification_id):
+    """
+    Đánh dấu một thông báo trong hộp thư của user là đã đọc
+    :return: True nếu thông báo chuyển từ chưa đọc sang đã đọc
+    """
+    updated = UserNotification.objects.filter(user=user, notification_id=notification_id, is_read=False) \
+        .update(is_read=True)
+    if updated:
+        NotificationCounter.objects.filter(user=user, unread__gt=0).update(unread=F('unread') - 1)
+    return bool(updated)
+
+
+@transaction.atomic
+def mark_all_read(user):
+    """
+    Đánh dấu tất cả thông báo của user là đã đọc
+    :return: số thông báo được đánh dấu
+    """
+    # Khoá bộ đếm để thông báo được gửi cùng lúc không bị trừ nhầm
+    list(NotificationCounter.objects.select_for_update().filter(user=user).values_list('pk'))
+    updated = UserNotification.objects.filter(user=user, is_read=False).update(is_read=True)
+    if updated:
+        NotificationCounter.objects.filter(user=user).update(unread=F('unread') - updated)
+    return updated
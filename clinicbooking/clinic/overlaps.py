@@ -0,0 +1,107 @@
+import bisect
+from collections import defaultdict
+
+from rest_framework.exceptions import ValidationError
+
+from clinic.models import Schedule, Appointment
+
+# Hai khung giờ [start, end) giao nhau khi start < end kia và end > start kia
+# (khung 08:00-09:00 và 09:00-10:00 nối tiếp nhau, không tính là trùng)
+
+
+def doctor_conflicts(doctor_id, day, start_time, end_time, exclude_id=None):
+    """
+    Các lịch khám của bác sĩ trong ngày có khung giờ giao với [start_time, end_time).
+    Truy vấn dùng index unique (doctor, date, start_time) nên chỉ đọc các lịch trong ngày của bác sĩ đó.
+    :param exclude_id: bỏ qua lịch đang được sửa
+    :return: QuerySet Schedule
+    """
+    queryset = Schedule.objects.filter(doctor_id=doctor_id, date=day,
+                                       start_time__lt=end_time, end_time__gt=start_time)
+    if exclude_id:
+        queryset = queryset.exclude(pk=exclude_id)
+    return queryset
+
+
+def patient_conflicts(healthrecord_id, schedule, exclude_id=None):
+    """
+    Các lịch hẹn chưa huỷ của hồ sơ có khung giờ giao với lịch khám được chọn (ở bất kỳ bác sĩ nào).
+    Truy vấn đi từ index unique_active_booking (healthrecord, ...) rồi nối sang lịch khám theo khoá chính.
+    :param exclude_id: bỏ qua lịch hẹn đang được đổi
+    :return: QuerySet Appointment
+    """
+    queryset = Appointment.objects.filter(healthrecord_id=healthrecord_id, cancel=False,
+                                          schedule__date=schedule.date,
+                                          schedule__start_time__lt=schedule.end_time,
+                                          schedule__end_time__gt=schedule.start_time)
+    if exclude_id:
+        queryset = queryset.exclude(pk=exclude_id)
+    return queryset
+
+
+def check_schedule(doctor_id, day, start_time, end_time, exclude_id=None):
+    """
+    Kiểm tra khung giờ của lịch khám mới/đang sửa
+    :raise ValidationError: giờ không hợp lệ hoặc trùng với lịch khác của bác sĩ
+    """
+    if start_time >= end_time:
+        raise ValidationError("Giờ bắt đầu phải trước giờ kết thúc.")
+    conflict = doctor_conflicts(doctor_id, day, start_time, end_time, exclude_id).order_by('start_time').first()
+    if conflict:
+        raise ValidationError(f"Bác sĩ đã có lịch khám {conflict.start_time.strftime('%H:%M')} - "
+                              f"{conflict.end_time.strftime('%H:%M')} trùng khung giờ này.")
+
+
+def check_patient(healthrecord_id, schedule, exclude_id=None):
+    """
+    Kiểm tra hồ sơ không có lịch hẹn khác trùng khung giờ với lịch khám được chọn
+    :raise ValidationError: nếu bị trùng
+    """
+    if patient_conflicts(healthrecord_id, schedule, exclude_id).exists():
+        raise ValidationError("Bạn đã có lịch khám trong khoảng thời gian này.")
+
+
+class IntervalIndex:
+    """
+    Chỉ mục khung giờ trong bộ nhớ cho các thao tác hàng loạt (vd: sinh lịch từ lịch mẫu):
+    nạp các lịch đã có một lần, sau đó mỗi lần kiểm tra trùng chỉ tốn O(log n) bằng bisect.
+    Mỗi khoá (vd: (doctor_id, date)) giữ danh sách các khung giờ đã gộp, sắp xếp và không giao nhau.
+    """
+
+    def __init__(self):
+        self._intervals = defaultdict(list)
+
+    @classmethod
+    def for_schedules(cls, doctor_ids, start, end):
+        """
+        Nạp các lịch khám của các bác sĩ trong khoảng ngày [start, end] bằng một truy vấn
+        :return: IntervalIndex với khoá (doctor_id, date)
+        """
+        index = cls()
+        existing = Schedule.objects.filter(doctor_id__in=doctor_ids, date__range=(start, end)) \
+            .order_by('doctor_id', 'date', 'start_time').values_list('doctor_id', 'date', 'start_time', 'end_time')
+        for doctor_id, day, start_time, end_time in existing.iterator(chunk_size=2000):
+            index.add((doctor_id, day), start_time, end_time)
+        return index
+
+    def overlaps(self, key, start, end):
+        intervals = self._intervals.get(key)
+        if not intervals:
+            return False
+        i = bisect.bisect_left(intervals, (start, end))
+        if i > 0 and intervals[i - 1][1] > start:
+            return True
+        return i < len(intervals) and intervals[i][0] < end
+
+    def add(self, key, start, end):
+        # Gộp với các khung giờ đang giao nhau để danh sách luôn không giao nhau
+        # (dữ liệu cũ có thể đã có lịch chồng lên nhau)
+        intervals = self._intervals[key]
+        lo = bisect.bisect_left(intervals, (start, end))
+        if lo > 0 and intervals[lo - 1][1] > start:
+            lo -= 1
+        hi = lo
+        while hi < len(intervals) and intervals[hi][0] < end:
+            start, end = min(start, intervals[hi][0]), max(end, intervals[hi][1])
+            hi += 1
+        intervals[lo:hi] = [(start, end)]
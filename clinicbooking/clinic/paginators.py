@@ -1,5 +1,51 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 
 class UserPagination(PageNumberPagination):
-    page_size = 3
\ No newline at end of file
+    page_size = 3
+
+
+class StandardPagination(PageNumberPagination):
+    """
+    Phân trang mặc định cho các API danh sách (?page=&page_size=).
+    Số phần tử mỗi trang lấy từ REST_FRAMEWORK['PAGE_SIZE'].
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Phân trang theo OFFSET cần thứ tự cố định, nếu chưa có thì sắp theo khoá chính
+        if hasattr(queryset, 'ordered') and not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        return super().paginate_queryset(queryset, request, view)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Phân trang theo keyset (?cursor=) cho các bảng chỉ thêm dòng mới và lớn dần theo thời gian.
+    Mỗi trang là WHERE id < (hoặc >) giá trị cuối của trang trước ... LIMIT page_size,
+    nên trang sâu vẫn chỉ đọc page_size dòng thay vì bỏ qua OFFSET dòng.
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class AppointmentPagination(KeysetPagination):
+    ordering = '-id'  # lịch hẹn mới nhất trước
+
+
+class PaymentPagination(KeysetPagination):
+    ordering = '-id'
+
+
+class MessagePagination(KeysetPagination):
+    ordering = 'id'  # tin nhắn theo thứ tự gửi
+
+
+class ReviewPagination(KeysetPagination):
+    ordering = 'id'
+
+
+class InboxPagination(KeysetPagination):
+    ordering = '-id'  # thông báo mới nhất trước
@@ -0,0 +1,128 @@
+from django.db import transaction
+from django.db.models import F, Q, Count, Sum, Max
+
+from clinic import caching
+from clinic.models import Review, DoctorRatingStats
+
+STAT_FIELDS = ['review_count', 'rating_sum', 'star_1', 'star_2', 'star_3', 'star_4', 'star_5', 'last_review_at']
+
+
+def get_rating_stats(user):
+    """
+    Lấy thống kê đánh giá của bác sĩ (None nếu bác sĩ chưa có đánh giá nào)
+    :param user: User của bác sĩ
+    :return: DoctorRatingStats hoặc None
+    """
+    try:
+        return user.rating_stats
+    except DoctorRatingStats.DoesNotExist:
+        return None
+
+
+def _apply(doctor_id, rating, sign):
+    """
+    Cộng (sign=1) hoặc trừ (sign=-1) một lượt đánh giá vào thống kê của bác sĩ.
+    Dùng biểu thức F() để cập nhật nguyên tử ngay trên database.
+    """
+    if not doctor_id:
+        return
+    # Chỉ tạo dòng thống kê khi cộng thêm; khi trừ thì dòng đã có sẵn
+    # (hoặc đã bị xoá cùng bác sĩ thì không cần tạo lại)
+    if sign > 0:
+        DoctorRatingStats.objects.get_or_create(doctor_id=doctor_id)
+    DoctorRatingStats.objects.filter(pk=doctor_id).update(**{
+        'review_count': F('review_count') + sign,
+        'rating_sum': F('rating_sum') + sign * rating,
+        f'star_{rating}': F(f'star_{rating}') + sign,
+    })
+
+
+def _refresh_last_review_at(doctor_id):
+    if not doctor_id:
+        return
+    last = Review.objects.filter(doctor_id=doctor_id).aggregate(last=Max('created_date'))['last']
+    DoctorRatingStats.objects.filter(pk=doctor_id).update(last_review_at=last)
+
+
+@transaction.atomic
+def review_created(review):
+    _apply(review.doctor_id, review.rating, 1)
+    DoctorRatingStats.objects.filter(pk=review.doctor_id).update(last_review_at=review.created_date)
+
+
+@transaction.atomic
+def review_updated(review, old_doctor_id, old_rating):
+    """
+    Cập nhật thống kê khi đánh giá bị sửa (đổi số sao hoặc đổi bác sĩ)
+    :param review: Review sau khi sửa
+    :param old_doctor_id: bác sĩ trước khi sửa
+    :param old_rating: số sao trước khi sửa
+    """
+    if review.doctor_id == old_doctor_id and review.rating == old_rating:
+        return
+    _apply(old_doctor_id, old_rating, -1)
+    _apply(review.doctor_id, review.rating, 1)
+    if review.doctor_id != old_doctor_id:
+        _refresh_last_review_at(old_doctor_id)
+        _refresh_last_review_at(review.doctor_id)
+
+
+@transaction.atomic
+def review_deleted(doctor_id, rating):
+    _apply(doctor_id, rating, -1)
+    _refresh_last_review_at(doctor_id)
+
+
+def compute_stats():
+    """
+    Tính thống kê đánh giá của tất cả bác sĩ trực tiếp từ bảng Review
+    :return: dict {doctor_id: {field: value}}
+    """
+    rows = (Review.objects.filter(doctor__isnull=False)
+            .values('doctor_id')
+            .annotate(review_count=Count('id'),
+                      rating_sum=Sum('rating'),
+                      star_1=Count('id', filter=Q(rating=1)),
+                      star_2=Count('id', filter=Q(rating=2)),
+                      star_3=Count('id', filter=Q(rating=3)),
+                      star_4=Count('id', filter=Q(rating=4)),
+                      star_5=Count('id', filter=Q(rating=5)),
+                      last_review_at=Max('created_date'))
+            .order_by())
+    return {row.pop('doctor_id'): row for row in rows}
+
+
+@transaction.atomic
+def rebuild_stats():
+    """
+    Xoá và tính lại toàn bộ bảng DoctorRatingStats
+    :return: số dòng thống kê được tạo
+    """
+    stats = compute_stats()
+    DoctorRatingStats.objects.all().delete()
+    DoctorRatingStats.objects.bulk_create(
+        [DoctorRatingStats(doctor_id=doctor_id, **values) for doctor_id, values in stats.items()],
+        batch_size=1000)
+    # bulk_create không phát signal nên phải tự xoá cache danh sách bác sĩ
+    caching.invalidate_on_commit(caching.DOCTORS)
+    return len(stats)
+
+
+def find_drift():
+    """
+    So sánh bảng DoctorRatingStats với số liệu thực tế trong bảng Review
+    :return: list các dict {doctor_id, field, stored, expected} bị lệch
+    """
+    expected = compute_stats()
+    stored = {row.pop('doctor_id'): row for row in DoctorRatingStats.objects.values('doctor_id', *STAT_FIELDS)}
+    empty = dict.fromkeys(STAT_FIELDS, 0)
+    empty['last_review_at'] = None
+
+    drift = []
+    for doctor_id in sorted(expected.keys() | stored.keys()):
+        exp = expected.get(doctor_id, empty)
+        cur = stored.get(doctor_id, empty)
+        for field in STAT_FIELDS:
+            if exp[field] != cur[field]:
+                drift.append({'doctor_id': doctor_id, 'field': field, 'stored': cur[field], 'expected': exp[field]})
+    return drift
@@ -0,0 +1,304 @@
+import json
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Sum, Q, F, DecimalField, DateField, Value
+from django.db.models.functions import Coalesce, Trunc
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from clinic.models import Appointment, DoctorDailyReport, StatsSnapshot
+from clinic.upsert import upsert
+
+GRANULARITIES = ['day', 'week', 'month', 'quarter']
+# Giới hạn số mốc thời gian của một lần thống kê (vd: hơn 1 năm theo ngày)
+MAX_BUCKETS = 400
+
+SUMMARY_FIELDS = ['booked', 'completed', 'paid', 'cancelled', 'revenue', 'paid_amount', 'disease_counts']
+TOTAL_FIELDS = ['booked', 'completed', 'paid', 'cancelled', 'revenue', 'paid_amount']
+
+ZERO = Value(Decimal('0.00'), output_field=DecimalField())
+GROUP_BY = {'doctor_id': F('schedule__doctor_id'), 'date': F('schedule__date')}
+
+
+def period_range(year, month=None, quarter=None):
+    """
+    Khoảng ngày của một tháng, một quý hoặc cả năm
+    :return: (ngày đầu, ngày cuối)
+    """
+    if month:
+        first_month, months = month, 1
+    elif quarter:
+        first_month, months = (quarter - 1) * 3 + 1, 3
+    else:
+        first_month, months = 1, 12
+    last_month = first_month + months - 1
+    next_start = date(year + 1, 1, 1) if last_month == 12 else date(year, last_month + 1, 1)
+    return date(year, first_month, 1), next_start - timedelta(days=1)
+
+
+def months_before(day, months):
+    """
+    Ngày đầu của tháng cách tháng chứa day một số tháng (vd: months_before(18/10/2026, 11) = 01/11/2025)
+    """
+    index = day.year * 12 + day.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def summarize(appointments):
+    """
+    Gom các lịch hẹn theo (bác sĩ, ngày khám) và tính các số liệu thống kê
+    :param appointments: QuerySet Appointment cần tổng hợp
+    :return: list các dict {doctor_id, date, booked, completed, paid, cancelled, revenue, paid_amount, disease_counts}
+    """
+    completed = Q(status='completed')
+    rows = (appointments.values(**GROUP_BY)
+            .annotate(booked=Count('id', filter=Q(cancel=False)),
+                      completed=Count('id', filter=completed),
+                      paid=Count('id', filter=Q(status='paid')),
+                      cancelled=Count('id', filter=Q(cancel=True)),
+                      revenue=Coalesce(Sum('schedule__doctor__doctor__consultation_fee', filter=completed), ZERO),
+                      paid_amount=Coalesce(Sum('payment__amount', filter=Q(payment__status='paid')), ZERO))
+            .order_by())
+
+    diseases = defaultdict(dict)
+    for doctor_id, day, disease_type, count in (appointments.filter(completed)
+                                                .values('disease_type', **GROUP_BY)
+                                                .annotate(count=Count('id'))
+                                                .values_list('doctor_id', 'date', 'disease_type', 'count')
+                                                .order_by()):
+        diseases[(doctor_id, day)][disease_type] = count
+    return [dict(row, disease_counts=diseases.get((row['doctor_id'], row['date']), {})) for row in rows]
+
+
+def refresh_days(days):
+    """
+    Tính lại dòng thống kê của các ngày được chỉ định (chỉ đọc lịch hẹn của đúng các ngày đó)
+    :param days: danh sách (doctor_id, date)
+    """
+    days = {(doctor_id, parse_date(day) if isinstance(day, str) else day) for doctor_id, day in days}
+    if not days:
+        return
+    condition = Q()
+    for doctor_id, day in days:
+        condition |= Q(schedule__doctor_id=doctor_id, schedule__date=day)
+
+    rows = [DoctorDailyReport(**row) for row in summarize(Appointment.objects.filter(condition))]
+    upsert(DoctorDailyReport, rows, ['doctor', 'date'], SUMMARY_FIELDS + ['updated_date'])
+    # Ngày không còn lịch hẹn nào thì xoá dòng thống kê
+    empty = days - {(row.doctor_id, row.date) for row in rows}
+    if empty:
+        condition = Q()
+        for doctor_id, day in empty:
+            condition |= Q(doctor_id=doctor_id, date=day)
+        DoctorDailyReport.objects.filter(condition).delete()
+
+
+def refresh_appointments(appointment_ids):
+    """
+    Tính lại dòng thống kê của các ngày chứa các lịch hẹn được chỉ định
+    """
+    refresh_days(Appointment.objects.filter(pk__in=appointment_ids)
+                 .values_list('schedule__doctor_id', 'schedule__date').distinct())
+
+
+@transaction.atomic
+def rebuild(start=None, end=None):
+    """
+    Xoá và tính lại bảng DoctorDailyReport từ bảng Appointment (toàn bộ hoặc trong khoảng ngày [start, end])
+    :return: số dòng thống kê được tạo
+    """
+    reports = DoctorDailyReport.objects.all()
+    appointments = Appointment.objects.all()
+    if start:
+        reports = reports.filter(date__gte=start)
+        appointments = appointments.filter(schedule__date__gte=start)
+    if end:
+        reports = reports.filter(date__lte=end)
+        appointments = appointments.filter(schedule__date__lte=end)
+    reports.delete()
+    rows = DoctorDailyReport.objects.bulk_create(
+        [DoctorDailyReport(**row) for row in summarize(appointments)], batch_size=1000)
+    return len(rows)
+
+
+def _rows(start=None, end=None, doctor_id=None):
+    queryset = DoctorDailyReport.objects.all()
+    if doctor_id:
+        queryset = queryset.filter(doctor_id=doctor_id)
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    return queryset
+
+
+def totals(start=None, end=None, doctor_id=None):
+    """
+    Cộng các dòng thống kê theo ngày trong khoảng [start, end] (bỏ trống là không giới hạn)
+    :param doctor_id: id user của bác sĩ, bỏ trống là toàn hệ thống
+    :return: dict {booked, completed, paid, cancelled, revenue, paid_amount}
+    """
+    result = _rows(start, end, doctor_id).aggregate(**{field: Sum(field) for field in TOTAL_FIELDS})
+    return {field: value or (Decimal('0.00') if field in ('revenue', 'paid_amount') else 0)
+            for field, value in result.items()}
+
+
+def top_diseases(start=None, end=None, doctor_id=None, limit=5):
+    """
+    Các loại bệnh được khám nhiều nhất, cộng từ disease_counts của các dòng thống kê theo ngày
+    :return: list các dict {disease_type, count}
+    """
+    counter = Counter()
+    for counts in _rows(start, end, doctor_id).exclude(completed=0).values_list('disease_counts', flat=True):
+        counter.update(counts)
+    return [{'disease_type': disease_type, 'count': count} for disease_type, count in counter.most_common(limit)]
+
+
+def bucket_start(day, granularity):
+    """
+    Ngày đầu của mốc thời gian chứa day (tuần bắt đầu từ thứ 2, giống Trunc('week') của database)
+    """
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'quarter':
+        return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+    return day
+
+
+def _next_bucket(start, granularity):
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    month = start.month - 1 + (3 if granularity == 'quarter' else 1)
+    return date(start.year + month // 12, month % 12 + 1, 1)
+
+
+def bucket_count(start, end, granularity):
+    """
+    Số mốc thời gian trong khoảng [start, end], tính trực tiếp từ khoảng cách ngày/tháng (không tạo danh sách mốc)
+    """
+    if granularity in ('day', 'week'):
+        first = bucket_start(start, granularity)
+        return (end - first).days // (7 if granularity == 'week' else 1) + 1
+    size = 3 if granularity == 'quarter' else 1
+    return (end.year * 12 + end.month - 1) // size - (start.year * 12 + start.month - 1) // size + 1
+
+
+def buckets(start, end, granularity):
+    """
+    Danh sách ngày đầu của các mốc thời gian trong khoảng [start, end]
+    """
+    result, current = [], bucket_start(start, granularity)
+    while current <= end:
+        result.append(current)
+        try:
+            current = _next_bucket(current, granularity)
+        except (ValueError, OverflowError):
+            # Mốc cuối cùng của năm 9999
+            break
+    return result
+
+
+def _sums():
+    # Tên annotate không được trùng tên cột của model nên thêm hậu tố, bỏ đi khi trả kết quả
+    return {f'{field}_sum': Coalesce(Sum(field), ZERO if field in ('revenue', 'paid_amount') else Value(0))
+            for field in TOTAL_FIELDS}
+
+
+def _strip(row):
+    return {key[:-4] if key.endswith('_sum') else key: value for key, value in row.items()}
+
+
+def timeseries(start, end, granularity='month', doctor_id=None, hospital_id=None, specialization_id=None, top=3):
+    """
+    Thống kê theo từng mốc thời gian (ngày/tuần/tháng/quý) trong khoảng [start, end] bằng một truy vấn
+    GROUP BY ngày đã cắt theo mốc trên bảng DoctorDailyReport, kèm các loại bệnh khám nhiều nhất mỗi mốc
+    và số liệu theo bệnh viện, chuyên khoa của cả khoảng.
+    :param granularity: 'day', 'week', 'month' hoặc 'quarter'
+    :param top: số loại bệnh trả về cho mỗi mốc
+    :return: dict {series, hospitals, specializations}
+    """
+    rows = _rows(start, end, doctor_id)
+    if hospital_id:
+        rows = rows.filter(doctor__doctor__hospital_id=hospital_id)
+    if specialization_id:
+        rows = rows.filter(doctor__doctor__specialization_id=specialization_id)
+    period = Trunc('date', granularity, output_field=DateField())
+
+    grouped = {row['period']: _strip(row)
+               for row in rows.annotate(period=period).values('period').annotate(**_sums()).order_by()}
+    diseases = defaultdict(Counter)
+    for day, counts in rows.exclude(completed=0).annotate(period=period).values_list('period', 'disease_counts'):
+        diseases[day].update(counts)
+
+    empty = {field: Decimal('0.00') if field in ('revenue', 'paid_amount') else 0 for field in TOTAL_FIELDS}
+    series = []
+    for bucket in buckets(start, end, granularity):
+        row = dict(grouped.get(bucket) or dict(empty, period=bucket))
+        row['top_diseases'] = [{'disease_type': disease_type, 'count': count}
+                               for disease_type, count in diseases[bucket].most_common(top)]
+        series.append(row)
+
+    def breakdown(relation):
+        key = f'{relation}_id'
+        return [_strip(row) for row in rows.values(**{key: F(f'doctor__doctor__{key}'),
+                                                      'name': F(f'doctor__doctor__{relation}__name')})
+                .annotate(**_sums()).order_by('-paid_amount_sum', key)]
+
+    return {
+        'series': series,
+        'hospitals': breakdown('hospital'),
+        'specializations': breakdown('specialization'),
+    }
+
+
+def dashboard_data(start, end, granularity):
+    """
+    Số liệu của trang thống kê admin: theo thời gian, theo bệnh viện/chuyên khoa, theo loại bệnh và tổng cộng.
+    Doanh thu chỉ tính các hoá đơn đã thanh toán.
+    :return: dict chỉ gồm kiểu dữ liệu JSON (ngày dạng YYYY-MM-DD, tiền dạng chuỗi số)
+    """
+    result = timeseries(start, end, granularity)
+    series = result['series']
+    data = {
+        **result,
+        'top_diseases': top_diseases(start, end, limit=10),
+        'total_appointments': sum(row['completed'] for row in series),
+        'total_revenue': sum(row['paid_amount'] for row in series),
+    }
+    return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def refresh_snapshot(start, end, granularity):
+    """
+    Tính lại số liệu trang thống kê cho khoảng thời gian và lưu kèm thời gian tính
+    :return: StatsSnapshot
+    """
+    started = time.perf_counter()
+    data = dashboard_data(start, end, granularity)
+    duration_ms = round((time.perf_counter() - started) * 1000)
+    snapshot, _ = StatsSnapshot.objects.update_or_create(
+        start=start, end=end, granularity=granularity,
+        defaults={'data': data, 'computed_at': timezone.now(), 'duration_ms': duration_ms})
+    return snapshot
+
+
+def get_snapshot(start, end, granularity, refresh=False):
+    """
+    Đọc số liệu đã tính sẵn, chỉ tính lại khi chưa có, đã cũ hơn ADMIN_STATS_MAX_AGE giây hoặc refresh=True
+    :return: StatsSnapshot
+    """
+    snapshot = StatsSnapshot.objects.filter(start=start, end=end, granularity=granularity).first()
+    max_age = timedelta(seconds=settings.ADMIN_STATS_MAX_AGE)
+    if refresh or snapshot is None or snapshot.computed_at < timezone.now() - max_age:
+        snapshot = refresh_snapshot(start, end, granularity)
+    return snapshot
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from clinic import consumers
+
+websocket_urlpatterns = [
+    path('ws/chat/<int:participant_id>/', consumers.ChatConsumer.as_asgi()),
+    path('ws/notifications/', consumers.NotificationConsumer.as_asgi()),
+]
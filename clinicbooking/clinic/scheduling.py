@@ -0,0 +1,78 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from clinic import availability
+from clinic.overlaps import IntervalIndex
+from clinic.models import Schedule
+
+# Sinh lịch tối đa một quý mỗi lần
+MAX_DAYS = 92
+BATCH_SIZE = 2000
+
+
+def template_slots(template):
+    """
+    Chia khung giờ của lịch mẫu thành các lượt khám, phần lẻ cuối không đủ một lượt sẽ bị bỏ
+    :param template: ScheduleTemplate
+    :return: list (giờ bắt đầu, giờ kết thúc)
+    """
+    current = datetime.combine(date.min, template.start_time)
+    end = datetime.combine(date.min, template.end_time)
+    step = timedelta(minutes=template.slot_minutes)
+    slots = []
+    while current + step <= end:
+        slots.append((current.time(), (current + step).time()))
+        current += step
+    return slots
+
+
+@transaction.atomic
+def generate_schedules(templates, start, end):
+    """
+    Sinh các Schedule từ lịch mẫu cho các ngày trong [start, end] bằng một lần bulk_create.
+    Các lịch đã có được nạp một lần vào bộ nhớ để kiểm tra trùng giờ, lượt khám nào trùng thì bỏ qua.
+    :param templates: các ScheduleTemplate cần sinh lịch
+    :return: (số lịch thực sự được tạo, số lượt bị bỏ qua do trùng giờ hoặc đã được tạo đồng thời)
+    """
+    if end < start:
+        raise ValidationError("Ngày kết thúc phải sau ngày bắt đầu.")
+    if (end - start).days + 1 > MAX_DAYS:
+        raise ValidationError(f"Chỉ được sinh lịch tối đa {MAX_DAYS} ngày mỗi lần.")
+
+    by_weekday = defaultdict(list)
+    for template in templates:
+        by_weekday[template.weekday].append((template, template_slots(template)))
+    doctor_ids = {template.doctor_id for items in by_weekday.values() for template, _ in items}
+    if not doctor_ids:
+        return 0, 0
+
+    taken = IntervalIndex.for_schedules(doctor_ids, start, end)
+
+    schedules, skipped = [], 0
+    day = start
+    while day <= end:
+        for template, slots in by_weekday.get(day.weekday(), []):
+            key = (template.doctor_id, day)
+            for slot_start, slot_end in slots:
+                if taken.overlaps(key, slot_start, slot_end):
+                    skipped += 1
+                    continue
+                taken.add(key, slot_start, slot_end)
+                schedules.append(Schedule(doctor_id=template.doctor_id, date=day, start_time=slot_start,
+                                          end_time=slot_end, capacity=template.capacity, active=True))
+        day += timedelta(days=1)
+
+    if not schedules:
+        return 0, skipped
+
+    # ignore_conflicts: nếu có lịch được tạo đồng thời thì unique_together (doctor, date, start_time) sẽ bỏ qua dòng đó,
+    # nên số lịch được tạo là số dòng tăng thêm chứ không phải số lịch gửi đi
+    existing = Schedule.objects.filter(doctor_id__in=doctor_ids, date__range=(start, end))
+    before = existing.count()
+    Schedule.objects.bulk_create(schedules, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    created = existing.count() - before
+    availability.refresh_range(doctor_ids, start, end)
+    return created, skipped + len(schedules) - created
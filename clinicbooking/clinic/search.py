@@ -0,0 +1,335 @@
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Sum, Value
+from django.db.models.functions import NullIf
+
+from clinic import caching
+from clinic.models import SearchEntry, SearchWord, SearchTerm
+
+KINDS = SearchEntry.Kind.values
+NAME_LENGTH = 255
+WORD_LENGTH = 50
+# Số từ tối đa của một câu tìm kiếm
+MAX_QUERY_WORDS = 8
+# Số từ khớp tối đa được đọc riêng theo thứ tự độ phổ biến khi lấy ứng viên
+MAX_ORDERED_SCANS = 4
+# Từ có từ TYPO_MIN_LENGTH ký tự trở lên mới được sửa lỗi gõ sai
+TYPO_MIN_LENGTH = 4
+
+# Mức khớp của một từ: trùng khớp, đang gõ dở (tiền tố), gõ sai một lỗi
+EXACT = 1.0
+PREFIX = 0.8
+TYPO = 0.6
+
+# kind: (model, trường tên, điều kiện lọc thêm, đường dẫn từ DoctorDailyReport tới đối tượng để tính độ phổ biến,
+#        đường dẫn tới thống kê đánh giá DoctorRatingStats)
+SOURCES = {
+    SearchEntry.Kind.DOCTOR: ('Doctor', 'user__full_name', {'user__is_active': True}, 'doctor__doctor',
+                              'user__rating_stats'),
+    SearchEntry.Kind.HOSPITAL: ('Hospital', 'name', {}, 'doctor__doctor__hospital', None),
+    SearchEntry.Kind.SPECIALIZATION: ('Specialization', 'name', {}, 'doctor__doctor__specialization', None),
+}
+
+
+def normalize(text):
+    """
+    Chuẩn hoá chuỗi để tìm kiếm: bỏ dấu tiếng Việt (kể cả đ -> d), chữ thường, chỉ giữ chữ và số
+    vd: 'Nguyễn Văn Đức' -> 'nguyen van duc'
+    """
+    text = unicodedata.normalize('NFD', (text or '').replace('đ', 'd').replace('Đ', 'D'))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def _words(normalized):
+    return list(dict.fromkeys(word[:WORD_LENGTH] for word in normalized.split()))
+
+
+def _deletes(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def one_typo(a, b):
+    """
+    a và b khác nhau đúng một lỗi gõ: thừa/thiếu/sai một ký tự hoặc đảo hai ký tự liền nhau
+    """
+    if a == b or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    return a[i + 1:] == b[i + 1:] or (a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2]
+                                      and a[i + 2:] == b[i + 2:])
+
+
+class Vocabulary:
+    """
+    Từ điển trong bộ nhớ: danh sách từ đã sắp xếp để tìm theo tiền tố (bisect) và bảng các biến thể
+    bỏ một ký tự của từng từ để tìm từ gõ sai mà không phải so với toàn bộ từ điển
+    """
+
+    def __init__(self, terms):
+        self.terms = terms
+        self.sorted_words = sorted(terms)
+        self.variants = defaultdict(set)
+        for word in terms:
+            for variant in _deletes(word) | {word}:
+                self.variants[variant].add(word)
+
+    def prefixed(self, prefix):
+        words = []
+        for i in range(bisect_left(self.sorted_words, prefix), len(self.sorted_words)):
+            if not self.sorted_words[i].startswith(prefix):
+                break
+            words.append(self.sorted_words[i])
+        return words
+
+    def similar(self, word):
+        candidates = set()
+        for variant in _deletes(word) | {word}:
+            candidates |= self.variants.get(variant, set())
+        return {candidate for candidate in candidates if one_typo(word, candidate)}
+
+    def expand(self, word, prefix=False):
+        """
+        Các từ trong từ điển khớp với một từ của câu tìm kiếm
+        :param prefix: True nếu là từ đang gõ dở (từ cuối), khớp cả các từ bắt đầu bằng word
+        :return: {từ: mức khớp}
+        """
+        matches = {}
+        if len(word) >= TYPO_MIN_LENGTH:
+            matches.update(dict.fromkeys(self.similar(word), TYPO))
+        if prefix:
+            # Tiền tố ngắn khớp rất nhiều từ, chỉ giữ những từ phổ biến nhất
+            longer = sorted(self.prefixed(word), key=self.terms.get, reverse=True)
+            matches.update(dict.fromkeys(longer[:settings.SEARCH_MAX_EXPANSIONS], PREFIX))
+        if word in self.terms:
+            matches[word] = EXACT
+        return matches
+
+
+_vocabulary = (None, None)
+
+
+def vocabulary():
+    """
+    Từ điển của chỉ mục, giữ trong bộ nhớ tiến trình và chỉ đọc lại khi có từ mới hoặc từ bị xoá khỏi chỉ mục
+    (số mục chứa mỗi từ có thể cũ hơn thực tế, chỉ dùng để ước lượng)
+    :return: Vocabulary
+    """
+    global _vocabulary
+    version = caching.get_version(caching.SEARCH_TERMS)
+    if _vocabulary[0] != version:
+        _vocabulary = (version, Vocabulary(dict(SearchTerm.objects.values_list('word', 'entries'))))
+    return _vocabulary[1]
+
+
+def _slots(text):
+    # Mỗi từ của câu tìm kiếm ứng với các từ khớp trong từ điển, từ cuối được tìm theo tiền tố
+    query = _words(normalize(text))[:MAX_QUERY_WORDS]
+    vocab = vocabulary()
+    return [vocab.expand(word, prefix=i == len(query) - 1) for i, word in enumerate(query)]
+
+
+def filter_queryset(queryset, kind, text):
+    """
+    Lọc queryset (Doctor, Hospital hoặc Specialization) theo tên không phân biệt dấu, cho phép gõ sai một lỗi
+    và gõ dở từ cuối. Mỗi từ là một truy vấn con trên index search_word_idx.
+    :param kind: 'doctor', 'hospital' hoặc 'specialization'
+    :param text: Chuỗi tìm kiếm, vd: 'nguyen van a'
+    :return: QuerySet
+    """
+    slots = _slots(text)
+    if not slots or not all(slots):
+        return queryset.none()
+    for slot in slots:
+        queryset = queryset.filter(
+            pk__in=SearchWord.objects.filter(kind=kind, word__in=list(slot)).values('object_id'))
+    return queryset
+
+
+def _candidates(slots, kinds):
+    # Bắt đầu từ từ hiếm nhất, các từ còn lại kiểm tra bằng EXISTS trên index search_word_target_idx.
+    # Mỗi từ một truy vấn để đọc theo thứ tự độ phổ biến ngay trên index search_word_idx và dừng sau
+    # SEARCH_CANDIDATES dòng, thay vì sắp xếp toàn bộ các dòng chứa từ đó
+    rarest, *others = slots
+    limit = settings.SEARCH_CANDIDATES
+    groups = [[word] for word in rarest] if len(rarest) <= MAX_ORDERED_SCANS else [list(rarest)]
+    candidates = []
+    for words in groups:
+        matches = SearchWord.objects.filter(word__in=words, kind__in=kinds)
+        for slot in others:
+            matches = matches.filter(Exists(SearchWord.objects.filter(
+                kind=OuterRef('kind'), object_id=OuterRef('object_id'), word__in=list(slot))))
+        candidates += matches.order_by('-popularity').values_list('popularity', 'kind', 'object_id')[:limit]
+    candidates = sorted(set(candidates), key=lambda candidate: (-candidate[0], candidate[1], candidate[2]))
+    return list(dict.fromkeys((kind, object_id) for _, kind, object_id in candidates))[:limit]
+
+
+def search(text, kinds=None, limit=None):
+    """
+    Tìm bác sĩ, bệnh viện, chuyên khoa theo tên không phân biệt dấu, cho phép gõ sai một lỗi mỗi từ.
+    Kết quả xếp theo mức khớp (trùng khớp > gõ dở > gõ sai, ưu tiên tên bắt đầu bằng câu tìm kiếm)
+    rồi theo độ phổ biến. Các từ không có trong chỉ mục được bỏ qua.
+    :param text: Chuỗi tìm kiếm
+    :param kinds: Danh sách loại cần tìm, mặc định cả 3 loại
+    :param limit: Số kết quả tối đa, mặc định SEARCH_RESULT_LIMIT
+    :return: danh sách dict type, id, name, score
+    """
+    kinds = [kind for kind in kinds or KINDS if kind in KINDS]
+    limit = limit or settings.SEARCH_RESULT_LIMIT
+    query = normalize(text)
+    slots = _slots(text)
+    known = [slot for slot in slots if slot]
+    if not known or not kinds:
+        return []
+
+    terms = vocabulary().terms
+    known.sort(key=lambda slot: sum(terms.get(word, 0) for word in slot))
+    candidates = _candidates(known, kinds)
+    if not candidates:
+        return []
+
+    targets = Q()
+    for kind in kinds:
+        ids = [object_id for candidate_kind, object_id in candidates if candidate_kind == kind]
+        if ids:
+            targets |= Q(kind=kind, object_id__in=ids)
+
+    results = []
+    for entry in SearchEntry.objects.filter(targets):
+        words = entry.normalized.split()
+        score = sum(max(slot.get(word, 0) for word in words) for slot in known) / len(slots)
+        if entry.normalized == query:
+            score += 1
+        elif entry.normalized.startswith(query):
+            score += 0.5
+        results.append((score, entry))
+
+    results.sort(key=lambda result: (-result[0], -result[1].popularity, -result[1].rating, result[1].name))
+    return [{'type': entry.kind, 'id': entry.object_id, 'name': entry.name, 'score': round(score, 3)}
+            for score, entry in results[:limit]]
+
+
+def _count_terms(added, removed):
+    # Cập nhật số mục chứa mỗi từ, từ điển trong bộ nhớ chỉ phải đọc lại khi có từ mới hoặc từ bị xoá
+    changed = False
+    if added:
+        existing = set(SearchTerm.objects.filter(word__in=added).values_list('word', flat=True))
+        SearchTerm.objects.bulk_create([SearchTerm(word=word) for word in added - existing], ignore_conflicts=True)
+        SearchTerm.objects.filter(word__in=added).update(entries=F('entries') + 1)
+        changed = bool(added - existing)
+    if removed:
+        SearchTerm.objects.filter(word__in=removed, entries__gt=0).update(entries=F('entries') - 1)
+        changed |= SearchTerm.objects.filter(word__in=removed, entries=0).delete()[0] > 0
+    if changed:
+        caching.invalidate_on_commit(caching.SEARCH_TERMS)
+
+
+def _remove(kind, object_id):
+    entry = SearchEntry.objects.filter(kind=kind, object_id=object_id).first()
+    if entry is None:
+        return
+    SearchWord.objects.filter(kind=kind, object_id=object_id).delete()
+    entry.delete()
+    _count_terms(set(), set(_words(entry.normalized)))
+
+
+def _index(kind, object_id, name, popularity, rating):
+    normalized = normalize(name)[:NAME_LENGTH]
+    new_words = set(_words(normalized))
+    if not new_words:
+        return _remove(kind, object_id)
+
+    entry = SearchEntry.objects.select_for_update().filter(kind=kind, object_id=object_id).first()
+    if entry is None:
+        entry = SearchEntry(kind=kind, object_id=object_id)
+    elif (entry.name, entry.normalized, entry.popularity, entry.rating) == \
+            (name[:NAME_LENGTH], normalized, popularity, rating):
+        return
+    old_words = set(_words(entry.normalized))
+    popularity_changed = entry.popularity != popularity
+    entry.name, entry.normalized, entry.popularity, entry.rating = name[:NAME_LENGTH], normalized, popularity, rating
+    entry.save()
+
+    words = SearchWord.objects.filter(kind=kind, object_id=object_id)
+    words.filter(word__in=old_words - new_words).delete()
+    if popularity_changed:
+        words.update(popularity=popularity)
+    SearchWord.objects.bulk_create([SearchWord(word=word, kind=kind, object_id=object_id, popularity=popularity)
+                                    for word in new_words - old_words])
+    _count_terms(new_words - old_words, old_words - new_words)
+
+
+def _documents(kind, ids=None):
+    # (id, tên, độ phổ biến, số sao) của các đối tượng đang hoạt động, độ phổ biến là tổng số lượt đặt khám
+    model_name, name_field, filters, report_path, stats_path = SOURCES[kind]
+    objects = django_apps.get_model('clinic', model_name).objects.filter(active=True, **filters)
+    if stats_path:
+        rating = F(f'{stats_path}__rating_sum') * 1.0 / NullIf(F(f'{stats_path}__review_count'), 0)
+    else:
+        rating = Value(0.0)
+    reports = django_apps.get_model('clinic', 'DoctorDailyReport').objects.all()
+    if ids is not None:
+        objects = objects.filter(pk__in=ids)
+        reports = reports.filter(**{f'{report_path}__in': ids})
+    popularity = dict(reports.values_list(report_path).annotate(total=Sum('booked')).order_by())
+    return [(pk, name, popularity.get(pk) or 0, round(rating or 0, 2))
+            for pk, name, rating in objects.annotate(rating=rating).values_list('pk', name_field, 'rating')]
+
+
+@transaction.atomic
+def refresh(kind, ids):
+    """
+    Cập nhật chỉ mục tìm kiếm của các đối tượng (gọi khi lưu/xoá), đối tượng đã xoá hoặc ngừng hoạt động
+    bị xoá khỏi chỉ mục
+    :param kind: 'doctor', 'hospital' hoặc 'specialization'
+    :param ids: Danh sách id đối tượng
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    documents = _documents(kind, ids)
+    for document in documents:
+        _index(kind, *document)
+    for object_id in set(ids) - {document[0] for document in documents}:
+        _remove(kind, object_id)
+
+
+def rebuild():
+    """
+    Tạo lại toàn bộ chỉ mục tìm kiếm và độ phổ biến (python manage.py rebuild_search_index)
+    :return: số mục trong chỉ mục
+    """
+    entries, words, terms = [], [], Counter()
+    for kind in KINDS:
+        for object_id, name, popularity, rating in _documents(kind):
+            normalized = normalize(name)[:NAME_LENGTH]
+            entry_words = _words(normalized)
+            if not entry_words:
+                continue
+            entries.append(SearchEntry(kind=kind, object_id=object_id, name=name[:NAME_LENGTH], normalized=normalized,
+                                       popularity=popularity, rating=rating))
+            words += [SearchWord(word=word, kind=kind, object_id=object_id, popularity=popularity)
+                      for word in entry_words]
+            terms.update(entry_words)
+
+    with transaction.atomic():
+        for model in (SearchWord, SearchEntry, SearchTerm):
+            model.objects.all().delete()
+        SearchEntry.objects.bulk_create(entries, batch_size=1000)
+        SearchWord.objects.bulk_create(words, batch_size=1000)
+        SearchTerm.objects.bulk_create([SearchTerm(word=word, entries=count) for word, count in terms.items()],
+                                       batch_size=1000)
+        caching.invalidate_on_commit(caching.SEARCH_TERMS)
+    return len(entries)
@@ -1,14 +1,27 @@
 import random
+from django.db import transaction
 from django.db.models import Avg
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.contrib.auth.tokens import default_token_generator
 from django.db.models import Avg
 from rest_framework import serializers
-from rest_framework.serializers import ModelSerializer
+from clinic import booking, overlaps, reports, media, uploads
+from clinic.fieldsets import DynamicFieldsMixin
+from clinic.media import ImageURLField
 from clinic.email import send_appointment_successfull_email, send_otp_email
+from clinic.ratings import get_rating_stats
 from clinic.models import (User, Doctor, HealthRecord, Schedule,
                            Appointment, Review, Message,
-                           Payment, TestResult, Notification, Hospital, Specialization, PasswordResetOTP)
+                           Payment, TestResult, Notification, Hospital, Specialization, PasswordResetOTP,
+                           ScheduleTemplate, UserNotification)
+
+
+class ModelSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Serializer gốc của các API: hỗ trợ ?fields= và ?expand= (clinic/fieldsets.py)
+    """
+    pass
 
 
 class HospitalSerializer(ModelSerializer):
@@ -18,10 +31,8 @@ class HospitalSerializer(ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        if instance.logo:
-            data['logo'] = f"{instance.logo.url}"
-        else:
-            data['logo'] = None
+        if 'logo' in data:
+            data['logo'] = media.image_url(instance.logo, self.context.get('image_variant'))
         return data
 
 
@@ -35,10 +46,8 @@ class UserSerializer(ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        if instance.avatar:
-            data['avatar'] = f"{instance.avatar.url}"
-        else:
-            data['avatar'] = None
+        if 'avatar' in data:
+            data['avatar'] = media.image_url(instance.avatar, self.context.get('image_variant'))
         return data
 
     class Meta:
@@ -52,12 +61,31 @@ class UserSerializer(ModelSerializer):
 
     def create(self, validated_data):
         data = validated_data.copy()
+        # Ảnh đại diện được tải lên Cloudinary ở background (clinic/uploads.py)
+        files = uploads.pop_files(data, ['avatar'])
         u = User(**data)
         u.set_password(u.password)
         u.save()
+        uploads.stage_files(u, files)
         return u
 
 
+class InboxSerializer(ModelSerializer):
+    """
+    Một thông báo trong hộp thư của user (id là id của thông báo)
+    """
+    id = serializers.IntegerField(source='notification_id', read_only=True)
+    title = serializers.CharField(source='notification.title', read_only=True)
+    content = serializers.CharField(source='notification.content', read_only=True)
+    type = serializers.CharField(source='notification.type', read_only=True)
+    send_at = serializers.DateTimeField(source='notification.send_at', read_only=True)
+
+    class Meta:
+        model = UserNotification
+        fields = ['id', 'title', 'content', 'type', 'send_at', 'is_read', 'created_date']
+        read_only_fields = fields
+
+
 class OTPRequestSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
@@ -123,7 +151,7 @@ class DoctorSerializer(ModelSerializer):
     specialization_name = serializers.CharField(source='specialization.name', read_only=True)
     user = UserSerializer(read_only=True)
     doctor = serializers.CharField(source='user.full_name', read_only=True)
-    avatar = serializers.CharField(source='user.avatar.url', read_only=True)
+    avatar = ImageURLField(source='user.avatar')
     # Phí khám bệnh của bác sĩ
     consultation_fee = serializers.SerializerMethodField()
     # Tổng số lượt đánh giá bác sĩ
@@ -131,31 +159,40 @@ class DoctorSerializer(ModelSerializer):
     # Số sao trung bình của bác sĩ
     average_rating = serializers.SerializerMethodField()
 
+    expandable_fields = {
+        'hospital': ('HospitalSerializer', {}),
+        'specialization': ('SpecializationSerializer', {}),
+    }
+
     class Meta:
         model = Doctor
         fields = ['id', 'user', 'doctor', 'avatar', 'biography', 'license_number', 'license_image', 'active',
                   'hospital_id', 'hospital_name',
                   'specialization', 'specialization_name', 'consultation_fee', 'total_reviews', 'average_rating', 'is_verified']
+        field_sources = {
+            'consultation_fee': ['consultation_fee'],
+            'total_reviews': ['user__rating_stats__review_count'],
+            'average_rating': ['user__rating_stats__review_count', 'user__rating_stats__rating_sum'],
+        }
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        if instance.license_image:
-            data['license_image'] = f"{instance.license_image.url}"
-        else:
-            data['license_image'] = None
+        if 'license_image' in data:
+            data['license_image'] = media.image_url(instance.license_image, self.context.get('image_variant'))
         return data
 
     def get_consultation_fee(self, obj):
         # Format tiền: ví dụ 200000 → "200,000 VNĐ"
         return "{:,.0f} VNĐ".format(obj.consultation_fee)
 
+    # Đọc từ bảng thống kê DoctorRatingStats (Doctor.objects.with_rating_stats() đã lấy kèm)
     def get_total_reviews(self, obj):
-        return Review.objects.filter(doctor=obj.user).count()
+        stats = get_rating_stats(obj.user)
+        return stats.review_count if stats else 0
 
     def get_average_rating(self, obj):
-        avg_rating = Review.objects.filter(doctor=obj.user).aggregate(Avg('rating'))['rating__avg']
-        print(avg_rating)
-        return round(avg_rating, 1) if avg_rating else 0  # Trả về 0 nếu chưa có đánh giá
+        stats = get_rating_stats(obj.user)
+        return stats.average_rating if stats else 0  # Trả về 0 nếu chưa có đánh giá
 
     def create(self, validated_data):
         request = self.context['request']
@@ -169,42 +206,152 @@ class DoctorSerializer(ModelSerializer):
 
 
 class TestResultSerializer(ModelSerializer):
+    expandable_fields = {
+        'health_record': ('HealthRecordSummarySerializer', {}),
+    }
+
     class Meta:
         model = TestResult
-        fields = ['id', 'test_name', 'description', 'image', 'health_record']
+        fields = ['id', 'test_name', 'description', 'image', 'thumbnail', 'health_record']
+        read_only_fields = ['thumbnail']
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        if instance.image:
-            data['image'] = f"{instance.image.url}"
-        else:
-            data['image'] = None
+        if 'image' in data:
+            data['image'] = media.image_url(instance.image, self.context.get('image_variant'))
+        if 'thumbnail' in data:
+            data['thumbnail'] = media.image_url(instance.thumbnail)
         return data
 
+    # Ảnh kết quả xét nghiệm được tải lên Cloudinary ở background (clinic/uploads.py)
+    def create(self, validated_data):
+        files = uploads.pop_files(validated_data, ['image'])
+        test_result = super().create(validated_data)
+        uploads.stage_files(test_result, files)
+        return test_result
+
+    def update(self, instance, validated_data):
+        files = uploads.pop_files(validated_data, ['image'])
+        test_result = super().update(instance, validated_data)
+        uploads.stage_files(test_result, files)
+        return test_result
+
 
 class HealthRecordSerializer(ModelSerializer):
     # test_results = TestResultSerializer(source='testresult_set', many=True, read_only=True)
     user = serializers.PrimaryKeyRelatedField(read_only=True)
 
+    expandable_fields = {
+        'user': ('UserSerializer', {}),
+    }
+
     class Meta:
         model = HealthRecord
         fields = '__all__'
 
 
+class HealthRecordSummarySerializer(ModelSerializer):
+    """
+    Dạng rút gọn của hồ sơ sức khoẻ (không có medical_history) dùng trong danh sách lịch hẹn
+    """
+
+    class Meta:
+        model = HealthRecord
+        fields = ['id', 'full_name', 'number_phone', 'day_of_birth']
+
+
 class ScheduleSerializer(ModelSerializer):
+    doctor_id = serializers.PrimaryKeyRelatedField(source='doctor', queryset=User.objects.filter(role='doctor'),
+                                                   required=False)
+
+    def validate(self, data):
+        start_time = data.get('start_time', getattr(self.instance, 'start_time', None))
+        end_time = data.get('end_time', getattr(self.instance, 'end_time', None))
+        if start_time and end_time and start_time >= end_time:
+            raise serializers.ValidationError("Giờ bắt đầu phải trước giờ kết thúc.")
+        return data
+
+    def _check_overlap(self, schedule):
+        # unique_together chỉ chặn trùng giờ bắt đầu, khung giờ còn không được giao với lịch khác của bác sĩ
+        if not schedule.doctor_id:
+            raise serializers.ValidationError("Cần chọn bác sĩ (doctor_id).")
+        # Khoá dòng user của bác sĩ để 2 yêu cầu tạo lịch trùng giờ cùng lúc phải chờ nhau
+        list(User.objects.select_for_update().filter(pk=schedule.doctor_id).values_list('pk'))
+        overlaps.check_schedule(schedule.doctor_id, schedule.date, schedule.start_time, schedule.end_time,
+                                exclude_id=schedule.pk)
 
+    @transaction.atomic
     def create(self, validated_data):
         data = validated_data.copy()
         schedule = Schedule(**data)
+        self._check_overlap(schedule)
         schedule.save()
         return schedule
 
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        self._check_overlap(instance)
+        instance.save()
+        return instance
+
     class Meta:
         model = Schedule
         fields = ['id', 'date', 'start_time', 'end_time', 'doctor_id', 'capacity', 'sum_booking', 'active']
+        # Số lượt đặt chỉ được thay đổi qua clinic/booking.py
+        read_only_fields = ['sum_booking', 'active']
+        # Trùng giờ bắt đầu (unique_together) đã nằm trong kiểm tra trùng khung giờ ở _check_overlap,
+        # bỏ UniqueTogetherValidator để bác sĩ không phải gửi doctor_id
+        validators = []
+
 
+class ScheduleTemplateSerializer(ModelSerializer):
+    doctor_id = serializers.PrimaryKeyRelatedField(source='doctor', queryset=User.objects.filter(role='doctor'),
+                                                   required=False)
+
+    class Meta:
+        model = ScheduleTemplate
+        fields = ['id', 'doctor_id', 'weekday', 'start_time', 'end_time', 'slot_minutes', 'capacity', 'active']
+
+    def validate(self, data):
+        start_time = data.get('start_time', getattr(self.instance, 'start_time', None))
+        end_time = data.get('end_time', getattr(self.instance, 'end_time', None))
+        if start_time and end_time and start_time >= end_time:
+            raise serializers.ValidationError("Giờ bắt đầu phải trước giờ kết thúc.")
+        if data.get('slot_minutes') == 0 or data.get('capacity') == 0:
+            raise serializers.ValidationError("Thời lượng và số bệnh nhân mỗi lượt khám phải lớn hơn 0.")
+        return data
 
-class AppointmentSerializer(serializers.ModelSerializer):
+
+class ScheduleGenerateSerializer(serializers.Serializer):
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    template_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+
+class ReportQuerySerializer(serializers.Serializer):
+    """
+    Tham số của API thống kê theo thời gian, mặc định là 12 tháng gần nhất theo tháng
+    """
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    granularity = serializers.ChoiceField(choices=reports.GRANULARITIES, default='month')
+    doctor_id = serializers.IntegerField(required=False)
+    hospital_id = serializers.IntegerField(required=False)
+    specialization_id = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        data.setdefault('end', timezone.localdate())
+        data.setdefault('start', reports.months_before(data['end'], 11))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError("Ngày bắt đầu phải trước ngày kết thúc.")
+        if reports.bucket_count(data['start'], data['end'], data['granularity']) > reports.MAX_BUCKETS:
+            raise serializers.ValidationError(f"Khoảng thời gian quá dài (tối đa {reports.MAX_BUCKETS} mốc).")
+        return data
+
+
+class AppointmentSerializer(ModelSerializer):
     schedule = ScheduleSerializer(read_only=True)
     healthrecord = HealthRecordSerializer(read_only=True)
 
@@ -227,29 +374,54 @@ class AppointmentSerializer(serializers.ModelSerializer):
 
         if Appointment.objects.filter(healthrecord=healthrecord, schedule=schedule, cancel=False).exists():
             raise serializers.ValidationError("Bạn đã có lịch khám này rồi!")
+        # Không cho đặt 2 lịch trùng giờ (kể cả ở 2 bác sĩ khác nhau) cho cùng một hồ sơ
+        overlaps.check_patient(healthrecord.pk, schedule)
 
         return data
 
     def create(self, validated_data):
         schedule = validated_data.pop('schedule_id')
         healthrecord = validated_data.pop('healthrecord_id')
+        validated_data.pop('status', None)  # mặc định là 'unpaid' khi tạo
 
-        appointment = Appointment.objects.create(
-            schedule=schedule,
-            healthrecord=healthrecord,
-            status='unpaid',  # mặc định khi tạo
-            **validated_data
-        )
-
-        schedule.sum_booking += 1
-        schedule.save()
+        appointment = booking.book_appointment(schedule, healthrecord, **validated_data)
 
         send_appointment_successfull_email(appointment)
 
         return appointment
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class AppointmentListSerializer(ModelSerializer):
+    """
+    Dạng rút gọn của lịch hẹn cho API danh sách: kèm lịch khám, bác sĩ, bệnh viện, chuyên khoa
+    (đã được select_related) và hồ sơ rút gọn. Chi tiết đầy đủ dùng AppointmentSerializer.
+    """
+    schedule = ScheduleSerializer(read_only=True)
+    healthrecord = HealthRecordSummarySerializer(read_only=True)
+    doctor = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Appointment
+        fields = ['id', 'healthrecord', 'created_date', 'updated_date', 'disease_type', 'symptoms', 'status',
+                  'schedule', 'doctor', 'active', 'cancel', 'reason']
+        read_only_fields = fields
+        field_sources = {
+            'doctor': ['schedule__doctor__full_name', 'schedule__doctor__doctor__hospital__name',
+                       'schedule__doctor__doctor__specialization__name'],
+        }
+
+    def get_doctor(self, appointment):
+        user = appointment.schedule.doctor
+        profile = getattr(user, 'doctor', None)
+        return {
+            'id': user.id,
+            'full_name': user.full_name,
+            'hospital_name': profile.hospital.name if profile else None,
+            'specialization_name': profile.specialization.name if profile else None,
+        }
+
+
+class MessageSerializer(ModelSerializer):
     sender = UserSerializer(read_only=True)
     receiver = UserSerializer(read_only=True)
 
@@ -258,12 +430,27 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'content', 'is_read', 'sender', 'receiver', 'test_result', 'created_date']
 
 
+class MessageSyncSerializer(ModelSerializer):
+    """
+    Dạng rút gọn của tin nhắn cho API đồng bộ: sender/receiver chỉ trả về id
+    """
+
+    class Meta:
+        model = Message
+        fields = ['id', 'content', 'is_read', 'sender', 'receiver', 'test_result', 'created_date']
+        read_only_fields = fields
+
+
 class ReviewSerializer(ModelSerializer):
     patient_name = serializers.CharField(source='patient.full_name', read_only=True)
-    avatar_patient = serializers.CharField(source='patient.avatar.url', read_only=True)
+    avatar_patient = ImageURLField(source='patient.avatar')
     doctor_name = serializers.CharField(source='doctor.full_name', read_only=True)
     doctor = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), write_only=True)
 
+    expandable_fields = {
+        'patient': ('UserSerializer', {}),
+    }
+
     class Meta:
         model = Review
         fields = ['id', 'rating', 'comment', 'reply', 'patient_name', 'avatar_patient', 'doctor', 'doctor_name']
@@ -280,7 +467,11 @@ class PaymentSerializer(ModelSerializer):
         fields = ['id', 'amount', 'method', 'status', 'created_date', 'updated_date', 'appointment_id']
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(ModelSerializer):
+    expandable_fields = {
+        'users': ('UserSerializer', {'many': True}),
+    }
+
     class Meta:
         model = Notification
         fields = '__all__'
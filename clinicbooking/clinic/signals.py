@@ -1,20 +1,165 @@
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import Appointment, Schedule
 
+from clinic import caching, availability, reports, search, autocomplete, ratings
+from clinic.consumers import broadcast_message
+from clinic.models import Message, Hospital, Specialization, Doctor, User, Review, Schedule, Appointment, Payment
 
-def update_schedule_sum(schedule):
-    schedule.sum_booking = Appointment.objects.filter(schedule=schedule, cancel=False).count()
-    schedule.active = schedule.sum_booking < schedule.capacity
-    print(schedule.sum_booking, schedule.active)
-    schedule.save(update_fields=['sum_booking', 'active'])
 
+@receiver(post_save, sender=Message)
+def on_message_created(sender, instance, created, **kwargs):
+    # Đẩy tin nhắn mới qua WebSocket sau khi transaction đã commit
+    if created:
+        transaction.on_commit(lambda: broadcast_message(instance))
 
-@receiver(post_save, sender=Appointment)
-def on_appointment_saved(sender, instance, **kwargs):
-    update_schedule_sum(instance.schedule)
 
+# Xoá cache các API danh mục (clinic/caching.py) khi dữ liệu thay đổi.
+# Bác sĩ hiển thị kèm tên bệnh viện, chuyên khoa, thông tin user và số sao nên cũng bị xoá theo.
+@receiver([post_save, post_delete], sender=Hospital)
+def on_hospital_changed(sender, instance, **kwargs):
+    caching.invalidate_on_commit(caching.HOSPITALS, caching.DOCTORS)
 
-@receiver(post_delete, sender=Appointment)
-def on_appointment_deleted(sender, instance, **kwargs):
-    update_schedule_sum(instance.schedule)
+
+@receiver([post_save, post_delete], sender=Specialization)
+def on_specialization_changed(sender, instance, **kwargs):
+    caching.invalidate_on_commit(caching.SPECIALIZATIONS, caching.DOCTORS)
+
+
+@receiver([post_save, post_delete], sender=Doctor)
+@receiver([post_save, post_delete], sender=Review)
+def on_doctor_changed(sender, instance, **kwargs):
+    caching.invalidate_on_commit(caching.DOCTORS)
+
+
+@receiver([post_save, post_delete], sender=User)
+def on_user_changed(sender, instance, update_fields=None, **kwargs):
+    # Bỏ qua lần lưu chỉ cập nhật last_login khi đăng nhập
+    if instance.role == 'doctor' and set(update_fields or []) != {'last_login'}:
+        caching.invalidate_on_commit(caching.DOCTORS)
+
+
+# Cập nhật thống kê đánh giá (DoctorRatingStats) mỗi khi Review được tạo/sửa/xoá,
+# kể cả qua trang admin, shell hay khi bị xoá theo đối tượng khác
+RATING_FIELDS = {'doctor', 'rating'}
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, update_fields=None, **kwargs):
+    instance._previous_rating = None
+    if instance.pk and (update_fields is None or RATING_FIELDS & set(update_fields)):
+        instance._previous_rating = Review.objects.filter(pk=instance.pk).values_list('doctor_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def on_review_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if created:
+        ratings.review_created(instance)
+    elif previous:
+        ratings.review_updated(instance, *previous)
+
+
+@receiver(post_delete, sender=Review)
+def on_review_deleted(sender, instance, **kwargs):
+    ratings.review_deleted(instance.doctor_id, instance.rating)
+
+
+# Cập nhật chỉ mục tìm kiếm (clinic/search.py) và cây gợi ý (clinic/autocomplete.py)
+# khi tên hoặc trạng thái của đối tượng thay đổi
+SEARCH_FIELDS = {
+    Doctor: ('doctor', {'active', 'user'}),
+    Hospital: ('hospital', {'active', 'name'}),
+    Specialization: ('specialization', {'active', 'name'}),
+}
+
+
+def _affects_search(update_fields, fields):
+    return update_fields is None or bool(fields & set(update_fields))
+
+
+def _refresh_search(kind, ids):
+    ids = list(ids)
+    search.refresh(kind, ids)
+    autocomplete.changed(kind, ids)
+
+
+@receiver([post_save, post_delete], sender=Doctor)
+@receiver([post_save, post_delete], sender=Hospital)
+@receiver([post_save, post_delete], sender=Specialization)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    kind, fields = SEARCH_FIELDS[sender]
+    if _affects_search(update_fields, fields):
+        _refresh_search(kind, [instance.pk])
+
+
+@receiver(post_save, sender=User)
+def update_doctor_search_index(sender, instance, update_fields=None, **kwargs):
+    if instance.role == 'doctor' and _affects_search(update_fields, {'full_name', 'is_active'}):
+        _refresh_search('doctor', Doctor.objects.filter(user=instance).values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Review)
+def update_doctor_rating(sender, instance, **kwargs):
+    # Thống kê đánh giá được cập nhật sau khi lưu Review (cùng transaction) nên đợi commit mới đọc số sao
+    if instance.doctor_id:
+        doctor_id = instance.doctor_id
+        transaction.on_commit(
+            lambda: _refresh_search('doctor', Doctor.objects.filter(user_id=doctor_id).values_list('pk', flat=True)))
+
+
+# Cập nhật bảng tổng hợp lịch trống (DoctorAvailability) khi lịch khám được tạo/sửa/xoá
+@receiver(pre_save, sender=Schedule)
+def remember_schedule_day(sender, instance, **kwargs):
+    instance._previous_day = None
+    if instance.pk:
+        instance._previous_day = Schedule.objects.filter(pk=instance.pk).values_list('doctor_id', 'date').first()
+
+
+@receiver(post_save, sender=Schedule)
+def on_schedule_saved(sender, instance, **kwargs):
+    days = [(instance.doctor_id, instance.date)]
+    if getattr(instance, '_previous_day', None):
+        days.append(instance._previous_day)
+    availability.refresh_days(days)
+    # Đổi ngày/bác sĩ của lịch khám thì các lịch hẹn cũng chuyển sang ngày mới trong bảng thống kê
+    if len(days) > 1 and days[0] != days[1]:
+        reports.refresh_days(days)
+
+
+@receiver(post_delete, sender=Schedule)
+def on_schedule_deleted(sender, instance, **kwargs):
+    availability.refresh_days([(instance.doctor_id, instance.date)])
+
+
+# Cập nhật bảng thống kê theo ngày (DoctorDailyReport) khi lịch hẹn hoặc hoá đơn thay đổi
+REPORT_FIELDS = {'schedule', 'status', 'cancel', 'disease_type'}
+
+
+def _schedule_day(schedule_id):
+    return Schedule.objects.filter(pk=schedule_id).values_list('doctor_id', 'date').first()
+
+
+def _affects_report(update_fields):
+    return update_fields is None or bool(REPORT_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_day(sender, instance, update_fields=None, **kwargs):
+    instance._previous_day = None
+    if instance.pk and _affects_report(update_fields):
+        instance._previous_day = Appointment.objects.filter(pk=instance.pk) \
+            .values_list('schedule__doctor_id', 'schedule__date').first()
+
+
+@receiver([post_save, post_delete], sender=Appointment)
+def on_appointment_changed(sender, instance, update_fields=None, **kwargs):
+    if not _affects_report(update_fields):
+        return
+    days = [day for day in (_schedule_day(instance.schedule_id), getattr(instance, '_previous_day', None)) if day]
+    reports.refresh_days(days)
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def on_payment_changed(sender, instance, **kwargs):
+    reports.refresh_appointments([instance.appointment_id])
@@ -1,3 +1,2366 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from io import StringIO
+from unittest.mock import patch
+from datetime import date, time, timedelta
 
-# Create your tests here.
+import cloudinary
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import ValidationError
+from oauth2_provider.models import AccessToken
+from rest_framework.test import APIClient
+
+from clinic import ratings, booking, caching, availability, scheduling, overlaps, reports, notifications, media, \
+    uploads, imaging, search, autocomplete
+from clinic.checks import check_shared_cache
+from clinic.email import send_queued_emails, queue_email
+from clinic.routing import websocket_urlpatterns
+from clinic.serializers import UserSerializer
+from clinic.ws_auth import OAuth2TokenAuthMiddleware
+from clinic.models import (User, Doctor, Hospital, Specialization, Review, DoctorRatingStats, HealthRecord,
+                           Schedule, Appointment, EmailOutbox, Message, DoctorAvailability, Notification,
+                           ScheduleTemplate, DoctorDailyReport, Payment, StatsSnapshot,
+                           UserNotification, NotificationCounter, MediaUpload, TestResult, SearchEntry, SearchWord,
+                           SearchTerm, PasswordResetOTP)
+
+
+def setUpModule():
+    # Cloudinary cần cloud_name để dựng URL ảnh, môi trường test có thể không có file .env
+    if not cloudinary.config().cloud_name:
+        cloudinary.config(cloud_name='clinic-test')
+
+
+class ClinicTestMixin:
+    """
+    Các hàm tạo dữ liệu mẫu dùng chung cho các test case
+    """
+    phone_seq = itertools.count(1)
+
+    def create_user(self, username, role='patient', **kwargs):
+        defaults = {
+            'full_name': username,
+            'email': f'{username}@clinic.test',
+            'number_phone': str(next(self.phone_seq)).zfill(10),
+            'avatar': 'image/upload/v1/avatar.jpg',
+            'role': role,
+        }
+        defaults.update(kwargs)
+        return User.objects.create_user(username=username, password=None, **defaults)
+
+    def create_hospital(self, name='BV Chợ Rẫy'):
+        return Hospital.objects.create(name=name, address='HCM', logo='image/upload/v1/logo.jpg',
+                                       description='<p>Bệnh viện</p>', phone='0123456789')
+
+    def create_specialization(self, name='Tim mạch'):
+        return Specialization.objects.create(name=name)
+
+    def create_healthrecord(self, user, **kwargs):
+        seq = str(next(self.phone_seq))
+        defaults = {
+            'full_name': user.full_name,
+            'number_phone': seq.zfill(10),
+            'email': user.email,
+            'CCCD': seq.zfill(12),
+            'BHYT': seq.zfill(10),
+            'day_of_birth': date(2000, 1, 1),
+            'occupation': 'student',
+            'address': 'HCM',
+            'medical_history': '<p>Không</p>',
+        }
+        defaults.update(kwargs)
+        return HealthRecord.objects.create(user=user, **defaults)
+
+    def create_schedule(self, doctor, days_ahead=3, start=time(8, 0), end=time(9, 0), capacity=1, **kwargs):
+        return Schedule.objects.create(doctor=doctor.user, date=date.today() + timedelta(days=days_ahead),
+                                       start_time=start, end_time=end, capacity=capacity, **kwargs)
+
+    def create_doctor(self, username, hospital=None, specialization=None, **kwargs):
+        user = self.create_user(username, role='doctor')
+        return Doctor.objects.create(user=user,
+                                     hospital=hospital or self.hospital,
+                                     specialization=specialization or self.specialization,
+                                     **kwargs)
+
+
+class DoctorListQueryTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.patient = self.create_user('patient')
+
+    def add_doctors(self, count):
+        for i in range(Doctor.objects.count(), Doctor.objects.count() + count):
+            doctor = self.create_doctor(f'doctor{i}')
+            Review.objects.create(doctor=doctor.user, patient=self.patient, rating=4)
+            Review.objects.create(doctor=doctor.user, patient=self.patient, rating=5)
+        ratings.rebuild_stats()
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get('/doctors/')
+        self.assertEqual(res.status_code, 200)
+        return len(ctx.captured_queries), res.data['results']
+
+    def test_query_count_independent_of_doctor_count(self):
+        self.add_doctors(1)
+        small_count, small_data = self.count_list_queries()
+        self.add_doctors(5)
+        large_count, large_data = self.count_list_queries()
+
+        self.assertEqual(len(small_data), 1)
+        self.assertEqual(len(large_data), 6)
+        self.assertEqual(small_count, large_count)
+
+    def test_rating_statistics(self):
+        self.add_doctors(1)
+        self.create_doctor('no_review')
+        _, data = self.count_list_queries()
+        stats = {d['user']['username']: (d['total_reviews'], d['average_rating']) for d in data}
+        self.assertEqual(stats['doctor0'], (2, 4.5))
+        self.assertEqual(stats['no_review'], (0, 0))
+
+    def test_doctor_by_user(self):
+        self.add_doctors(1)
+        doctor = Doctor.objects.get()
+        res = self.client.get('/doctors/by-user/', {'user_id': doctor.user_id})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['total_reviews'], 2)
+        self.assertEqual(res.data['average_rating'], 4.5)
+
+
+class DoctorRatingStatsTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.patient = self.create_user('patient')
+        self.doctor = self.create_doctor('doctor')
+        self.client.force_authenticate(self.patient)
+
+    def stats(self, doctor=None):
+        return DoctorRatingStats.objects.get(doctor=(doctor or self.doctor).user)
+
+    def post_review(self, rating, doctor=None):
+        res = self.client.post('/reviews/', {'doctor': (doctor or self.doctor).user_id, 'rating': rating,
+                                             'comment': 'ok'}, format='json')
+        self.assertEqual(res.status_code, 201)
+        return res.data['id']
+
+    def test_create_update_destroy_keep_stats_in_sync(self):
+        first = self.post_review(5)
+        second = self.post_review(3)
+        stats = self.stats()
+        self.assertEqual((stats.review_count, stats.rating_sum, stats.average_rating), (2, 8, 4.0))
+        self.assertEqual(stats.histogram, {1: 0, 2: 0, 3: 1, 4: 0, 5: 1})
+        self.assertIsNotNone(stats.last_review_at)
+
+        res = self.client.patch(f'/reviews/{second}/', {'rating': 1}, format='json')
+        self.assertEqual(res.status_code, 200)
+        stats = self.stats()
+        self.assertEqual((stats.review_count, stats.rating_sum), (2, 6))
+        self.assertEqual(stats.histogram, {1: 1, 2: 0, 3: 0, 4: 0, 5: 1})
+
+        res = self.client.delete(f'/reviews/{first}/')
+        self.assertEqual(res.status_code, 204)
+        stats = self.stats()
+        self.assertEqual((stats.review_count, stats.rating_sum, stats.star_5), (1, 1, 0))
+        self.assertEqual(ratings.find_drift(), [])
+
+    def test_move_review_to_another_doctor(self):
+        other = self.create_doctor('other')
+        review_id = self.post_review(4)
+        res = self.client.patch(f'/reviews/{review_id}/', {'doctor': other.user_id}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.stats().review_count, 0)
+        self.assertIsNone(self.stats().last_review_at)
+        self.assertEqual(self.stats(other).review_count, 1)
+        self.assertEqual(ratings.find_drift(), [])
+
+    def test_find_drift_and_rebuild(self):
+        self.post_review(4)
+        # bulk_create không phát signal nên thống kê bị lệch
+        Review.objects.bulk_create([Review(doctor=self.doctor.user, patient=self.patient, rating=2)])
+
+        drift = {row['field']: (row['stored'], row['expected']) for row in ratings.find_drift()}
+        self.assertEqual(drift['review_count'], (1, 2))
+        self.assertEqual(drift['star_2'], (0, 1))
+
+        self.assertEqual(ratings.rebuild_stats(), 1)
+        self.assertEqual(ratings.find_drift(), [])
+        self.assertEqual(self.stats().average_rating, 3.0)
+
+    def test_reviews_changed_outside_api_keep_stats_in_sync(self):
+        # Tạo/sửa/xoá trực tiếp (admin, shell) cũng cập nhật thống kê qua signal
+        review = Review.objects.create(doctor=self.doctor.user, patient=self.patient, rating=5)
+        Review.objects.create(doctor=self.doctor.user, patient=self.patient, rating=3)
+        self.assertEqual((self.stats().review_count, self.stats().rating_sum), (2, 8))
+
+        review.rating = 1
+        review.save()
+        self.assertEqual(self.stats().histogram, {1: 1, 2: 0, 3: 1, 4: 0, 5: 0})
+        review.reply = 'Cảm ơn'
+        review.save(update_fields=['reply'])
+        self.assertEqual(self.stats().rating_sum, 4)
+
+        review.delete()
+        self.assertEqual((self.stats().review_count, self.stats().rating_sum), (1, 3))
+        self.assertEqual(ratings.find_drift(), [])
+
+    def test_admin_review_changes_keep_stats_in_sync(self):
+        admin = self.create_user('admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        review = Review.objects.create(doctor=self.doctor.user, patient=self.patient, rating=5)
+
+        res = self.client.post(f'/admin/clinic/review/{review.id}/change/', {
+            'rating': 2, 'comment': 'ok', 'reply': '', 'patient': self.patient.id, 'doctor': self.doctor.user_id,
+            'active': 'on'})
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(self.stats().histogram, {1: 0, 2: 1, 3: 0, 4: 0, 5: 0})
+
+        res = self.client.post(f'/admin/clinic/review/{review.id}/delete/', {'post': 'yes'})
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(self.stats().review_count, 0)
+        self.assertEqual(ratings.find_drift(), [])
+
+    def test_doctor_list_ordering_by_rating(self):
+        other = self.create_doctor('other')
+        self.create_doctor('no_review')
+        self.post_review(3)
+        self.post_review(5, doctor=other)
+        res = self.client.get('/doctors/', {'ordering': 'rating'})
+        self.assertEqual([d['user']['username'] for d in res.data['results']], ['other', 'doctor', 'no_review'])
+
+
+class BookingServiceTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+        self.patient = self.create_user('patient')
+        self.record = self.create_healthrecord(self.patient)
+        self.client.force_authenticate(self.patient)
+
+    def book(self, schedule, record=None):
+        return self.client.post('/appointments/', {'schedule_id': schedule.id,
+                                                   'healthrecord_id': (record or self.record).id,
+                                                   'disease_type': 'Khac'}, format='json')
+
+    def test_book_until_full(self):
+        schedule = self.create_schedule(self.doctor, capacity=2)
+        self.assertEqual(self.book(schedule).status_code, 201)
+        self.assertEqual(self.book(schedule).status_code, 400)  # trùng lịch
+        other = self.create_healthrecord(self.create_user('other'))
+        self.assertEqual(self.book(schedule, other).status_code, 201)
+        third = self.create_healthrecord(self.create_user('third'))
+        self.assertEqual(self.book(schedule, third).status_code, 400)  # lịch đã đầy
+
+        schedule.refresh_from_db()
+        self.assertEqual((schedule.sum_booking, schedule.active), (2, False))
+        self.assertEqual(Appointment.objects.filter(schedule=schedule).count(), 2)
+        # Email xác nhận được đưa vào hàng đợi, không gửi trong request
+        self.assertEqual(EmailOutbox.objects.count(), 2)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_cancel_releases_seat_and_allows_rebooking(self):
+        schedule = self.create_schedule(self.doctor)
+        appointment_id = self.book(schedule).data['id']
+        res = self.client.patch(f'/appointments/{appointment_id}/cancel/', {'reason': 'Bận'}, format='json')
+        self.assertEqual(res.status_code, 200)
+        schedule.refresh_from_db()
+        self.assertEqual((schedule.sum_booking, schedule.active), (0, True))
+
+        res = self.client.patch(f'/appointments/{appointment_id}/cancel/', {'reason': 'Bận'}, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.book(schedule).status_code, 201)
+
+    def test_reschedule_moves_seat(self):
+        old = self.create_schedule(self.doctor)
+        new = self.create_schedule(self.doctor, start=time(9, 0), end=time(10, 0))
+        appointment_id = self.book(old).data['id']
+
+        res = self.client.patch(f'/appointments/{appointment_id}/reschedule/', {'new_schedule_id': new.id},
+                                format='json')
+        self.assertEqual(res.status_code, 200)
+        old.refresh_from_db()
+        new.refresh_from_db()
+        self.assertEqual((old.sum_booking, old.active), (0, True))
+        self.assertEqual((new.sum_booking, new.active), (1, False))
+
+        # Lịch cũ đã được trả chỗ, lịch mới đã đầy
+        other = self.create_healthrecord(self.create_user('other'))
+        self.assertEqual(self.book(old, other).status_code, 201)
+        res = self.client.patch(f'/appointments/{appointment_id}/reschedule/', {'new_schedule_id': old.id},
+                                format='json')
+        self.assertEqual(res.status_code, 400)
+
+    def test_unique_active_booking_constraint(self):
+        schedule = self.create_schedule(self.doctor, capacity=5)
+        booking.book_appointment(schedule, self.record, disease_type='Khac')
+        with self.assertRaises(ValidationError):
+            booking.book_appointment(schedule, self.record, disease_type='Khac')
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.sum_booking, 1)
+
+
+@unittest.skipIf(connection.vendor == 'sqlite' and connection.is_in_memory_db(),
+                 'SQLite in-memory không hỗ trợ ghi đồng thời từ nhiều thread')
+class BookingConcurrencyTest(ClinicTestMixin, TransactionTestCase):
+    THREADS = 12
+
+    def setUp(self):
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+
+    def run_concurrently(self, schedule, records):
+        barrier = threading.Barrier(len(records))
+        results = []
+
+        def worker(record):
+            try:
+                barrier.wait()
+                booking.book_appointment(schedule, record, disease_type='Khac')
+                results.append(True)
+            except ValidationError:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(record,)) for record in records]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), len(records))
+        return results
+
+    def test_no_overbooking(self):
+        schedule = self.create_schedule(self.doctor, capacity=3)
+        records = [self.create_healthrecord(self.create_user(f'patient{i}')) for i in range(self.THREADS)]
+
+        results = self.run_concurrently(schedule, records)
+
+        schedule.refresh_from_db()
+        self.assertEqual(results.count(True), 3)
+        self.assertEqual(schedule.sum_booking, 3)
+        self.assertFalse(schedule.active)
+        self.assertEqual(Appointment.objects.filter(schedule=schedule).count(), 3)
+
+    def test_no_duplicate_booking(self):
+        schedule = self.create_schedule(self.doctor, capacity=self.THREADS)
+        record = self.create_healthrecord(self.create_user('patient'))
+
+        results = self.run_concurrently(schedule, [record] * self.THREADS)
+
+        schedule.refresh_from_db()
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(schedule.sum_booking, 1)
+        self.assertEqual(Appointment.objects.filter(schedule=schedule).count(), 1)
+
+
+class CountingEmailBackend(EmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP timeout')
+
+
+class LeaseCheckingEmailBackend(EmailBackend):
+    # Ghi lại trạng thái transaction và số email còn đến hạn (worker khác có thể lấy) ngay lúc gửi
+    checks = []
+
+    def send_messages(self, messages):
+        due = EmailOutbox.objects.filter(status=EmailOutbox.Status.PENDING, next_attempt_at__lte=timezone.now())
+        LeaseCheckingEmailBackend.checks.append((connection.in_atomic_block, due.count()))
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2, EMAIL_OUTBOX_RETRY_BASE_SECONDS=60)
+class EmailOutboxTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = self.create_user('patient')
+
+    def request_otp(self):
+        res = self.client.post('/api/password-reset/otp/', {'email': self.patient.email}, format='json')
+        self.assertEqual(res.status_code, 200)
+
+    def test_request_only_queues_email(self):
+        self.request_otp()
+        self.assertEqual(len(mail.outbox), 0)
+        email = EmailOutbox.objects.get()
+        self.assertEqual((email.to, email.status), ([self.patient.email], EmailOutbox.Status.PENDING))
+
+        self.assertEqual(send_queued_emails(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        email.refresh_from_db()
+        self.assertEqual(email.status, EmailOutbox.Status.SENT)
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+    def test_sent_email_body_is_purged(self):
+        self.request_otp()
+        otp = PasswordResetOTP.objects.get().otp_code
+        self.assertIn(otp, EmailOutbox.objects.get().body)
+
+        send_queued_emails()
+        self.assertIn(otp, mail.outbox[0].body)
+        email = EmailOutbox.objects.get()
+        self.assertEqual((email.body, email.html_body), ('', ''))
+
+        admin = self.create_user('admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        res = self.client.get(f'/admin/clinic/emailoutbox/{email.id}/change/')
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('name="body"', res.content.decode())
+
+    @override_settings(EMAIL_BACKEND='clinic.tests.CountingEmailBackend')
+    def test_batch_reuses_one_connection(self):
+        for _ in range(3):
+            self.request_otp()
+        CountingEmailBackend.opened = 0
+        self.assertEqual(send_queued_emails(), (3, 0))
+        self.assertEqual(CountingEmailBackend.opened, 1)
+
+    def test_retry_with_backoff_then_dead_letter(self):
+        self.request_otp()
+        with self.settings(EMAIL_BACKEND='clinic.tests.FailingEmailBackend'):
+            self.assertEqual(send_queued_emails(), (0, 1))
+            email = EmailOutbox.objects.get()
+            self.assertEqual((email.status, email.attempts), (EmailOutbox.Status.PENDING, 1))
+            self.assertGreater(email.next_attempt_at, timezone.now())
+            self.assertIn('SMTP timeout', email.last_error)
+
+            # Chưa đến hạn thử lại
+            self.assertEqual(send_queued_emails(), (0, 0))
+
+            EmailOutbox.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(send_queued_emails(), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (EmailOutbox.Status.DEAD, 2))
+        self.assertEqual(len(mail.outbox), 0)
+
+
+@override_settings(EMAIL_BACKEND='clinic.tests.LeaseCheckingEmailBackend')
+class EmailOutboxLeaseTest(TransactionTestCase):
+    def test_sends_outside_transaction_on_leased_rows(self):
+        for i in range(2):
+            queue_email('Thông báo', f'Nội dung {i}', [f'patient{i}@clinic.test'])
+        LeaseCheckingEmailBackend.checks = []
+        self.assertEqual(send_queued_emails(), (2, 0))
+        self.assertEqual(LeaseCheckingEmailBackend.checks, [(False, 0), (False, 0)])
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.Status.SENT).count(), 2)
+
+    def test_expired_lease_is_picked_up_again(self):
+        queue_email('Thông báo', 'Nội dung', ['patient@clinic.test'])
+        EmailOutbox.objects.update(next_attempt_at=timezone.now() + timedelta(seconds=300))
+        self.assertEqual(send_queued_emails(), (0, 0))
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(send_queued_emails(), (1, 0))
+
+
+class MessageSyncTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = self.create_user('patient')
+        self.doctor = self.create_user('doctor', role='doctor')
+        self.stranger = self.create_user('stranger')
+        self.client.force_authenticate(self.patient)
+
+    def send(self, sender, receiver, content):
+        return Message.objects.create(sender=sender, receiver=receiver, content=content)
+
+    def sync(self, **params):
+        res = self.client.get('/messages/sync/', {'participant_id': self.doctor.id, **params})
+        self.assertEqual(res.status_code, 200)
+        return res.data
+
+    def test_returns_only_newer_messages_with_compact_users(self):
+        first = self.send(self.patient, self.doctor, 'Chào bác sĩ')
+        second = self.send(self.doctor, self.patient, 'Chào bạn')
+        self.send(self.stranger, self.patient, 'Tin nhắn khác')
+
+        data = self.sync()
+        self.assertEqual([m['id'] for m in data['messages']], [first.id, second.id])
+        self.assertEqual(data['messages'][1]['sender'], self.doctor.id)
+        self.assertEqual(data['last_id'], second.id)
+        self.assertFalse(data['has_more'])
+
+        data = self.sync(after_id=second.id)
+        self.assertEqual((data['messages'], data['last_id']), ([], second.id))
+
+        third = self.send(self.doctor, self.patient, 'Bạn khoẻ không?')
+        data = self.sync(after_id=second.id)
+        self.assertEqual([m['id'] for m in data['messages']], [third.id])
+
+    def test_marks_received_messages_read_in_bulk(self):
+        sent = self.send(self.patient, self.doctor, 'Chào bác sĩ')
+        received = [self.send(self.doctor, self.patient, f'Tin {i}') for i in range(3)]
+        self.sync()
+        self.assertTrue(all(Message.objects.filter(pk__in=[m.id for m in received]).values_list('is_read', flat=True)))
+        sent.refresh_from_db()
+        self.assertFalse(sent.is_read)
+
+    def test_limit_and_has_more(self):
+        messages = [self.send(self.doctor, self.patient, f'Tin {i}') for i in range(5)]
+        data = self.sync(limit=2)
+        self.assertEqual(len(data['messages']), 2)
+        self.assertTrue(data['has_more'])
+        # Chỉ đánh dấu đã đọc những tin nhắn client đã nhận
+        self.assertEqual(Message.objects.filter(is_read=True).count(), 2)
+
+        data = self.sync(limit=10, after_id=data['last_id'])
+        self.assertEqual([m['id'] for m in data['messages']], [m.id for m in messages[2:]])
+        self.assertFalse(data['has_more'])
+
+    def test_invalid_params_return_400(self):
+        doctor = self.doctor.id
+        # limit=0 trả về trang rỗng với has_more=True làm client lặp mãi, limit âm không cắt được queryset
+        for params in ({'participant_id': 'abc'}, {'participant_id': doctor, 'after_id': 'x'},
+                       {'participant_id': doctor, 'limit': 'x'}, {'participant_id': doctor, 'limit': 0},
+                       {'participant_id': doctor, 'limit': -5}, {}):
+            res = self.client.get('/messages/sync/', params)
+            self.assertEqual(res.status_code, 400)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatWebSocketTest(ClinicTestMixin, TransactionTestCase):
+    application = OAuth2TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    def setUp(self):
+        self.patient = self.create_user('patient')
+        self.doctor = self.create_user('doctor', role='doctor')
+        self.stranger = self.create_user('stranger')
+        self.tokens = {user.id: AccessToken.objects.create(user=user, token=f'token-{user.username}',
+                                                           expires=timezone.now() + timedelta(hours=1)).token
+                       for user in [self.patient, self.doctor, self.stranger]}
+
+    async def connect(self, user, participant, token=None):
+        token = token or self.tokens[user.id]
+        communicator = WebsocketCommunicator(self.application, f'/ws/chat/{participant.id}/?token={token}')
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def test_new_message_pushed_to_both_participants(self):
+        patient_ws, connected = await self.connect(self.patient, self.doctor)
+        self.assertTrue(connected)
+        doctor_ws, connected = await self.connect(self.doctor, self.patient)
+        self.assertTrue(connected)
+        stranger_ws, connected = await self.connect(self.stranger, self.patient)
+        self.assertTrue(connected)
+
+        message = await sync_to_async(Message.objects.create)(sender=self.patient, receiver=self.doctor,
+                                                               content='Chào bác sĩ')
+
+        for ws in [patient_ws, doctor_ws]:
+            data = await ws.receive_json_from(timeout=2)
+            self.assertEqual((data['id'], data['sender'], data['receiver']),
+                             (message.id, self.patient.id, self.doctor.id))
+        self.assertTrue(await stranger_ws.receive_nothing())
+
+        for ws in [patient_ws, doctor_ws, stranger_ws]:
+            await ws.disconnect()
+
+    async def test_rejects_invalid_token(self):
+        _, connected = await self.connect(self.patient, self.doctor, token='invalid')
+        self.assertFalse(connected)
+
+    async def test_rejects_expired_token(self):
+        await sync_to_async(AccessToken.objects.filter(user=self.patient).update)(
+            expires=timezone.now() - timedelta(minutes=1))
+        _, connected = await self.connect(self.patient, self.doctor)
+        self.assertFalse(connected)
+
+
+class HotPathIndexTest(ClinicTestMixin, TestCase):
+    """
+    Kiểm tra (bằng EXPLAIN) các truy vấn thường dùng đều tìm theo index, không quét toàn bảng
+    """
+
+    def setUp(self):
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctors = [self.create_doctor(f'doctor{i}') for i in range(3)]
+        self.patients = [self.create_user(f'patient{i}') for i in range(5)]
+        self.records = [self.create_healthrecord(p) for p in self.patients]
+
+        schedules = [Schedule(doctor=d.user, date=date.today() + timedelta(days=day), start_time=time(hour, 0),
+                              end_time=time(hour, 30), capacity=5)
+                     for d in self.doctors for day in range(30) for hour in range(8, 12)]
+        Schedule.objects.bulk_create(schedules)
+        schedules = list(Schedule.objects.all())
+        Appointment.objects.bulk_create([
+            Appointment(schedule=schedule, healthrecord=record, disease_type='Khac',
+                        status=['unpaid', 'paid', 'completed'][i % 3])
+            for i, schedule in enumerate(schedules) for record in self.records[:i % 3 + 1]])
+        Message.objects.bulk_create([
+            Message(sender=self.patients[i % 5], receiver=self.doctors[i % 3].user, content=f'Tin {i}')
+            for i in range(300)])
+        with connection.cursor() as cursor:
+            if connection.vendor in ('sqlite', 'postgresql'):
+                cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, *tables):
+        plan = queryset.explain()
+        for table in tables:
+            lines = [line for line in plan.splitlines() if table in line]
+            self.assertTrue(lines, f'{table} không có trong plan:\n{plan}')
+            for line in lines:
+                if connection.vendor == 'sqlite':
+                    self.assertRegex(line, r'SEARCH .*USING (COVERING |PRIMARY KEY|INTEGER PRIMARY KEY|INDEX)',
+                                     f'Quét toàn bảng {table}:\n{plan}')
+                elif connection.vendor == 'postgresql':
+                    self.assertNotIn(f'Seq Scan on {table}', line, f'Quét toàn bảng {table}:\n{plan}')
+                elif connection.vendor == 'mysql':
+                    self.assertNotRegex(line, r'\tALL\t', f'Quét toàn bảng {table}:\n{plan}')
+
+    def test_schedule_by_doctor_date_active(self):
+        doctor = self.doctors[0].user
+        qs = Schedule.objects.filter(doctor_id=doctor.id, date=date.today() + timedelta(days=2), active=True)
+        self.assertUsesIndex(qs, 'clinic_schedule')
+
+    def test_doctor_report_appointments(self):
+        doctor = self.doctors[1].user
+        today = date.today()
+        qs = Appointment.objects.filter(schedule__doctor=doctor, status='completed',
+                                        schedule__date__range=(today, today + timedelta(days=30)))
+        self.assertUsesIndex(qs, 'clinic_schedule', 'clinic_appointment')
+
+    def test_duplicate_booking_check(self):
+        schedule = Schedule.objects.first()
+        qs = Appointment.objects.filter(healthrecord=self.records[0], schedule=schedule, cancel=False)
+        self.assertUsesIndex(qs, 'clinic_appointment')
+
+    def test_doctor_overlap_check(self):
+        qs = overlaps.doctor_conflicts(self.doctors[0].user_id, date.today() + timedelta(days=2),
+                                       time(8, 15), time(9, 15))
+        self.assertUsesIndex(qs, 'clinic_schedule')
+
+    def test_patient_overlap_check(self):
+        schedule = Schedule.objects.filter(doctor=self.doctors[2].user).first()
+        qs = overlaps.patient_conflicts(self.records[0].id, schedule)
+        self.assertUsesIndex(qs, 'clinic_schedule', 'clinic_appointment')
+
+    def test_conversation_messages(self):
+        patient, doctor = self.patients[0], self.doctors[0].user
+        qs = Message.objects.filter(Q(sender=patient, receiver=doctor) | Q(sender=doctor, receiver=patient)) \
+            .order_by('created_date')
+        self.assertUsesIndex(qs, 'clinic_message')
+
+    def test_message_sync(self):
+        patient, doctor = self.patients[0], self.doctors[0].user
+        qs = Message.objects.filter(Q(sender=patient, receiver=doctor) | Q(sender=doctor, receiver=patient),
+                                    id__gt=10).order_by('id')
+        self.assertUsesIndex(qs, 'clinic_message')
+
+    def test_expired_unpaid_appointments(self):
+        qs = Appointment.objects.filter(status='unpaid', created_date__lt=timezone.now() - timedelta(minutes=30)) \
+            .order_by('status', 'created_date')
+        self.assertUsesIndex(qs, 'clinic_appointment')
+
+    def test_due_notifications(self):
+        now = timezone.now()
+        Notification.objects.bulk_create([
+            Notification(title=f'Thông báo {i}', content='x', send_at=now + timedelta(hours=i - 100),
+                         published_at=now if i < 100 else None) for i in range(200)])
+        self.assertUsesIndex(notifications.due_notifications(now).order_by('send_at', 'id'), 'clinic_notification')
+
+    def test_doctor_name_search(self):
+        qs = search.filter_queryset(Doctor.objects.all(), 'doctor', 'doctr1')
+        self.assertEqual(list(qs), [self.doctors[1]])
+        self.assertIn('search_word_idx', qs.explain())
+
+
+class PaginationTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.patient = self.create_user('patient')
+        self.client.force_authenticate(self.patient)
+
+    def collect_cursor_pages(self, url, params):
+        ids, pages = [], 0
+        res = self.client.get(url, params)
+        while True:
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn('count', res.data)
+            ids += [row['id'] for row in res.data['results']]
+            pages += 1
+            if not res.data['next']:
+                return ids, pages
+            res = self.client.get(res.data['next'])
+
+    def test_default_page_number_pagination(self):
+        for i in range(5):
+            self.create_user(f'doctor{i}', role='doctor')
+        res = self.client.get('/users/doctors/', {'page_size': 2})
+        self.assertEqual(res.data['count'], 5)
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertIsNotNone(res.data['next'])
+
+        res = self.client.get('/users/doctors/', {'page_size': 2, 'page': 3})
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertIsNone(res.data['next'])
+
+    def test_page_size_is_capped(self):
+        Specialization.objects.bulk_create([Specialization(name=f'Khoa {i}') for i in range(120)])
+        res = self.client.get('/specializations/', {'page_size': 1000})
+        self.assertEqual(len(res.data['results']), 100)
+
+    def test_message_keyset_pages(self):
+        doctor = self.create_user('doctor', role='doctor')
+        Message.objects.bulk_create([Message(sender=self.patient, receiver=doctor, content=f'Tin {i}')
+                                     for i in range(7)])
+        ids, pages = self.collect_cursor_pages('/messages/', {'participant_id': doctor.id, 'page_size': 3})
+        self.assertEqual(ids, sorted(Message.objects.values_list('id', flat=True)))
+        self.assertEqual(pages, 3)
+
+    def test_appointment_keyset_pages_newest_first(self):
+        doctor = self.create_doctor('doctor')
+        record = self.create_healthrecord(self.patient)
+        for day in range(5):
+            schedule = self.create_schedule(doctor, days_ahead=day + 1)
+            Appointment.objects.create(schedule=schedule, healthrecord=record, disease_type='Khac')
+        ids, pages = self.collect_cursor_pages('/appointments/', {'page_size': 2})
+        self.assertEqual(ids, sorted(Appointment.objects.values_list('id', flat=True), reverse=True))
+        self.assertEqual(pages, 3)
+
+    def test_keyset_page_does_not_use_offset(self):
+        doctor = self.create_user('doctor', role='doctor')
+        Message.objects.bulk_create([Message(sender=self.patient, receiver=doctor, content=f'Tin {i}')
+                                     for i in range(6)])
+        res = self.client.get('/messages/', {'participant_id': doctor.id, 'page_size': 3})
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(res.data['next'])
+        sql = [q['sql'] for q in ctx.captured_queries if 'clinic_message' in q['sql']]
+        self.assertTrue(sql)
+        self.assertTrue(all('OFFSET' not in s.upper() for s in sql), sql)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'catalog-test'}})
+class CatalogCacheTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+
+    def get(self, url, params=None, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url, params, headers=headers)
+        return res, len(ctx.captured_queries)
+
+    def test_second_request_served_from_cache(self):
+        res, queries = self.get('/hospitals/')
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(queries, 0)
+        self.assertIn('ETag', res.headers)
+
+        cached, queries = self.get('/hospitals/')
+        self.assertEqual(queries, 0)
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(cached.headers['ETag'], res.headers['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        res, _ = self.get('/doctors/')
+        etag = res.headers['ETag']
+        res, queries = self.get('/doctors/', If_None_Match=etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b'')
+        self.assertEqual(queries, 0)
+
+        res, _ = self.get('/doctors/', If_None_Match='"khac"')
+        self.assertEqual(res.status_code, 200)
+
+    def test_keyed_by_query_params(self):
+        Specialization.objects.create(name='Nhi khoa')
+        all_items, _ = self.get('/specializations/')
+        filtered, _ = self.get('/specializations/', {'name': 'Nhi'})
+        self.assertEqual(all_items.data['count'], 2)
+        self.assertEqual([s['name'] for s in filtered.data['results']], ['Nhi khoa'])
+
+    def test_save_and_delete_invalidate(self):
+        res, _ = self.get(f'/hospitals/{self.hospital.id}/')
+        self.hospital.name = 'BV Nhân Dân 115'
+        self.hospital.save()
+        updated, queries = self.get(f'/hospitals/{self.hospital.id}/')
+        self.assertGreater(queries, 0)
+        self.assertEqual(updated.data['name'], 'BV Nhân Dân 115')
+        self.assertNotEqual(updated.headers['ETag'], res.headers['ETag'])
+
+        # Bác sĩ hiển thị tên bệnh viện nên cũng phải được làm mới
+        doctors, _ = self.get('/doctors/')
+        self.assertEqual(doctors.data['results'][0]['hospital_name'], 'BV Nhân Dân 115')
+
+        extra = Specialization.objects.create(name='Nhi khoa')
+        res, _ = self.get('/specializations/')
+        self.assertEqual(res.data['count'], 2)
+        extra.delete()
+        res, _ = self.get('/specializations/')
+        self.assertEqual(res.data['count'], 1)
+
+    def test_new_review_refreshes_doctor_rating(self):
+        patient = self.create_user('patient')
+        self.get('/doctors/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(doctor=self.doctor.user, patient=patient, rating=4)
+        res, _ = self.get('/doctors/')
+        self.assertEqual(res.data['results'][0]['average_rating'], 4.0)
+
+    def test_requires_shared_cache_outside_debug(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                             'LOCATION': 'redis://localhost:6379/2'}}
+        with self.settings(CACHES=local, DEBUG=False):
+            with self.assertRaises(ImproperlyConfigured):
+                caching.require_shared()
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['clinic.E001'])
+        with self.settings(CACHES=local, DEBUG=True):
+            caching.require_shared()
+        with self.settings(CACHES=redis, DEBUG=False):
+            caching.require_shared()
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_login_does_not_invalidate(self):
+        self.get('/doctors/')
+        version = caching.get_version(caching.DOCTORS)
+        self.doctor.user.last_login = timezone.now()
+        self.doctor.user.save(update_fields=['last_login'])
+        self.assertEqual(caching.get_version(caching.DOCTORS), version)
+        self.doctor.user.save()
+        self.assertNotEqual(caching.get_version(caching.DOCTORS), version)
+
+
+class DoctorAvailabilityTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+        self.patient = self.create_user('patient')
+        self.record = self.create_healthrecord(self.patient)
+
+    def summary(self, schedule):
+        return DoctorAvailability.objects.filter(doctor=schedule.doctor, date=schedule.date) \
+            .values('free_slots', 'slot_count', 'free_capacity', 'capacity').first()
+
+    def test_summary_follows_schedules_and_bookings(self):
+        first = self.create_schedule(self.doctor, start=time(8, 0), end=time(9, 0), capacity=1)
+        self.create_schedule(self.doctor, start=time(9, 0), end=time(10, 0), capacity=2)
+        self.assertEqual(self.summary(first), {'free_slots': 2, 'slot_count': 2, 'free_capacity': 3, 'capacity': 3})
+
+        appointment = booking.book_appointment(first, self.record, disease_type='Khac')
+        self.assertEqual(self.summary(first), {'free_slots': 1, 'slot_count': 2, 'free_capacity': 2, 'capacity': 3})
+
+        booking.cancel_appointment(appointment)
+        self.assertEqual(self.summary(first)['free_capacity'], 3)
+
+    def test_upsert_on_mysql_uses_unique_constraint(self):
+        # MySQL không hỗ trợ unique_fields (ON CONFLICT (...)), upsert dựa vào ON DUPLICATE KEY UPDATE
+        schedule = self.create_schedule(self.doctor)
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                patch('django.db.models.query.QuerySet.bulk_create', autospec=True) as bulk_create:
+            availability.refresh_days([(schedule.doctor_id, schedule.date)])
+            availability.refresh_range([schedule.doctor_id], schedule.date, schedule.date)
+        self.assertEqual(bulk_create.call_count, 2)
+        for call in bulk_create.call_args_list:
+            self.assertTrue(call.kwargs['update_conflicts'])
+            self.assertNotIn('unique_fields', call.kwargs)
+
+    def test_upsert_without_conflict_support_reinserts_days(self):
+        first = self.create_schedule(self.doctor, start=time(8, 0), end=time(9, 0), capacity=1)
+        second = self.create_schedule(self.doctor, start=time(9, 0), end=time(10, 0), capacity=2)
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                patch.object(connection.features, 'supports_update_conflicts', False):
+            Schedule.objects.filter(pk=first.pk).update(sum_booking=1)
+            availability.refresh_days([(first.doctor_id, first.date)])
+            self.assertEqual(self.summary(first),
+                             {'free_slots': 1, 'slot_count': 2, 'free_capacity': 2, 'capacity': 3})
+            Schedule.objects.filter(pk=second.pk).update(sum_booking=2)
+            availability.refresh_range([self.doctor.user_id], first.date, first.date)
+        self.assertEqual(DoctorAvailability.objects.count(), 1)
+        self.assertEqual(self.summary(first), {'free_slots': 0, 'slot_count': 2, 'free_capacity': 0, 'capacity': 3})
+
+    def test_moving_and_deleting_schedule(self):
+        schedule = self.create_schedule(self.doctor, days_ahead=3)
+        old_date = schedule.date
+        schedule.date = old_date + timedelta(days=1)
+        schedule.save()
+        self.assertFalse(DoctorAvailability.objects.filter(date=old_date).exists())
+        self.assertEqual(self.summary(schedule)['slot_count'], 1)
+
+        schedule.delete()
+        self.assertFalse(DoctorAvailability.objects.exists())
+
+    def test_rebuild_matches_incremental(self):
+        for day in range(1, 4):
+            self.create_schedule(self.doctor, days_ahead=day, capacity=2)
+        booking.book_appointment(Schedule.objects.first(), self.record, disease_type='Khac')
+        fields = ('doctor_id', 'date', 'free_slots', 'slot_count', 'free_capacity', 'capacity')
+        incremental = list(DoctorAvailability.objects.order_by('date').values_list(*fields))
+        self.assertEqual(availability.rebuild(), 3)
+        self.assertEqual(list(DoctorAvailability.objects.order_by('date').values_list(*fields)), incremental)
+
+    def test_specialization_calendar_in_one_query(self):
+        other = self.create_doctor('other')
+        outsider = self.create_doctor('outsider', specialization=self.create_specialization('Nhi'))
+        for doctor in (self.doctor, other, outsider):
+            for day in range(1, 6):
+                self.create_schedule(doctor, days_ahead=day)
+        full = Schedule.objects.get(doctor=other.user, date=date.today() + timedelta(days=2))
+        booking.book_appointment(full, self.record, disease_type='Khac')
+
+        with self.assertNumQueries(1):
+            res = self.client.get('/availability/', {'specialization_id': self.specialization.id,
+                                                     'start': date.today().isoformat(), 'days': 60})
+        self.assertEqual(res.status_code, 200)
+        calendar = {row['doctor_id']: [d['date'] for d in row['days']] for row in res.data['doctors']}
+        self.assertEqual(set(calendar), {self.doctor.user_id, other.user_id})
+        self.assertEqual(len(calendar[self.doctor.user_id]), 5)
+        self.assertNotIn(full.date, calendar[other.user_id])
+
+        res = self.client.get('/availability/', {'doctor_id': outsider.user_id, 'days': 3})
+        self.assertEqual([row['doctor_id'] for row in res.data['doctors']], [outsider.user_id])
+        self.assertEqual(len(res.data['doctors'][0]['days']), 2)
+
+    def test_available_dates(self):
+        self.create_schedule(self.doctor, days_ahead=-1)
+        upcoming = self.create_schedule(self.doctor, days_ahead=2)
+        res = self.client.get('/schedules/available-dates/', {'doctor_id': self.doctor.user_id})
+        self.assertEqual(list(res.data), [upcoming.date])
+        self.assertEqual(self.client.get('/availability/').status_code, 400)
+
+
+class AppointmentListQueryTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.specialization = self.create_specialization()
+        self.patient = self.create_user('patient')
+        self.client.force_authenticate(self.patient)
+        self.record = self.create_healthrecord(self.patient, medical_history='<p>' + 'Tiền sử ' * 500 + '</p>')
+        self.doctor_seq = itertools.count()
+
+    def add_appointments(self, count):
+        # Mỗi lịch hẹn với một bác sĩ, bệnh viện khác nhau để lộ ra truy vấn N+1 nếu có
+        for _ in range(count):
+            i = next(self.doctor_seq)
+            doctor = self.create_doctor(f'doctor{i}', hospital=self.create_hospital(f'BV {i}'))
+            schedule = self.create_schedule(doctor, days_ahead=i + 1)
+            Appointment.objects.create(schedule=schedule, healthrecord=self.record, disease_type='Khac')
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get('/appointments/', {'page_size': 50})
+        self.assertEqual(res.status_code, 200)
+        return len(ctx.captured_queries), res.data['results']
+
+    def test_query_count_independent_of_appointment_count(self):
+        self.add_appointments(2)
+        small_count, small_data = self.count_list_queries()
+        self.add_appointments(8)
+        large_count, large_data = self.count_list_queries()
+        self.assertEqual((len(small_data), len(large_data)), (2, 10))
+        self.assertEqual(small_count, large_count)
+
+    def test_list_is_compact_and_detail_is_full(self):
+        self.add_appointments(1)
+        _, data = self.count_list_queries()
+        item = data[0]
+        self.assertNotIn('medical_history', item['healthrecord'])
+        self.assertEqual(item['doctor']['hospital_name'], 'BV 0')
+        self.assertEqual(item['doctor']['specialization_name'], 'Tim mạch')
+        self.assertEqual(item['schedule']['doctor_id'], item['doctor']['id'])
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/appointments/', {'page_size': 50})
+        self.assertTrue(all('medical_history' not in q['sql'] for q in ctx.captured_queries))
+
+        res = self.client.get(f"/appointments/{item['id']}/")
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Tiền sử', res.data['healthrecord']['medical_history'])
+
+    def test_detail_only_for_own_appointments(self):
+        self.add_appointments(1)
+        appointment = Appointment.objects.get()
+        self.client.force_authenticate(self.create_user('stranger'))
+        self.assertEqual(self.client.get(f'/appointments/{appointment.id}/').status_code, 404)
+
+
+class SparseFieldsTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+        self.patient = self.create_user('patient')
+        Review.objects.create(doctor=self.doctor.user, patient=self.patient, rating=4)
+        ratings.rebuild_stats()
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url, params)
+        self.assertEqual(res.status_code, 200)
+        return res, [q['sql'] for q in ctx.captured_queries]
+
+    def test_fields_shrink_payload_and_query(self):
+        res, sql = self.get('/doctors/', {'fields': 'id,doctor,average_rating'})
+        row = res.data['results'][0]
+        self.assertEqual(set(row), {'id', 'doctor', 'average_rating'})
+        self.assertEqual(row['average_rating'], 4.0)
+        doctor_sql = [q for q in sql if 'clinic_doctor' in q and 'COUNT' not in q][0]
+        # Không JOIN bệnh viện/chuyên khoa và không SELECT các cột không dùng
+        self.assertNotIn('clinic_hospital', doctor_sql)
+        self.assertNotIn('clinic_specialization', doctor_sql)
+        self.assertNotIn('biography', doctor_sql)
+        self.assertNotIn('"clinic_user"."email"', doctor_sql)
+
+    def test_nested_fields(self):
+        res, _ = self.get('/doctors/', {'fields': 'id,user.full_name,user.avatar'})
+        # Danh sách bác sĩ trả về ảnh cỡ vừa (clinic/media.py)
+        avatar = media.image_url(User.objects.get(pk=self.doctor.user_id).avatar, 'card')
+        self.assertEqual(res.data['results'][0]['user'], {'full_name': 'doctor', 'avatar': avatar})
+
+    def test_expand_relation(self):
+        res, sql = self.get('/doctors/', {'fields': 'id,hospital,specialization', 'expand': 'hospital,specialization'})
+        row = res.data['results'][0]
+        self.assertEqual(row['hospital']['name'], self.hospital.name)
+        self.assertEqual(row['specialization']['name'], self.specialization.name)
+        self.assertEqual(len([q for q in sql if 'clinic_hospital' in q]), 1)
+
+        self.client.force_authenticate(self.patient)
+        record = self.create_healthrecord(self.patient)
+        res, _ = self.get(f'/healthrecords/{record.id}/', {'expand': 'user', 'fields': 'id,user'})
+        self.assertEqual(res.data, {'id': record.id, 'user': UserSerializer(User.objects.get(pk=self.patient.pk)).data})
+
+    def test_without_params_response_is_unchanged(self):
+        res, _ = self.get('/doctors/', {})
+        self.assertIn('license_image', res.data['results'][0])
+        self.assertEqual(res.data['results'][0]['hospital_id'], self.hospital.id)
+
+    def test_notifications_skip_users_when_not_requested(self):
+        notification = Notification.objects.create(title='Ưu đãi', content='<p>Giảm giá</p>', send_at=timezone.now())
+        notification.users.add(self.patient)
+        # Danh sách tất cả thông báo kèm người nhận chỉ dành cho quản trị viên
+        self.client.force_authenticate(self.create_user('admin', role='admin', is_staff=True))
+        _, sql = self.get('/notifications/', {'fields': 'id,title'})
+        self.assertFalse([q for q in sql if 'clinic_notification_users' in q])
+        res, sql = self.get('/notifications/', {'fields': 'id,users', 'expand': 'users'})
+        self.assertEqual(res.data['results'][0]['users'][0]['id'], self.patient.id)
+
+    def test_appointment_list_fields(self):
+        self.client.force_authenticate(self.patient)
+        record = self.create_healthrecord(self.patient)
+        Appointment.objects.create(schedule=self.create_schedule(self.doctor), healthrecord=record, disease_type='Khac')
+        res, sql = self.get('/appointments/', {'fields': 'id,doctor,schedule.date'})
+        row = res.data['results'][0]
+        self.assertEqual(row['doctor']['hospital_name'], self.hospital.name)
+        self.assertEqual(set(row['schedule']), {'date'})
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn('clinic_healthrecord"."full_name', sql[0])
+
+
+class ScheduleTemplateTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+        self.monday = date.today() + timedelta(days=7 - date.today().weekday())
+
+    def add_template(self, doctor=None, weekday=0, start=time(8, 0), end=time(10, 0), slot_minutes=30, capacity=2):
+        return ScheduleTemplate.objects.create(doctor=(doctor or self.doctor).user, weekday=weekday,
+                                               start_time=start, end_time=end, slot_minutes=slot_minutes,
+                                               capacity=capacity)
+
+    def test_expands_weekly_slots(self):
+        template = self.add_template(end=time(10, 10))
+        self.assertEqual(len(scheduling.template_slots(template)), 4)  # phần lẻ 10 phút bị bỏ
+
+        created, skipped = scheduling.generate_schedules([template], self.monday, self.monday + timedelta(days=13))
+        self.assertEqual((created, skipped), (8, 0))
+        dates = sorted(set(Schedule.objects.values_list('date', flat=True)))
+        self.assertEqual(dates, [self.monday, self.monday + timedelta(days=7)])
+        slot = Schedule.objects.order_by('date', 'start_time').first()
+        self.assertEqual((slot.start_time, slot.end_time, slot.capacity, slot.active), (time(8, 0), time(8, 30), 2, True))
+        self.assertEqual(DoctorAvailability.objects.get(date=self.monday).free_capacity, 8)
+
+    def test_skips_overlapping_slots_and_is_idempotent(self):
+        Schedule.objects.create(doctor=self.doctor.user, date=self.monday, start_time=time(8, 15),
+                                end_time=time(8, 45))
+        templates = [self.add_template(), self.add_template(start=time(9, 30), end=time(11, 0))]
+        created, skipped = scheduling.generate_schedules(templates, self.monday, self.monday)
+        # 08:00-08:30 và 08:30-09:00 trùng lịch có sẵn, 09:30-10:00 trùng giữa 2 lịch mẫu
+        self.assertEqual((created, skipped), (4, 3))
+        self.assertEqual(scheduling.generate_schedules(templates, self.monday, self.monday), (0, 7))
+        self.assertEqual(Schedule.objects.count(), 5)
+
+    def test_counts_only_inserted_rows(self):
+        # Lịch được tạo đồng thời (sau khi đã nạp các lịch có sẵn) bị unique_together bỏ qua khi bulk_create
+        template = self.add_template()
+        empty = overlaps.IntervalIndex()
+        with patch('clinic.scheduling.IntervalIndex.for_schedules', return_value=empty):
+            Schedule.objects.create(doctor=self.doctor.user, date=self.monday, start_time=time(8, 0),
+                                    end_time=time(8, 30))
+            created, skipped = scheduling.generate_schedules([template], self.monday, self.monday)
+        self.assertEqual((created, skipped), (3, 1))
+        self.assertEqual(Schedule.objects.count(), 4)
+
+    def test_query_count_independent_of_doctor_count(self):
+        def run(doctor_count, offset):
+            doctors = [self.create_doctor(f'doctor{offset + i}') for i in range(doctor_count)]
+            templates = [self.add_template(doctor, weekday=day) for doctor in doctors for day in range(5)]
+            with CaptureQueriesContext(connection) as ctx:
+                created, _ = scheduling.generate_schedules(templates, self.monday, self.monday + timedelta(days=27))
+            self.assertEqual(created, doctor_count * 5 * 4 * 4)
+            # Số câu INSERT chỉ phụ thuộc batch size của database, các truy vấn còn lại không đổi
+            return len([q for q in ctx.captured_queries if not q['sql'].startswith('INSERT')])
+
+        self.assertEqual(run(2, 0), run(20, 100))
+
+    def test_rejects_invalid_range(self):
+        template = self.add_template()
+        with self.assertRaises(ValidationError):
+            scheduling.generate_schedules([template], self.monday, self.monday - timedelta(days=1))
+        with self.assertRaises(ValidationError):
+            scheduling.generate_schedules([template], self.monday, self.monday + timedelta(days=scheduling.MAX_DAYS))
+
+    def test_doctor_api(self):
+        other = self.create_doctor('other')
+        self.add_template(doctor=other)
+        self.client.force_authenticate(self.doctor.user)
+        res = self.client.post('/schedule-templates/', {'weekday': 2, 'start_time': '13:00', 'end_time': '15:00',
+                                                        'slot_minutes': 60, 'doctor_id': other.user_id}, format='json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['doctor_id'], self.doctor.user_id)
+        self.assertEqual(len(self.client.get('/schedule-templates/').data['results']), 1)
+
+        wednesday = self.monday + timedelta(days=2)
+        res = self.client.post('/schedule-templates/generate/', {'start_date': self.monday.isoformat(),
+                                                                 'end_date': wednesday.isoformat()}, format='json')
+        self.assertEqual(res.data, {'created': 2, 'skipped': 0})
+        self.assertFalse(Schedule.objects.filter(doctor=other.user).exists())
+
+        res = self.client.post('/schedule-templates/', {'weekday': 2, 'start_time': '15:00', 'end_time': '13:00'},
+                               format='json')
+        self.assertEqual(res.status_code, 400)
+
+
+class OverlapTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+        self.other_doctor = self.create_doctor('other_doctor')
+        self.patient = self.create_user('patient')
+        self.record = self.create_healthrecord(self.patient)
+
+    def test_interval_index(self):
+        index = overlaps.IntervalIndex()
+        # Dữ liệu cũ chồng lên nhau được gộp lại: 08:00-09:30
+        index.add('a', time(8, 0), time(9, 0))
+        index.add('a', time(8, 30), time(9, 30))
+        index.add('a', time(11, 0), time(12, 0))
+        self.assertTrue(index.overlaps('a', time(9, 15), time(9, 45)))
+        self.assertTrue(index.overlaps('a', time(7, 0), time(13, 0)))
+        self.assertTrue(index.overlaps('a', time(11, 30), time(11, 45)))
+        self.assertFalse(index.overlaps('a', time(9, 30), time(11, 0)))  # nối tiếp, không trùng
+        self.assertFalse(index.overlaps('b', time(8, 0), time(9, 0)))
+
+    def test_schedule_api_rejects_overlap(self):
+        self.create_schedule(self.doctor, start=time(8, 0), end=time(9, 0))
+        day = (date.today() + timedelta(days=3)).isoformat()
+        self.client.force_authenticate(self.doctor.user)
+
+        res = self.client.post('/schedules/', {'date': day, 'start_time': '08:30', 'end_time': '09:30'})
+        self.assertEqual(res.status_code, 400)
+        res = self.client.post('/schedules/', {'date': day, 'start_time': '09:00', 'end_time': '10:00'})
+        self.assertEqual(res.status_code, 201, res.data)
+        self.assertEqual(res.data['doctor_id'], self.doctor.user_id)
+
+        # Sửa lịch vừa tạo chồng lên lịch 08:00-09:00 cũng bị chặn, sửa trong khung giờ của chính nó thì được
+        res = self.client.patch(f'/schedules/{res.data["id"]}/', {'start_time': '08:45'})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(Schedule.objects.filter(doctor=self.doctor.user).count(), 2)
+
+        # Bác sĩ khác được tạo lịch cùng giờ
+        self.client.force_authenticate(self.other_doctor.user)
+        res = self.client.post('/schedules/', {'date': day, 'start_time': '08:30', 'end_time': '09:30'})
+        self.assertEqual(res.status_code, 201)
+
+    def test_patient_cannot_book_two_doctors_at_same_time(self):
+        first = self.create_schedule(self.doctor, start=time(8, 0), end=time(9, 0))
+        overlapping = self.create_schedule(self.other_doctor, start=time(8, 30), end=time(9, 30))
+        later = self.create_schedule(self.other_doctor, start=time(9, 30), end=time(10, 30))
+        booking.book_appointment(first, self.record, disease_type='Khac')
+
+        self.client.force_authenticate(self.patient)
+        res = self.client.post('/appointments/', {'schedule_id': overlapping.id, 'healthrecord_id': self.record.id,
+                                                  'disease_type': 'Khac'}, format='json')
+        self.assertEqual(res.status_code, 400)
+        with self.assertRaises(ValidationError):
+            booking.book_appointment(overlapping, self.record, disease_type='Khac')
+        overlapping.refresh_from_db()
+        self.assertEqual(overlapping.sum_booking, 0)
+
+        # Hồ sơ khác (người thân) vẫn đặt được cùng giờ
+        relative = self.create_healthrecord(self.patient, full_name='Người thân')
+        booking.book_appointment(overlapping, relative, disease_type='Khac')
+        booking.book_appointment(later, self.record, disease_type='Khac')
+
+    def test_reschedule_rejects_overlap(self):
+        first = self.create_schedule(self.doctor, start=time(8, 0), end=time(9, 0))
+        second = self.create_schedule(self.doctor, start=time(10, 0), end=time(11, 0))
+        overlapping = self.create_schedule(self.other_doctor, start=time(10, 30), end=time(11, 30))
+        adjacent = self.create_schedule(self.other_doctor, start=time(8, 30), end=time(9, 30))
+        appointment = booking.book_appointment(first, self.record, disease_type='Khac')
+        booking.book_appointment(second, self.record, disease_type='Khac')
+
+        with self.assertRaises(ValidationError):
+            booking.reschedule_appointment(appointment, overlapping)
+        # Trùng với chính lịch hẹn đang được đổi thì không tính
+        booking.reschedule_appointment(appointment, adjacent)
+        self.assertEqual(Appointment.objects.get(pk=appointment.pk).schedule_id, adjacent.id)
+
+
+class DailyReportTest(ClinicTestMixin, TestCase):
+    FIELDS = ('doctor_id', 'date', 'booked', 'completed', 'paid', 'cancelled', 'revenue', 'paid_amount',
+              'disease_counts')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor', consultation_fee=200000)
+        self.patients = [self.create_healthrecord(self.create_user(f'patient{i}')) for i in range(4)]
+
+    def snapshot(self):
+        return list(DoctorDailyReport.objects.order_by('doctor_id', 'date').values_list(*self.FIELDS))
+
+    def complete(self, appointment, disease_type=None):
+        Payment.objects.create(appointment=appointment, method='momo', amount=150000, status='paid')
+        appointment.status = 'completed'
+        if disease_type:
+            appointment.disease_type = disease_type
+        appointment.save()
+
+    def test_incremental_matches_rebuild(self):
+        today = self.create_schedule(self.doctor, days_ahead=0, capacity=4)
+        tomorrow = self.create_schedule(self.doctor, days_ahead=1, capacity=4)
+        appointments = [booking.book_appointment(today, record, disease_type='Khac') for record in self.patients]
+        self.complete(appointments[0], 'HoHap')
+        self.complete(appointments[1])
+        payment = Payment.objects.create(appointment=appointments[2], method='vnpay', amount=150000)
+        payment.status = 'paid'
+        payment.save()
+        appointments[2].status = 'paid'
+        appointments[2].save(update_fields=['status', 'updated_date'])
+        booking.cancel_appointment(appointments[3])
+        booking.reschedule_appointment(appointments[2], tomorrow)
+
+        row = DoctorDailyReport.objects.get(date=today.date)
+        self.assertEqual((row.booked, row.completed, row.paid, row.cancelled), (2, 2, 0, 1))
+        self.assertEqual((row.revenue, row.paid_amount), (400000, 300000))
+        self.assertEqual(row.disease_counts, {'HoHap': 1, 'Khac': 1})
+        self.assertEqual(DoctorDailyReport.objects.get(date=tomorrow.date).paid, 1)
+
+        incremental = self.snapshot()
+        DoctorDailyReport.objects.all().delete()
+        call_command('backfill_reports', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_incremental_without_conflict_support(self):
+        # Database không hỗ trợ upsert: xoá rồi thêm lại các ngày bị ảnh hưởng, kết quả vẫn như tính lại toàn bộ
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                patch.object(connection.features, 'supports_update_conflicts', False):
+            self.test_incremental_matches_rebuild()
+
+    def test_booking_on_mysql_uses_unique_constraint(self):
+        # MySQL không hỗ trợ unique_fields: cả bảng thống kê lẫn bảng lịch trống dùng ON DUPLICATE KEY UPDATE
+        schedule = self.create_schedule(self.doctor, capacity=2)
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                patch('django.db.models.query.QuerySet.bulk_create', autospec=True) as bulk_create:
+            booking.book_appointment(schedule, self.patients[0], disease_type='Khac')
+        self.assertIn(DoctorDailyReport, {call.args[0].model for call in bulk_create.call_args_list})
+        for call in bulk_create.call_args_list:
+            self.assertTrue(call.kwargs['update_conflicts'])
+            self.assertNotIn('unique_fields', call.kwargs)
+
+    def test_period_range(self):
+        self.assertEqual(reports.period_range(2025, month=2), (date(2025, 2, 1), date(2025, 2, 28)))
+        self.assertEqual(reports.period_range(2025, month=12), (date(2025, 12, 1), date(2025, 12, 31)))
+        self.assertEqual(reports.period_range(2025, quarter=4), (date(2025, 10, 1), date(2025, 12, 31)))
+        self.assertEqual(reports.period_range(2024), (date(2024, 1, 1), date(2024, 12, 31)))
+
+    def test_report_endpoints_read_rollup(self):
+        first = self.create_schedule(self.doctor, days_ahead=0, capacity=4)
+        for record, disease_type in zip(self.patients, ['HoHap', 'HoHap', 'Mat', 'Khac']):
+            self.complete(booking.book_appointment(first, record, disease_type='Khac'), disease_type)
+        other = self.create_doctor('other', consultation_fee=100000)
+        afternoon = self.create_schedule(other, days_ahead=0, start=time(14, 0), end=time(15, 0))
+        self.complete(booking.book_appointment(afternoon, self.patients[0], disease_type='Khac'))
+        day = first.date
+
+        self.client.force_authenticate(self.doctor.user)
+        with self.assertNumQueries(3):
+            res = self.client.get('/reportsdoctor/', {'month': day.month, 'year': day.year})
+        self.assertEqual(res.data['total_appointment'], 4)
+        self.assertEqual(res.data['examined_count'], 4)
+        self.assertEqual(res.data['top_disease'][0], {'disease_type': 'HoHap', 'count': 2})
+
+        admin = self.create_user('admin', role='admin', is_staff=True)
+        self.client.force_authenticate(admin)
+        with self.assertNumQueries(1):
+            res = self.client.get('/reportsadmin/', {'quarter': (day.month - 1) // 3 + 1, 'year': day.year})
+        self.assertEqual((res.data['appointment_count'], res.data['revenue']), (5, 900000))
+        res = self.client.get('/reportsadmin/', {'year': day.year - 1})
+        self.assertEqual((res.data['appointment_count'], res.data['revenue']), (0, 0))
+
+
+class TimeSeriesReportTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor', consultation_fee=200000)
+        self.other = self.create_doctor('other', hospital=self.create_hospital('BV Nhi Đồng'),
+                                        specialization=self.create_specialization('Nhi'))
+        self.admin = self.create_user('admin', role='admin', is_staff=True)
+        records = [self.create_healthrecord(self.create_user(f'patient{i}')) for i in range(3)]
+        visits = [(self.doctor, date(2030, 1, 15), 'HoHap'), (self.doctor, date(2030, 1, 20), 'HoHap'),
+                  (self.other, date(2030, 1, 20), 'Mat'), (self.doctor, date(2030, 4, 2), 'Khac')]
+        for i, (doctor, day, disease_type) in enumerate(visits):
+            schedule = Schedule.objects.create(doctor=doctor.user, date=day, start_time=time(8 + i, 0),
+                                               end_time=time(9 + i, 0), capacity=3)
+            appointment = booking.book_appointment(schedule, records[i % 3], disease_type=disease_type)
+            Payment.objects.create(appointment=appointment, method='momo', amount=150000, status='paid')
+            appointment.status = 'completed'
+            appointment.save()
+
+    def get(self, **params):
+        return self.client.get('/reports/timeseries/', params)
+
+    def test_monthly_series_in_constant_queries(self):
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(4):
+            res = self.get(start='2030-01-01', end='2030-06-30', granularity='month')
+        self.assertEqual(res.status_code, 200)
+        series = res.data['series']
+        self.assertEqual([row['period'] for row in series], [date(2030, m, 1) for m in range(1, 7)])
+        self.assertEqual((series[0]['completed'], series[0]['paid_amount']), (3, 450000))
+        self.assertEqual(series[0]['top_diseases'][0], {'disease_type': 'HoHap', 'count': 2})
+        self.assertEqual((series[1]['completed'], series[1]['top_diseases']), (0, []))
+        self.assertEqual(series[3]['completed'], 1)
+
+        hospitals = {row['name']: row['completed'] for row in res.data['hospitals']}
+        self.assertEqual(hospitals, {'BV Chợ Rẫy': 3, 'BV Nhi Đồng': 1})
+        self.assertEqual({row['name'] for row in res.data['specializations']}, {'Tim mạch', 'Nhi'})
+
+    def test_week_and_quarter_buckets(self):
+        self.client.force_authenticate(self.admin)
+        res = self.get(start='2030-01-09', end='2030-01-21', granularity='week')
+        # Mốc tuần bắt đầu từ thứ 2 (07/01/2030), 15/01 và 20/01 (Chủ nhật) cùng tuần 14/01
+        self.assertEqual([(row['period'], row['completed']) for row in res.data['series']],
+                         [(date(2030, 1, 7), 0), (date(2030, 1, 14), 3), (date(2030, 1, 21), 0)])
+        res = self.get(start='2030-01-01', end='2030-12-31', granularity='quarter',
+                       hospital_id=self.hospital.id)
+        self.assertEqual([row['completed'] for row in res.data['series']], [2, 1, 0, 0])
+
+    def test_permissions_and_validation(self):
+        self.client.force_authenticate(self.other.user)
+        res = self.get(start='2030-01-01', end='2030-12-31', granularity='quarter', doctor_id=self.doctor.user_id)
+        self.assertEqual([row['completed'] for row in res.data['series']], [1, 0, 0, 0])  # chỉ số liệu của mình
+
+        self.client.force_authenticate(self.create_user('patient'))
+        self.assertEqual(self.get().status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(len(self.get().data['series']), 12)  # mặc định 12 tháng gần nhất
+        self.assertEqual(self.get(granularity='year').status_code, 400)
+        self.assertEqual(self.get(start='2030-02-01', end='2030-01-01').status_code, 400)
+        self.assertEqual(self.get(start='2020-01-01', end='2030-01-01', granularity='day').status_code, 400)
+
+    def test_bucket_count_without_building_buckets(self):
+        ranges = [(date(2030, 1, 9), date(2030, 1, 21)), (date(2029, 11, 30), date(2031, 2, 1)),
+                  (date(2030, 3, 31), date(2030, 4, 1)), (date(2030, 1, 6), date(2030, 1, 6))]
+        for start, end in ranges:
+            for granularity in reports.GRANULARITIES:
+                self.assertEqual(reports.bucket_count(start, end, granularity),
+                                 len(reports.buckets(start, end, granularity)), (start, end, granularity))
+
+        # Khoảng rất dài bị từ chối ngay, không duyệt qua hàng triệu mốc
+        self.client.force_authenticate(self.admin)
+        with patch('clinic.reports.buckets', side_effect=AssertionError):
+            res = self.get(start='0001-01-01', end='9999-12-31', granularity='day')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(len(reports.buckets(date(9999, 12, 1), date(9999, 12, 31), 'month')), 1)
+
+    def test_admin_stats_page(self):
+        superuser = User.objects.create_superuser('root', 'root@clinic.test', 'x', role='admin')
+        self.client.force_login(superuser)
+        res = self.client.get('/admin/clinics-stats/', {'start': '2030-01-01', 'end': '2030-03-31'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.context['total_appointments'], 3)
+        self.assertEqual(res.context['chart']['labels'], ['2030-01-01', '2030-02-01', '2030-03-01'])
+
+        self.client.logout()
+        self.assertEqual(self.client.get('/admin/clinics-stats/').status_code, 302)
+
+
+class StatsSnapshotTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+        self.records = [self.create_healthrecord(self.create_user(f'patient{i}')) for i in range(3)]
+        self.schedule = self.create_schedule(self.doctor, days_ahead=0, capacity=3)
+        superuser = User.objects.create_superuser('root', 'root@clinic.test', 'x', role='admin')
+        self.client.force_login(superuser)
+
+    def visit(self, payment_status='paid'):
+        appointment = booking.book_appointment(self.schedule, self.records[Appointment.objects.count()],
+                                               disease_type='Khac')
+        Payment.objects.create(appointment=appointment, method='momo', amount=100000, status=payment_status)
+        appointment.status = 'completed'
+        appointment.save()
+
+    def stats_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get('/admin/clinics-stats/')
+        self.assertEqual(res.status_code, 200)
+        sql = ' '.join(q['sql'] for q in ctx.captured_queries)
+        return res, 'clinic_doctordailyreport' in sql
+
+    def test_served_from_snapshot_until_stale(self):
+        self.visit()
+        self.visit(payment_status='pending')
+        res, computed = self.stats_queries()
+        self.assertTrue(computed)
+        # Hoá đơn chưa thanh toán không tính vào doanh thu
+        self.assertEqual((res.context['total_appointments'], res.context['total_revenue']), (2, '100,000'))
+
+        self.visit()
+        res, computed = self.stats_queries()
+        self.assertFalse(computed)
+        self.assertEqual(res.context['total_appointments'], 2)
+
+        with override_settings(ADMIN_STATS_MAX_AGE=0):
+            res, computed = self.stats_queries()
+        self.assertTrue(computed)
+        self.assertEqual(res.context['total_appointments'], 3)
+        self.assertEqual(StatsSnapshot.objects.count(), 1)
+
+    def test_manual_refresh_records_compute_time(self):
+        self.stats_queries()
+        self.visit()
+        snapshot = StatsSnapshot.objects.get()
+        StatsSnapshot.objects.update(duration_ms=999999)
+        res = self.client.post('/admin/clinics-stats/')
+        self.assertEqual(res.status_code, 302)
+        refreshed = StatsSnapshot.objects.get()
+        self.assertGreater(refreshed.computed_at, snapshot.computed_at)
+        self.assertLess(refreshed.duration_ms, 999999)
+        self.assertEqual(refreshed.data['total_appointments'], 1)
+
+    def test_refresh_command(self):
+        self.visit()
+        old = StatsSnapshot.objects.create(start=date(2020, 1, 1), end=date(2020, 1, 31), granularity='day',
+                                           computed_at=timezone.now() - timedelta(days=30))
+        call_command('refresh_stats', stdout=open(os.devnull, 'w'))
+        snapshot = StatsSnapshot.objects.get()
+        self.assertNotEqual(snapshot.pk, old.pk)
+        self.assertEqual((snapshot.end, snapshot.data['total_appointments']), (timezone.localdate(), 1))
+
+
+@override_settings(NOTIFICATION_PUSH_BACKEND='clinic.tests.RecordingPushBackend')
+class NotificationInboxTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patients = [self.create_user(f'patient{i}') for i in range(5)]
+        self.doctor = self.create_user('doctor', role='doctor')
+        self.admin = self.create_user('admin', role='admin', is_staff=True)
+
+    def notify(self, title='Ưu đãi', users=(), **kwargs):
+        notification = Notification.objects.create(title=title, content='<p>Giảm giá</p>',
+                                                   send_at=kwargs.pop('send_at', timezone.now()), **kwargs)
+        notification.users.set(users)
+        return notification
+
+    def test_publish_fans_out_in_batches_and_is_idempotent(self):
+        promotion = self.notify()
+        with patch.object(notifications, 'BATCH_SIZE', 2):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(notifications.publish(promotion), 5)  # tất cả bệnh nhân
+        # Không có câu INSERT nào cho từng người nhận riêng lẻ: 3 lô, mỗi lô 1 câu INSERT hộp thư
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "clinic_usernotification"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(notifications.publish(promotion), 0)
+        self.assertFalse(UserNotification.objects.filter(user=self.doctor).exists())
+        self.assertEqual([notifications.unread_count(p) for p in self.patients], [1] * 5)
+
+        targeted = self.notify('Khám định kỳ', users=[self.patients[0], self.doctor])
+        notifications.publish(targeted)
+        self.assertEqual(notifications.unread_count(self.patients[0]), 2)
+        self.assertEqual(notifications.unread_count(self.patients[1]), 1)
+        self.assertEqual(notifications.unread_count(self.doctor), 1)
+        promotion.refresh_from_db()
+        self.assertIsNotNone(promotion.published_at)
+
+    def test_inbox_endpoints(self):
+        for i in range(3):
+            notifications.publish(self.notify(f'Thông báo {i}'))
+        hidden = self.notify('Chỉ cho bác sĩ', users=[self.doctor])
+        notifications.publish(hidden)
+        patient = self.patients[0]
+        self.client.force_authenticate(patient)
+
+        self.assertEqual(self.client.get('/notifications/unread-count/').data, {'count': 3})
+        with self.assertNumQueries(1):
+            res = self.client.get('/notifications/inbox/', {'page_size': 2})
+        self.assertEqual([item['title'] for item in res.data['results']], ['Thông báo 2', 'Thông báo 1'])
+        res = self.client.get(res.data['next'])
+        self.assertEqual([item['title'] for item in res.data['results']], ['Thông báo 0'])
+
+        first = res.data['results'][0]['id']
+        self.assertEqual(self.client.post(f'/notifications/{first}/read/').data, {'count': 2})
+        self.assertEqual(self.client.post(f'/notifications/{first}/read/').data, {'count': 2})
+        self.assertEqual(self.client.post(f'/notifications/{hidden.id}/read/').status_code, 404)
+        self.assertEqual(self.client.post('/notifications/mark-all-read/').data, {'updated': 2, 'count': 0})
+        self.assertEqual(self.client.get('/notifications/unread-count/').data, {'count': 0})
+        self.assertEqual(notifications.unread_count(self.patients[1]), 3)
+
+        # Bệnh nhân chỉ thấy thông báo gửi cho mình và không được tạo thông báo
+        ids = [item['id'] for item in self.client.get('/notifications/').data['results']]
+        self.assertNotIn(hidden.id, ids)
+        self.assertEqual(len(ids), 3)
+        res = self.client.post('/notifications/', {'title': 'x', 'content': 'x', 'send_at': timezone.now()})
+        self.assertEqual(res.status_code, 403)
+
+    def test_admin_create_is_published_by_dispatcher(self):
+        self.client.force_authenticate(self.admin)
+        res = self.client.post('/notifications/', {'title': 'Ưu đãi', 'content': '<p>Giảm 20%</p>', 'type': 'uu_dai',
+                                                   'send_at': timezone.now().isoformat()}, format='json')
+        self.assertEqual(res.status_code, 201)
+        later = (timezone.now() + timedelta(days=1)).isoformat()
+        scheduled = self.client.post('/notifications/', {'title': 'Hẹn giờ', 'content': '<p>Sau</p>', 'send_at': later},
+                                     format='json')
+        self.assertFalse(UserNotification.objects.exists())
+
+        self.assertEqual(notifications.dispatch_due(), (1, 5))
+        self.assertEqual(UserNotification.objects.filter(notification_id=res.data['id']).count(), 5)
+        self.assertFalse(UserNotification.objects.filter(notification_id=scheduled.data['id']).exists())
+
+
+class RecordingPushBackend:
+    """
+    Backend push thay thế trong test: ghi lại các lần gửi, user nằm trong failing bị tính là gửi lỗi
+    """
+    sent = []
+    failing = set()
+
+    def send(self, user_ids, payload):
+        self.sent.append((list(user_ids), payload))
+        return len(self.failing.intersection(user_ids))
+
+
+@override_settings(NOTIFICATION_PUSH_BACKEND='clinic.tests.RecordingPushBackend',
+                   NOTIFICATION_CHANNELS=['inbox', 'email', 'push'])
+class NotificationDispatchTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.patients = [self.create_user(f'patient{i}') for i in range(5)]
+        self.patients[4].email = ''
+        self.patients[4].save()
+        RecordingPushBackend.sent = []
+        RecordingPushBackend.failing = {self.patients[3].id}
+
+    def notify(self, title='Khám sức khoẻ định kỳ', send_at=None, **kwargs):
+        return Notification.objects.create(title=title, content='<p>Đã tới lịch <b>khám định kỳ</b></p>',
+                                           type=Notification.NotifyType.KHAM_SK,
+                                           send_at=send_at or timezone.now(), **kwargs)
+
+    def test_dispatches_due_notifications_to_all_channels(self):
+        due = self.notify()
+        future = self.notify('Nhắc lịch tuần sau', send_at=timezone.now() + timedelta(days=7))
+
+        with patch.object(notifications, 'BATCH_SIZE', 2):
+            self.assertEqual(notifications.dispatch_due(), (1, 5))
+        due.refresh_from_db()
+        self.assertIsNotNone(due.published_at)
+        self.assertEqual((due.delivered_count, due.emailed_count, due.pushed_count, due.failed_count),
+                         (5, 4, 4, 1))
+        self.assertIsNotNone(due.dispatch_ms)
+
+        # Gửi theo từng lô 2 người
+        self.assertEqual([len(user_ids) for user_ids, _ in RecordingPushBackend.sent], [2, 2, 1])
+        payload = RecordingPushBackend.sent[0][1]
+        self.assertEqual((payload['id'], payload['type'], payload['is_read']), (due.id, 'kham_sk', False))
+        email = EmailOutbox.objects.first()
+        self.assertEqual((email.subject, email.body), (due.title, 'Đã tới lịch khám định kỳ'))
+        self.assertEqual(EmailOutbox.objects.count(), 4)
+
+        # Thông báo đã gửi không bị gửi lại, thông báo hẹn giờ chưa tới send_at chưa được gửi
+        self.assertEqual(notifications.dispatch_due(), (0, 0))
+        self.assertFalse(future.deliveries.exists())
+        Notification.objects.filter(pk=future.pk).update(send_at=timezone.now())
+        self.assertEqual(notifications.dispatch_due(), (1, 5))
+
+    def test_claimed_notifications_are_skipped_until_stale(self):
+        first, second = self.notify('Lần 1'), self.notify('Lần 2')
+        self.assertEqual(notifications.claim_due(limit=1), [first])
+        # Worker khác chỉ nhận được thông báo chưa ai nhận
+        self.assertEqual(notifications.claim_due(), [second])
+        self.assertEqual(notifications.claim_due(), [])
+
+        # Worker nhận thông báo đầu bị dừng giữa chừng: sau NOTIFICATION_CLAIM_TIMEOUT được nhận lại và gửi tiếp
+        notifications._deliver(first, [self.patients[0].id])
+        later = timezone.now() + timedelta(minutes=11)
+        self.assertEqual(notifications.claim_due(now=later), [first, second])
+        notifications.publish(first)
+        self.assertEqual(first.deliveries.count(), 5)
+        self.assertEqual(notifications.unread_count(self.patients[0]), 1)
+        self.assertEqual([len(user_ids) for user_ids, _ in RecordingPushBackend.sent], [4])
+
+    def test_channels_can_be_disabled(self):
+        with self.settings(NOTIFICATION_CHANNELS=['inbox']):
+            call_command('dispatch_notifications', stdout=open(os.devnull, 'w'))
+        self.assertEqual(UserNotification.objects.count(), 0)
+        self.notify()
+        with self.settings(NOTIFICATION_CHANNELS=['inbox']):
+            call_command('dispatch_notifications', stdout=open(os.devnull, 'w'))
+        self.assertEqual(UserNotification.objects.count(), 5)
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assertEqual(RecordingPushBackend.sent, [])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+                   NOTIFICATION_CHANNELS=['inbox', 'push'])
+class NotificationWebSocketTest(ClinicTestMixin, TransactionTestCase):
+    application = OAuth2TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    async def test_published_notification_pushed_to_recipient(self):
+        patient = await sync_to_async(self.create_user)('patient')
+        other = await sync_to_async(self.create_user)('other')
+        token = await sync_to_async(AccessToken.objects.create)(user=patient, token='token-patient',
+                                                                expires=timezone.now() + timedelta(hours=1))
+        communicator = WebsocketCommunicator(self.application, f'/ws/notifications/?token={token.token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        notification = await sync_to_async(Notification.objects.create)(title='Ưu đãi', content='<p>x</p>',
+                                                                         send_at=timezone.now())
+        await sync_to_async(notification.users.set)([patient, other])
+        await sync_to_async(notifications.dispatch_due)()
+
+        data = await communicator.receive_json_from(timeout=2)
+        self.assertEqual((data['id'], data['title']), (notification.id, 'Ưu đãi'))
+        await communicator.disconnect()
+
+        connected, _ = await WebsocketCommunicator(self.application, '/ws/notifications/?token=invalid').connect()
+        self.assertFalse(connected)
+
+
+class AppointmentExpiryTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+        self.records = [self.create_healthrecord(self.create_user(f'patient{i}')) for i in range(4)]
+        self.morning = self.create_schedule(self.doctor, capacity=3)
+        self.afternoon = self.create_schedule(self.doctor, start=time(14, 0), end=time(15, 0), capacity=2)
+
+    def book(self, schedule, record, minutes_ago):
+        appointment = booking.book_appointment(schedule, record, disease_type='Khac')
+        Appointment.objects.filter(pk=appointment.pk).update(
+            created_date=timezone.now() - timedelta(minutes=minutes_ago))
+        return appointment
+
+    def test_expires_unpaid_appointments_and_releases_seats(self):
+        expired = [self.book(self.morning, self.records[0], 45), self.book(self.morning, self.records[1], 31),
+                   self.book(self.afternoon, self.records[2], 60)]
+        recent = self.book(self.morning, self.records[3], 5)
+        paid = self.book(self.afternoon, self.records[3], 90)
+        Appointment.objects.filter(pk=paid.pk).update(status='paid')
+        pending = Payment.objects.create(appointment=expired[0], method='vnpay', amount=200000)
+        settled = Payment.objects.create(appointment=paid, method='vnpay', amount=200000, status='paid')
+        self.assertEqual(DoctorDailyReport.objects.get().booked, 5)
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = booking.expire_unpaid_appointments()
+        self.assertEqual(result, {'expired': 3, 'payments_failed': 1, 'schedules': 2, 'seats': 3})
+        # Lịch sáng trả 2 chỗ, lịch chiều trả 1 chỗ: mỗi lịch một câu UPDATE sum_booking
+        counter_updates = [q for q in ctx.captured_queries
+                           if q['sql'].startswith('UPDATE "clinic_schedule" SET "sum_booking"')]
+        self.assertEqual(len(counter_updates), 2)
+
+        for appointment in expired:
+            appointment.refresh_from_db()
+            self.assertEqual((appointment.status, appointment.cancel, appointment.active_booking),
+                             ('cancelled', True, None))
+        recent.refresh_from_db()
+        self.assertEqual(recent.status, 'unpaid')
+        pending.refresh_from_db()
+        settled.refresh_from_db()
+        self.assertEqual((pending.status, settled.status), ('failed', 'paid'))
+
+        self.morning.refresh_from_db()
+        self.afternoon.refresh_from_db()
+        self.assertEqual((self.morning.sum_booking, self.morning.active), (1, True))
+        self.assertEqual((self.afternoon.sum_booking, self.afternoon.active), (1, True))
+        report = DoctorDailyReport.objects.get()
+        self.assertEqual((report.booked, report.cancelled), (2, 3))
+
+        # Chạy lại không huỷ thêm, hồ sơ bị huỷ lịch có thể đặt lại
+        self.assertEqual(booking.expire_unpaid_appointments()['expired'], 0)
+        booking.book_appointment(self.morning, self.records[0], disease_type='Khac')
+
+    def test_command_works_in_batches(self):
+        for record in self.records[:3]:
+            self.book(self.morning, record, 40)
+        stdout = StringIO()
+        with self.settings(APPOINTMENT_EXPIRY_BATCH_SIZE=2):
+            call_command('expire_appointments', stdout=stdout)
+            self.assertEqual(Appointment.objects.filter(status='unpaid').count(), 1)
+            call_command('expire_appointments', stdout=stdout)
+        self.assertIn('trả lại 2 chỗ', stdout.getvalue())
+        self.assertIn('trả lại 1 chỗ', stdout.getvalue())
+        self.morning.refresh_from_db()
+        self.assertEqual(self.morning.sum_booking, 0)
+
+
+@override_settings(VNPAY_TMN_CODE='CLINIC', VNPAY_HASH_SECRET_KEY='secret', VNPAY_PAYMENT_URL='https://vnpay.test/pay',
+                   VNPAY_RETURN_URL='https://clinic.test/api/vnpay_return/')
+class PaymentAfterExpiryTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        self.doctor = self.create_doctor('doctor')
+        self.schedule = self.create_schedule(self.doctor, capacity=1)
+        record = self.create_healthrecord(self.create_user('patient'))
+        self.appointment = booking.book_appointment(self.schedule, record, disease_type='Khac')
+
+    def start_payment(self):
+        res = self.client.post('/create-payment-url/', {'appointment_id': self.appointment.id}, format='json')
+        self.assertEqual(res.status_code, 200)
+        return Payment.objects.get(pk=res.json()['payment_id'])
+
+    def expire(self):
+        Appointment.objects.filter(pk=self.appointment.pk).update(created_date=timezone.now() - timedelta(hours=1))
+        self.assertEqual(booking.expire_unpaid_appointments()['expired'], 1)
+
+    def vnpay_return(self, payment, code='00'):
+        params = {'vnp_TxnRef': str(payment.id), 'vnp_ResponseCode': code, 'vnp_TransactionNo': '14000001'}
+        query = urllib.parse.urlencode(sorted(params.items())).encode('utf-8')
+        params['vnp_SecureHash'] = hmac.new(b'secret', query, hashlib.sha512).hexdigest()
+        return self.client.get('/api/vnpay_return/', params)
+
+    def test_success_marks_appointment_paid(self):
+        payment = self.start_payment()
+        res = self.vnpay_return(payment)
+        self.assertEqual(res.status_code, 200)
+        payment.refresh_from_db()
+        self.appointment.refresh_from_db()
+        self.assertEqual((payment.status, payment.transaction_id), ('paid', '14000001'))
+        self.assertEqual((self.appointment.status, self.appointment.active_booking), ('paid', True))
+
+        # Đã thanh toán thì không bị huỷ do quá hạn, VNPay gọi lại cũng không ghi nhận lần nữa
+        Appointment.objects.filter(pk=self.appointment.pk).update(created_date=timezone.now() - timedelta(hours=1))
+        self.assertEqual(booking.expire_unpaid_appointments()['expired'], 0)
+        self.assertEqual(self.vnpay_return(payment).status_code, 400)
+        self.assertEqual(EmailOutbox.objects.filter(subject='Xác nhận thanh toán thành công').count(), 1)
+
+    def test_late_success_after_expiry_is_flagged_for_refund(self):
+        payment = self.start_payment()
+        self.expire()
+        # Chỗ đã được trả lại và có bệnh nhân khác đặt
+        other = booking.book_appointment(self.schedule, self.create_healthrecord(self.create_user('other')),
+                                         disease_type='Khac')
+
+        res = self.vnpay_return(payment)
+        self.assertEqual(res.status_code, 409)
+        payment.refresh_from_db()
+        self.appointment.refresh_from_db()
+        self.schedule.refresh_from_db()
+        self.assertEqual((payment.status, payment.transaction_id), ('refund', '14000001'))
+        self.assertEqual((self.appointment.status, self.appointment.cancel, self.appointment.active_booking),
+                         ('cancelled', True, None))
+        self.assertEqual(self.schedule.sum_booking, 1)
+        self.assertEqual(Appointment.objects.filter(schedule=self.schedule, active_booking=True).get(), other)
+        self.assertFalse(EmailOutbox.objects.filter(subject='Xác nhận thanh toán thành công').exists())
+
+    def test_failure_does_not_overwrite_paid_payment(self):
+        payment = self.start_payment()
+        self.assertEqual(self.vnpay_return(payment, code='24').status_code, 400)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'failed')
+
+        # Thanh toán lại dùng lại hoá đơn cũ
+        self.assertEqual(self.start_payment().pk, payment.pk)
+        self.vnpay_return(payment)
+        self.vnpay_return(payment, code='24')
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'paid')
+
+    def test_rejects_payment_for_expired_appointment(self):
+        payment = self.start_payment()
+        self.expire()
+        res = self.client.post('/create-payment-url/', {'appointment_id': self.appointment.id}, format='json')
+        self.assertEqual(res.status_code, 400)
+
+        self.client.force_authenticate(self.create_user('admin', is_staff=True))
+        res = self.client.post(f'/payments/{payment.id}/process/', {'transaction_id': 'momo-1'}, format='json')
+        self.assertEqual(res.status_code, 400)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'failed')
+
+
+class MediaURLTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        media.image_url.cache_clear()
+        cache.clear()
+
+    def test_variants_and_memoization(self):
+        logo = Hospital.objects.get().logo
+        self.assertEqual(media.image_url(logo), logo.url)
+        self.assertEqual(media.image_url(logo, 'unknown'), logo.url)
+        self.assertIn('/c_fill,f_auto,h_150,q_auto,w_150/', media.image_url(logo, 'thumbnail'))
+        self.assertIn('/c_limit,f_auto,q_auto,w_480/', media.image_url(logo, 'card'))
+        self.assertIsNone(media.image_url(None))
+
+        before = media.image_url.cache_info()
+        media.image_url(Hospital.objects.get().logo, 'thumbnail')
+        self.assertEqual(media.image_url.cache_info().hits, before.hits + 1)
+
+        # Ảnh tải lại có version mới nên không dùng lại URL cũ
+        Hospital.objects.update(logo='image/upload/v2/logo.jpg')
+        self.assertIn('/v2/logo.jpg', media.image_url(Hospital.objects.get().logo, 'thumbnail'))
+
+    def test_list_builds_each_url_once(self):
+        for i in range(10):
+            self.create_doctor(f'doctor{i}')
+        with patch('clinic.media.cloudinary_url', wraps=media.cloudinary_url) as build:
+            res = self.client.get('/doctors/')
+            self.assertEqual(len(res.data['results']), 10)
+            # Tất cả bác sĩ dùng chung một ảnh đại diện: chỉ dựng URL một lần
+            self.assertEqual(build.call_count, 1)
+            cache.clear()
+            self.client.get('/doctors/')
+            self.assertEqual(build.call_count, 1)
+        self.assertIn('w_480', res.data['results'][0]['avatar'])
+
+    def test_variant_chosen_per_endpoint(self):
+        res = self.client.get('/hospitals/')
+        self.assertIn('w_150', res.data['results'][0]['logo'])
+        res = self.client.get(f'/hospitals/{self.hospital.id}/')
+        self.assertIn('w_480', res.data['logo'])
+        res = self.client.get(f'/hospitals/{self.hospital.id}/', {'image': 'full'})
+        self.assertEqual(res.data['logo'], Hospital.objects.get().logo.url)
+
+        doctor = self.create_doctor('doctor')
+        Review.objects.create(rating=5, patient=self.create_user('patient'), doctor=doctor.user)
+        res = self.client.get('/reviews/', {'doctor': doctor.user_id})
+        self.assertIn('w_150', res.data['results'][0]['avatar_patient'])
+
+
+class LocalStorageBackend:
+    """
+    Backend lưu trữ thay thế Cloudinary trong test: chép file vào thư mục tạm,
+    failures là số lần gọi đầu tiên bị lỗi, active/peak đếm số lần tải lên chạy song song
+    """
+    root = None
+    failures = 0
+    delay = 0
+    calls = active = peak = 0
+    lock = threading.Lock()
+
+    def upload(self, path, options):
+        cls = LocalStorageBackend
+        with cls.lock:
+            cls.calls += 1
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+            fail = cls.calls <= cls.failures
+        try:
+            threading.Event().wait(cls.delay)
+            if fail:
+                raise ConnectionError('Cloudinary không phản hồi')
+            name = os.path.basename(path)
+            shutil.copy(path, os.path.join(cls.root, name))
+            return f"{options['resource_type']}/{options['type']}/v1/{name}"
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+class MediaStagingMixin:
+    """
+    Thư mục lưu tạm và backend lưu trữ cục bộ cho các test tải ảnh
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        staging, storage = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, storage, ignore_errors=True)
+        settings = override_settings(MEDIA_STAGING_ROOT=staging, MEDIA_UPLOAD_BACKEND='clinic.tests.LocalStorageBackend',
+                                     MEDIA_UPLOAD_CONCURRENCY=2, MEDIA_UPLOAD_MAX_ATTEMPTS=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        LocalStorageBackend.root = storage
+        LocalStorageBackend.failures = LocalStorageBackend.delay = 0
+        LocalStorageBackend.calls = LocalStorageBackend.active = LocalStorageBackend.peak = 0
+
+    def stored_path(self, value):
+        return os.path.join(LocalStorageBackend.root, os.path.basename(str(value.get_prep_value())))
+
+
+class MediaUploadTest(MediaStagingMixin, ClinicTestMixin, TestCase):
+    def image(self, name='photo.JPG', content=b'\xff\xd8 fake jpeg ' * 50):
+        return SimpleUploadedFile(name, content, content_type='image/jpeg')
+
+    def test_register_acknowledged_before_upload(self):
+        content = b'\xff\xd8 avatar ' * 100
+        res = self.client.post('/users/', {'username': 'new', 'password': '123', 'full_name': 'Người mới',
+                                           'email': 'new@clinic.test', 'number_phone': '0900000001',
+                                           'role': 'patient', 'avatar': self.image(content=content)},
+                               format='multipart')
+        self.assertEqual(res.status_code, 201, res.data)
+        self.assertIsNone(res.data['avatar'])
+        self.assertEqual(LocalStorageBackend.calls, 0)
+        upload = MediaUpload.objects.get()
+        self.assertEqual((upload.model, upload.field, upload.status), ('clinic.user', 'avatar', 'pending'))
+        self.assertTrue(upload.path.endswith('.jpg'))
+
+        self.assertEqual(uploads.process_uploads(), (1, 0))
+        user = User.objects.get(username='new')
+        self.assertEqual(str(user.avatar), os.path.basename(upload.path).split('.')[0])
+        self.assertIn(f'/image/upload/v1/{os.path.basename(upload.path)}', user.avatar.url)
+        with open(os.path.join(LocalStorageBackend.root, os.path.basename(upload.path)), 'rb') as stored:
+            self.assertEqual(stored.read(), content)
+        self.assertFalse(os.path.exists(upload.path))
+        self.assertEqual(MediaUpload.objects.get().status, MediaUpload.Status.UPLOADED)
+
+    def test_license_and_test_result_uploads(self):
+        self.hospital = self.create_hospital()
+        self.specialization = self.create_specialization()
+        doctor = self.create_doctor('doctor', is_verified=True)
+        self.client.force_authenticate(doctor.user)
+        res = self.client.post('/doctor/upload-license/', {'license_number': 'GP-01', 'license_image': self.image()},
+                               format='multipart')
+        self.assertEqual(res.status_code, 200)
+        doctor.refresh_from_db()
+        self.assertEqual((doctor.license_number, doctor.is_verified, bool(doctor.license_image)), ('GP-01', False, False))
+
+        record = self.create_healthrecord(self.create_user('patient'))
+        res = self.client.post('/testresults/', {'test_name': 'X-quang', 'health_record': record.id,
+                                                 'image': self.image('xray.png')}, format='multipart')
+        self.assertEqual(res.status_code, 201, res.data)
+
+        self.assertEqual(uploads.process_uploads(), (2, 0))
+        doctor.refresh_from_db()
+        self.assertTrue(doctor.license_image.public_id)
+        self.assertTrue(TestResult.objects.get().image.public_id)
+
+    def test_retries_then_gives_up(self):
+        user = self.create_user('patient')
+        uploads.stage(user, 'avatar', self.image())
+        LocalStorageBackend.failures = 1
+        with self.assertLogs('clinic.uploads', 'WARNING'):
+            self.assertEqual(uploads.process_uploads(), (0, 1))
+        upload = MediaUpload.objects.get()
+        self.assertEqual((upload.status, upload.attempts), (MediaUpload.Status.PENDING, 1))
+        self.assertIn('không phản hồi', upload.last_error)
+        # Chưa tới lần thử lại tiếp theo
+        self.assertEqual(uploads.process_uploads(), (0, 0))
+
+        MediaUpload.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(uploads.process_uploads(), (1, 0))
+        user.refresh_from_db()
+        self.assertEqual(user.avatar.version, '1')
+
+        uploads.stage(user, 'avatar', self.image())
+        LocalStorageBackend.failures = LocalStorageBackend.calls + 2
+        with self.assertLogs('clinic.uploads', 'WARNING'):
+            uploads.process_uploads()
+            MediaUpload.objects.update(next_attempt_at=timezone.now())
+            uploads.process_uploads()
+        self.assertEqual(MediaUpload.objects.latest('id').status, MediaUpload.Status.DEAD)
+
+    def test_concurrency_limit_and_latest_file_wins(self):
+        users = [self.create_user(f'patient{i}') for i in range(4)]
+        for user in users:
+            uploads.stage(user, 'avatar', self.image())
+        latest = uploads.stage(users[0], 'avatar', self.image('new.png'))
+        LocalStorageBackend.delay = 0.05
+        self.assertEqual(uploads.process_uploads(), (5, 0))
+        self.assertEqual(LocalStorageBackend.peak, 2)
+        users[0].refresh_from_db()
+        self.assertEqual(users[0].avatar.format, 'png')
+        self.assertEqual(str(users[0].avatar), os.path.splitext(os.path.basename(latest.path))[0])
+
+
+@unittest.skipUnless(imaging.available(), 'Chưa cài Pillow')
+class ImageCompressionTest(MediaStagingMixin, ClinicTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.record = self.create_healthrecord(self.create_user('patient'))
+
+    def camera_photo(self, size=(2400, 1200)):
+        from PIL import Image
+
+        image = Image.effect_noise(size, 60).convert('RGB')
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: ảnh chụp dọc, cần xoay 90 độ
+        exif[0x010F] = 'Camera'  # Make
+        path = os.path.join(tempfile.mkdtemp(), 'photo.jpg')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), ignore_errors=True)
+        image.save(path, 'JPEG', quality=95, exif=exif)
+        with open(path, 'rb') as f:
+            return SimpleUploadedFile('IMG_0001.JPG', f.read(), content_type='image/jpeg')
+
+    def test_compresses_and_generates_thumbnail(self):
+        from PIL import Image
+
+        result = TestResult.objects.create(test_name='X-quang', health_record=self.record)
+        original = uploads.stage(result, 'image', self.camera_photo())
+        with self.settings(MEDIA_IMAGE_MAX_SIZE=1000, MEDIA_THUMBNAIL_SIZE=200):
+            self.assertEqual(uploads.process_uploads(), (2, 0))
+
+        result.refresh_from_db()
+        with Image.open(self.stored_path(result.image)) as stored:
+            # Đã xoay theo EXIF (ảnh dọc), thu nhỏ và bỏ metadata
+            self.assertEqual(stored.size, (500, 1000))
+            self.assertEqual((stored.format, len(stored.getexif())), ('JPEG', 0))
+        with Image.open(self.stored_path(result.thumbnail)) as thumbnail:
+            self.assertEqual(thumbnail.size, (100, 200))
+
+        original.refresh_from_db()
+        self.assertLess(original.stored_bytes, original.original_bytes // 4)
+        self.assertFalse(os.listdir(os.path.dirname(original.path)))  # đã xoá các file tạm
+        stats = uploads.compression_stats()
+        self.assertEqual(stats['files'], 1)
+        self.assertEqual(stats['saved_bytes'], original.original_bytes - original.stored_bytes)
+
+        res = self.client.get(f'/testresults/{result.id}/')
+        self.assertIn(os.path.basename(str(result.thumbnail.get_prep_value())), res.data['thumbnail'])
+
+    def test_only_configured_image_fields_are_compressed(self):
+        result = TestResult.objects.create(test_name='Xét nghiệm máu', health_record=self.record)
+        pdf = SimpleUploadedFile('ket-qua.pdf', b'%PDF-1.4 not an image', content_type='application/pdf')
+        uploads.stage(result, 'image', pdf)
+        uploads.stage(self.record.user, 'avatar', self.camera_photo((300, 200)))
+        stdout = StringIO()
+        call_command('process_uploads', stdout=stdout)
+        self.assertIn('Đã tải lên 2 file', stdout.getvalue())
+
+        # File không đọc được như ảnh thì tải lên nguyên bản, ảnh đại diện không nằm trong MEDIA_COMPRESS_FIELDS
+        pdf_upload = MediaUpload.objects.get(field='image')
+        self.assertEqual(pdf_upload.original_bytes, pdf_upload.stored_bytes)
+        self.assertIsNone(MediaUpload.objects.get(field='avatar').original_bytes)
+        self.assertFalse(MediaUpload.objects.filter(field='thumbnail').exists())
+        result.refresh_from_db()
+        self.assertEqual(result.image.format, 'pdf')
+        self.assertIn('tiết kiệm 0 bytes', stdout.getvalue())
+
+
+class LeaseCheckingStorageBackend(LocalStorageBackend):
+    # Ghi lại trạng thái transaction và số file còn đến hạn (worker khác có thể lấy) ngay lúc tải lên
+    checks = []
+
+    def upload(self, path, options):
+        due = MediaUpload.objects.filter(status=MediaUpload.Status.PENDING, next_attempt_at__lte=timezone.now())
+        LeaseCheckingStorageBackend.checks.append((connection.in_atomic_block, due.count()))
+        return super().upload(path, options)
+
+
+class MediaUploadLeaseTest(MediaStagingMixin, ClinicTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        LeaseCheckingStorageBackend.checks = []
+        settings = override_settings(MEDIA_UPLOAD_BACKEND='clinic.tests.LeaseCheckingStorageBackend',
+                                     MEDIA_UPLOAD_CONCURRENCY=1)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.record = self.create_healthrecord(self.create_user('patient'))
+
+    def photo(self):
+        from PIL import Image
+
+        path = os.path.join(tempfile.mkdtemp(), 'photo.jpg')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), ignore_errors=True)
+        Image.new('RGB', (400, 300), 'white').save(path, 'JPEG')
+        with open(path, 'rb') as f:
+            return SimpleUploadedFile('IMG_0001.JPG', f.read(), content_type='image/jpeg')
+
+    def test_uploads_outside_transaction_on_leased_rows(self):
+        result = TestResult.objects.create(test_name='X-quang', health_record=self.record)
+        uploads.stage(result, 'image', self.photo())
+        # Ảnh gốc và ảnh thu nhỏ đều được tải lên khi không giữ transaction và không còn dòng nào đến hạn
+        self.assertEqual(uploads.process_uploads(), (2, 0))
+        self.assertEqual(LeaseCheckingStorageBackend.checks, [(False, 0), (False, 0)])
+        self.assertEqual(MediaUpload.objects.filter(status=MediaUpload.Status.UPLOADED).count(), 2)
+
+    def test_expired_lease_is_picked_up_again(self):
+        result = TestResult.objects.create(test_name='X-quang', health_record=self.record)
+        uploads.stage(result, 'image', self.photo())
+        MediaUpload.objects.update(next_attempt_at=timezone.now() + timedelta(seconds=600))
+        self.assertEqual(uploads.process_uploads(), (0, 0))
+        MediaUpload.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(uploads.process_uploads(), (2, 0))
+
+
+class SearchTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.hospital = self.create_hospital('Bệnh viện Chợ Rẫy')
+        self.specialization = self.create_specialization('Tim mạch')
+        self.an = self.create_doctor('an', hospital=self.hospital)
+        self.an.user.full_name = 'Nguyễn Văn An'
+        self.an.user.save()
+        self.anh = self.create_doctor('anh')
+        self.anh.user.full_name = 'Nguyễn Văn Anh'
+        self.anh.user.save()
+        self.duc = self.create_doctor('duc')
+        self.duc.user.full_name = 'Trần Đức'
+        self.duc.user.save()
+
+    def names(self, res):
+        self.assertEqual(res.status_code, 200)
+        return [row['name'] for row in res.data['results']]
+
+    def test_normalize(self):
+        self.assertEqual(search.normalize('Nguyễn Văn Đức'), 'nguyen van duc')
+        self.assertEqual(search.normalize('  BV. Chợ-Rẫy (HCM) '), 'bv cho ray hcm')
+        self.assertEqual(search.normalize(None), '')
+
+    def test_one_typo(self):
+        self.assertTrue(search.one_typo('nguyen', 'nguyn'))
+        self.assertTrue(search.one_typo('nguyen', 'ngyuen'))
+        self.assertTrue(search.one_typo('nguyen', 'nguyan'))
+        self.assertTrue(search.one_typo('nguyen', 'nguyeen'))
+        self.assertFalse(search.one_typo('nguyen', 'nguyen'))
+        self.assertFalse(search.one_typo('nguyen', 'ngyune'))
+
+    def test_index_follows_saves(self):
+        entry = SearchEntry.objects.get(kind='doctor', object_id=self.an.id)
+        self.assertEqual(entry.normalized, 'nguyen van an')
+        self.assertEqual(SearchTerm.objects.get(word='nguyen').entries, 2)
+        self.assertTrue(SearchEntry.objects.filter(kind='hospital', normalized='benh vien cho ray').exists())
+
+        self.an.user.full_name = 'Lê Văn An'
+        self.an.user.save(update_fields=['full_name'])
+        self.assertEqual(set(SearchWord.objects.filter(kind='doctor', object_id=self.an.id)
+                             .values_list('word', flat=True)), {'le', 'van', 'an'})
+        self.assertEqual(SearchTerm.objects.get(word='nguyen').entries, 1)
+
+        # Ngừng hoạt động hoặc bị xoá thì ra khỏi chỉ mục, từ không còn mục nào cũng bị xoá khỏi từ điển
+        self.duc.active = False
+        self.duc.save()
+        self.assertFalse(SearchEntry.objects.filter(kind='doctor', object_id=self.duc.id).exists())
+        self.assertFalse(SearchTerm.objects.filter(word='tran').exists())
+        self.an.delete()
+        self.assertFalse(SearchWord.objects.filter(kind='doctor', object_id=self.an.id).exists())
+        self.assertFalse(SearchTerm.objects.filter(word='le').exists())
+
+        # Lưu lại không đổi tên thì không ghi gì vào chỉ mục
+        with CaptureQueriesContext(connection) as queries:
+            self.anh.save()
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'clinic_search' in query['sql'] and not query['sql'].startswith('SELECT')])
+
+    def test_doctor_filter_ignores_diacritics_and_typos(self):
+        # Từ cuối được hiểu là đang gõ dở nên 'an' khớp cả 'Anh' (giống tìm chuỗi con trước đây)
+        for name, expected in [('nguyen van an', ['Nguyễn Văn An', 'Nguyễn Văn Anh']),
+                               ('nguyen van anh', ['Nguyễn Văn Anh']),
+                               ('Nguyễn Văn', ['Nguyễn Văn An', 'Nguyễn Văn Anh']),
+                               ('ngyuen van a', ['Nguyễn Văn An', 'Nguyễn Văn Anh']),
+                               ('tran duc', ['Trần Đức']),
+                               ('dương', [])]:
+            res = self.client.get('/doctors/', {'name': name})
+            self.assertEqual(sorted(row['user']['full_name'] for row in res.data['results']), expected, name)
+
+    def test_specialization_and_hospital_filters(self):
+        self.create_specialization('Nhi khoa')
+        res = self.client.get('/specializations/', {'name': 'tim mach'})
+        self.assertEqual([row['name'] for row in res.data['results']], ['Tim mạch'])
+        res = self.client.get('/hospitals/', {'name': 'cho ray'})
+        self.assertEqual([row['name'] for row in res.data['results']], ['Bệnh viện Chợ Rẫy'])
+
+    def test_ranked_search_across_kinds(self):
+        self.create_hospital('Bệnh viện An Bình')
+        res = self.client.get('/search/', {'q': 'nguyen van an'})
+        # Trùng khớp xếp trước tên đang gõ dở
+        self.assertEqual(self.names(res), ['Nguyễn Văn An', 'Nguyễn Văn Anh'])
+
+        res = self.client.get('/search/', {'q': 'an'})
+        self.assertEqual(self.names(res)[0], 'Bệnh viện An Bình')
+        self.assertEqual({row['type'] for row in res.data['results']}, {'doctor', 'hospital'})
+        res = self.client.get('/search/', {'q': 'an', 'type': 'hospital'})
+        self.assertEqual(self.names(res), ['Bệnh viện An Bình'])
+
+        # Gõ sai một lỗi và các từ không có trong chỉ mục (vd: 'bác sĩ') vẫn tìm được
+        self.assertEqual(self.names(self.client.get('/search/', {'q': 'bác sĩ trân duc'})), ['Trần Đức'])
+        self.assertEqual(self.names(self.client.get('/search/', {'q': 'tim mahc'})), ['Tim mạch'])
+        self.assertEqual(self.client.get('/search/').status_code, 400)
+
+    def test_popularity_breaks_ties(self):
+        DoctorDailyReport.objects.create(doctor=self.anh.user, date=date.today(), booked=5)
+        DoctorDailyReport.objects.create(doctor=self.an.user, date=date.today(), booked=2)
+        self.assertEqual(search.rebuild(), 5)
+        res = self.client.get('/search/', {'q': 'nguyen'})
+        self.assertEqual(self.names(res), ['Nguyễn Văn Anh', 'Nguyễn Văn An'])
+        # Bệnh viện/chuyên khoa phổ biến theo tổng lượt đặt khám của các bác sĩ
+        self.assertEqual(SearchEntry.objects.get(kind='hospital', object_id=self.hospital.id).popularity, 7)
+
+    def test_rebuild_command_matches_incremental_index(self):
+        self.an.user.full_name = 'Lê Văn An'
+        self.an.user.save()
+        before = {
+            'entries': set(SearchEntry.objects.values_list('kind', 'object_id', 'normalized')),
+            'words': sorted(SearchWord.objects.values_list('kind', 'object_id', 'word')),
+            'terms': set(SearchTerm.objects.values_list('word', 'entries')),
+        }
+        stdout = StringIO()
+        call_command('rebuild_search_index', stdout=stdout)
+        self.assertIn('5 mục', stdout.getvalue())
+        self.assertEqual(before, {
+            'entries': set(SearchEntry.objects.values_list('kind', 'object_id', 'normalized')),
+            'words': sorted(SearchWord.objects.values_list('kind', 'object_id', 'word')),
+            'terms': set(SearchTerm.objects.values_list('word', 'entries')),
+        })
+
+
+class AutocompleteTest(ClinicTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete._state.update(index=None, version=None)
+        self.client = APIClient()
+        self.patient = self.create_user('patient')
+        self.hospital = self.create_hospital('Bệnh viện Chợ Rẫy')
+        self.specialization = self.create_specialization('Tim mạch')
+        self.doctors = {}
+        for username, full_name, booked in [('an', 'Nguyễn Văn An', 2), ('anh', 'Nguyễn Văn Anh', 5),
+                                            ('duc', 'Trần Đức', 0), ('binh', 'Lê Văn Bình', 0)]:
+            doctor = self.create_doctor(username)
+            doctor.user.full_name = full_name
+            doctor.user.save()
+            DoctorDailyReport.objects.create(doctor=doctor.user, date=date.today(), booked=booked)
+            self.doctors[username] = doctor
+        search.rebuild()
+
+    def suggest(self, q, **params):
+        res = self.client.get('/autocomplete/', {'q': q, **params})
+        self.assertEqual(res.status_code, 200)
+        return [row['name'] for row in res.data['results']]
+
+    def test_suggests_by_prefix_and_popularity(self):
+        self.assertEqual(self.suggest('nguy'), ['Nguyễn Văn Anh', 'Nguyễn Văn An'])
+        self.assertEqual(self.suggest('Nguyễn Văn An'), ['Nguyễn Văn Anh', 'Nguyễn Văn An'])
+        # Có khoảng trắng cuối thì từ trước đó phải trọn vẹn
+        self.assertEqual(self.suggest('nguyen van an '), [])
+        self.assertEqual(self.suggest('đu'), ['Trần Đức'])
+        self.assertEqual(self.suggest('cho r'), ['Bệnh viện Chợ Rẫy'])
+        self.assertEqual(self.suggest(''), [])
+        # Gõ tên đệm vẫn ra gợi ý, tên bắt đầu bằng chuỗi đang gõ xếp trước
+        self.assertEqual(self.suggest('v', type='doctor'), ['Nguyễn Văn Anh', 'Nguyễn Văn An', 'Lê Văn Bình'])
+        self.assertEqual(self.suggest('v', type='doctor', limit=1), ['Nguyễn Văn Anh'])
+        self.assertEqual(self.suggest('b', type='doctor,hospital'), ['Bệnh viện Chợ Rẫy', 'Lê Văn Bình'])
+
+        # Bệnh viện/chuyên khoa có tổng lượt đặt khám của các bác sĩ nên xếp trước bác sĩ chưa có lượt đặt nào
+        self.assertEqual(self.suggest('t'), ['Tim mạch', 'Trần Đức'])
+        self.assertEqual(self.suggest('t', type='doctor'), ['Trần Đức'])
+        res = self.client.get('/autocomplete/', {'q': 'tim'})
+        self.assertEqual(res.data['results'], [{'type': 'specialization', 'id': self.specialization.id,
+                                                'name': 'Tim mạch'}])
+
+    def test_rating_breaks_popularity_ties(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(doctor=self.doctors['binh'].user, patient=self.patient, rating=5)
+        self.assertEqual(SearchEntry.objects.get(kind='doctor', object_id=self.doctors['binh'].id).rating, 5.0)
+        self.assertEqual(self.suggest('l') + self.suggest('tr'), ['Lê Văn Bình', 'Trần Đức'])
+        self.assertEqual(self.suggest('t', type='doctor'), ['Trần Đức'])
+        self.assertEqual(self.suggest('van b'), ['Lê Văn Bình'])
+
+    def test_keystrokes_do_not_query_database(self):
+        self.suggest('n')
+        with self.assertNumQueries(0):
+            for q in ['n', 'ng', 'ngu', 'nguy', 'nguye', 'nguyen', 'nguyen v', 'nguyen va', 'nguyen van']:
+                self.assertEqual(len(self.suggest(q)), 2)
+
+    def test_changes_are_applied_incrementally(self):
+        self.suggest('n')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctors['an'].user.full_name = 'Phạm Minh'
+            self.doctors['an'].user.save()
+            self.doctors['duc'].active = False
+            self.doctors['duc'].save()
+            self.create_specialization('Nhi khoa')
+
+        # Chỉ đọc lại các mục vừa thay đổi
+        with self.assertNumQueries(1):
+            self.assertEqual(self.suggest('nguyen'), ['Nguyễn Văn Anh'])
+        self.assertEqual(self.suggest('pham'), ['Phạm Minh'])
+        self.assertEqual(self.suggest('tr'), [])
+        self.assertEqual(self.suggest('nhi'), ['Nhi khoa'])
+
+    def test_new_process_starts_from_snapshot(self):
+        self.suggest('n')
+        self.assertIsNotNone(cache.get(autocomplete.SNAPSHOT_KEY))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctors['binh'].user.full_name = 'Lê Văn Bảo'
+            self.doctors['binh'].user.save()
+
+        # Tiến trình mới: đọc snapshot và chỉ truy vấn mục thay đổi sau snapshot
+        autocomplete._state.update(index=None, version=None)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.suggest('le van b'), ['Lê Văn Bảo'])
+
+        # Nhật ký thay đổi không còn đủ thì tải lại toàn bộ từ database
+        autocomplete._state.update(index=None, version=None)
+        with override_settings(AUTOCOMPLETE_MAX_PENDING_CHANGES=0):
+            self.assertEqual(self.suggest('le van b'), ['Lê Văn Bảo'])
+        self.assertEqual(cache.get(autocomplete.SNAPSHOT_KEY)['version'],
+                         caching.get_version(caching.AUTOCOMPLETE))
+
+    def test_rebuild_reloads_every_process(self):
+        self.suggest('n')
+        # Sửa trực tiếp trên database (không qua signal) rồi tạo lại chỉ mục
+        User.objects.filter(pk=self.doctors['duc'].user_id).update(full_name='Trần Đức Huy')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.suggest('tran'), ['Trần Đức Huy'])
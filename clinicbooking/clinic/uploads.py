@@ -0,0 +1,210 @@
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from cloudinary import uploader
+from django.apps import apps
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from clinic import imaging
+from clinic.models import MediaUpload
+
+logger = logging.getLogger(__name__)
+
+
+class CloudinaryBackend:
+    """
+    Tải file lên Cloudinary với cùng tuỳ chọn như khi CloudinaryField tự tải lên lúc lưu model
+    """
+
+    def upload(self, path, options):
+        """
+        :return: giá trị lưu vào CloudinaryField (vd: image/upload/v1/abc.jpg)
+        """
+        return uploader.upload_resource(path, **options).get_prep_value()
+
+
+def storage_backend():
+    return import_string(settings.MEDIA_UPLOAD_BACKEND)()
+
+
+def pop_files(validated_data, fields):
+    """
+    Tách các file vừa tải lên khỏi dữ liệu của serializer để không bị tải lên Cloudinary ngay trong request
+    :return: {tên trường: file}
+    """
+    return {field: validated_data.pop(field) for field in fields
+            if isinstance(validated_data.get(field), UploadedFile)}
+
+
+def stage(instance, field, file):
+    """
+    Lưu file tạm vào MEDIA_STAGING_ROOT và đưa vào hàng đợi tải lên cho trường ảnh của đối tượng
+    :param instance: Đối tượng đã lưu (cần có pk)
+    :param field: Tên trường CloudinaryField
+    :param file: UploadedFile
+    :return: MediaUpload
+    """
+    os.makedirs(settings.MEDIA_STAGING_ROOT, exist_ok=True)
+    path = os.path.join(settings.MEDIA_STAGING_ROOT, uuid.uuid4().hex + os.path.splitext(file.name)[1].lower())
+    with open(path, 'wb') as out:
+        for chunk in file.chunks():
+            out.write(chunk)
+
+    return MediaUpload.objects.create(model=instance._meta.label_lower, object_id=instance.pk, field=field,
+                                      path=path)
+
+
+def stage_files(instance, files):
+    return [stage(instance, field, file) for field, file in files.items()]
+
+
+def _upload_options(upload):
+    model_field = apps.get_model(upload.model)._meta.get_field(upload.field)
+    options = {'type': model_field.type, 'resource_type': model_field.resource_type}
+    options.update({key: value for key, value in model_field.options.items() if not callable(value)})
+    return options
+
+
+def _mark_failed(upload, error, now):
+    upload.attempts += 1
+    upload.last_error = str(error)
+    if upload.attempts >= settings.MEDIA_UPLOAD_MAX_ATTEMPTS:
+        upload.status = MediaUpload.Status.DEAD
+    else:
+        delay = settings.MEDIA_UPLOAD_RETRY_BASE_SECONDS * 2 ** (upload.attempts - 1)
+        upload.next_attempt_at = now + timedelta(seconds=delay)
+    upload.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def _apply(upload, value):
+    # Đã có file mới hơn cho cùng trường (vd: user đổi ảnh 2 lần liên tiếp) thì không ghi đè bằng file cũ
+    newer = MediaUpload.objects.filter(model=upload.model, object_id=upload.object_id, field=upload.field,
+                                       id__gt=upload.id)
+    if not newer.exists():
+        instance = apps.get_model(upload.model).objects.filter(pk=upload.object_id).first()
+        if instance is not None:
+            setattr(instance, upload.field, value)
+            # Lưu qua save() để các signal (xoá cache danh mục,...) vẫn chạy
+            instance.save(update_fields=[upload.field])
+    upload.status = MediaUpload.Status.UPLOADED
+    upload.attempts += 1
+    upload.uploaded_at = timezone.now()
+    upload.save(update_fields=['status', 'attempts', 'uploaded_at'])
+
+
+def _prepare_images(pending, leased_until):
+    """
+    Nén các ảnh thuộc MEDIA_COMPRESS_FIELDS trong process pool trước khi tải lên (mỗi file chỉ nén một lần)
+    và đưa ảnh thu nhỏ vào hàng đợi tải lên cùng lô (cũng được giữ tới leased_until để worker khác không lấy)
+    :return: danh sách MediaUpload của các ảnh thu nhỏ
+    """
+    targets = [upload for upload in pending if upload.original_bytes is None
+               and f'{upload.model}.{upload.field}' in settings.MEDIA_COMPRESS_FIELDS]
+    if not targets or not imaging.available():
+        return []
+
+    pool = imaging.process_pool(settings.MEDIA_IMAGE_WORKERS)
+    futures = [pool.submit(imaging.compress, upload.path, settings.MEDIA_IMAGE_MAX_SIZE,
+                           settings.MEDIA_IMAGE_QUALITY, settings.MEDIA_THUMBNAIL_SIZE) for upload in targets]
+    thumbnails = []
+    for upload, future in zip(targets, futures):
+        try:
+            result = future.result()
+        except Exception:
+            logger.exception("Không thể nén ảnh %s", upload)
+            result = None
+        if result is None:
+            # Không phải ảnh (hoặc ảnh lỗi): tải lên nguyên bản, không nén lại ở lần thử sau
+            size = os.path.getsize(upload.path) if os.path.exists(upload.path) else 0
+            upload.original_bytes = upload.stored_bytes = size
+        else:
+            if result['path'] != upload.path:
+                os.remove(upload.path)
+            upload.path = result['path']
+            upload.original_bytes, upload.stored_bytes = result['original_bytes'], result['stored_bytes']
+            thumbnail_field = settings.MEDIA_COMPRESS_FIELDS[f'{upload.model}.{upload.field}']
+            if thumbnail_field:
+                thumbnails.append(MediaUpload.objects.create(model=upload.model, object_id=upload.object_id,
+                                                             field=thumbnail_field, path=result['thumbnail'],
+                                                             next_attempt_at=leased_until))
+            elif os.path.exists(result['thumbnail']):
+                os.remove(result['thumbnail'])
+        upload.save(update_fields=['path', 'original_bytes', 'stored_bytes'])
+    return thumbnails
+
+
+def compression_stats():
+    """
+    Tổng dung lượng ảnh trước/sau khi nén
+    :return: dict files, original_bytes, stored_bytes, saved_bytes
+    """
+    stats = MediaUpload.objects.filter(original_bytes__isnull=False).aggregate(
+        files=Count('id'), original_bytes=Sum('original_bytes'), stored_bytes=Sum('stored_bytes'))
+    stats['original_bytes'] = stats['original_bytes'] or 0
+    stats['stored_bytes'] = stats['stored_bytes'] or 0
+    stats['saved_bytes'] = stats['original_bytes'] - stats['stored_bytes']
+    return stats
+
+
+def process_uploads(batch_size=None):
+    """
+    Tải một lô file đang chờ lên backend lưu trữ (MEDIA_UPLOAD_BACKEND), tối đa MEDIA_UPLOAD_CONCURRENCY file
+    song song, rồi cập nhật trường ảnh của đối tượng. Ảnh chụp (MEDIA_COMPRESS_FIELDS) được nén trước khi tải lên.
+    File lỗi được thử lại sau (thời gian chờ tăng gấp đôi), quá số lần cho phép thì chuyển sang DEAD.
+    Các dòng được nhận bằng SELECT ... FOR UPDATE SKIP LOCKED rồi giữ trong MEDIA_UPLOAD_LEASE_SECONDS giây
+    (dời next_attempt_at) nên có thể chạy nhiều worker cùng lúc; việc nén và tải lên chạy ngoài transaction,
+    worker bị dừng giữa chừng thì file được xử lý lại khi hết hạn giữ.
+    :param batch_size: Số file tối đa trong một lô
+    :return: (số file tải lên thành công, số file lỗi)
+    """
+    batch_size = batch_size or settings.MEDIA_UPLOAD_BATCH_SIZE
+    now = timezone.now()
+    leased_until = now + timedelta(seconds=settings.MEDIA_UPLOAD_LEASE_SECONDS)
+    done = failed = 0
+
+    with transaction.atomic():
+        pending = list(MediaUpload.objects.select_for_update(skip_locked=True)
+                       .filter(status=MediaUpload.Status.PENDING, next_attempt_at__lte=now)
+                       .order_by('next_attempt_at', 'id')[:batch_size])
+        if not pending:
+            return done, failed
+        MediaUpload.objects.filter(pk__in=[upload.pk for upload in pending]).update(next_attempt_at=leased_until)
+
+    pending += _prepare_images(pending, leased_until)
+    backend = storage_backend()
+
+    def upload_one(upload):
+        try:
+            return backend.upload(upload.path, _upload_options(upload)), None
+        except Exception as ex:
+            return None, ex
+
+    # Chỉ các lệnh gọi backend chạy song song, cập nhật database vẫn ở thread hiện tại
+    with ThreadPoolExecutor(max_workers=settings.MEDIA_UPLOAD_CONCURRENCY) as pool:
+        results = list(pool.map(upload_one, pending))
+
+    with transaction.atomic():
+        for upload, (value, error) in zip(pending, results):
+            if error is not None:
+                logger.warning("Không thể tải lên %s: %s", upload, error)
+                _mark_failed(upload, error, now)
+                failed += 1
+                continue
+            _apply(upload, value)
+            done += 1
+
+    for upload, (value, error) in zip(pending, results):
+        if error is None:
+            try:
+                os.remove(upload.path)
+            except OSError:
+                pass
+    return done, failed
@@ -0,0 +1,31 @@
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+
+def upsert(model, rows, unique_fields, update_fields, batch_size=None):
+    """
+    Thêm mới hoặc cập nhật các dòng theo ràng buộc unique của bảng bằng một lần bulk_create:
+    - PostgreSQL/SQLite: INSERT ... ON CONFLICT (unique_fields) DO UPDATE
+    - MySQL không cho chỉ định cột xung đột: INSERT ... ON DUPLICATE KEY UPDATE, dựa vào UniqueConstraint của bảng
+    - Database không hỗ trợ upsert: xoá rồi thêm lại các dòng trong cùng transaction
+    :param model: Model có UniqueConstraint trên unique_fields
+    :param rows: Các đối tượng chưa lưu
+    :param unique_fields: Các trường của ràng buộc unique, vd: ['doctor', 'date']
+    :param update_fields: Các trường được cập nhật khi dòng đã tồn tại
+    """
+    if not rows:
+        return
+    features = connections[router.db_for_write(model)].features
+    if features.supports_update_conflicts_with_target:
+        model.objects.bulk_create(rows, update_conflicts=True, unique_fields=unique_fields,
+                                  update_fields=update_fields, batch_size=batch_size)
+    elif features.supports_update_conflicts:
+        model.objects.bulk_create(rows, update_conflicts=True, update_fields=update_fields, batch_size=batch_size)
+    else:
+        attnames = [model._meta.get_field(field).attname for field in unique_fields]
+        condition = Q()
+        for row in rows:
+            condition |= Q(**{attname: getattr(row, attname) for attname in attnames})
+        with transaction.atomic():
+            model.objects.filter(condition).delete()
+            model.objects.bulk_create(rows, batch_size=batch_size)
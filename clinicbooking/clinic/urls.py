@@ -17,6 +17,7 @@ router.register('doctors', views.DoctorViewSet, basename='doctor-info')
 # router.register('patients', views.PatientViewSet, basename='patient')
 router.register('appointments', views.AppointmentViewSet, basename='appointment')
 router.register('schedules', views.ScheduleViewSet, basename='schedule')
+router.register('schedule-templates', views.ScheduleTemplateViewSet, basename='schedule-template')
 router.register('messages', views.MessageViewSet, basename='message')
 router.register('healthrecords', views.HealthRecordViewSet, basename='healthrecord')
 router.register('testresults', views.TestResultViewSet, basename='testresult')
@@ -26,11 +27,17 @@ router.register('payments', views.PaymentViewSet, basename='payment')
 router.register('notifications', views.NotificationViewSet, basename='notification')
 
 urlpatterns = [
+    # Đặt trước router để 'available-dates' không bị hiểu là id của schedule
+    path('schedules/available-dates/', views.ScheduleAvailableDatesView.as_view(), name='schedule_available_dates'),
+    path('availability/', views.AvailabilityView.as_view(), name='availability'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('autocomplete/', views.AutocompleteView.as_view(), name='autocomplete'),
     path('', include(router.urls)),
     path('api/password-reset/otp/', PasswordResetSendOTPViewSet.as_view(), name='send_otp'),
     path('api/password-reset/otp/confirm/', PasswordResetConfirmOTPViewSet.as_view(), name='confirm_otp'),
     path('reportsdoctor/', DoctorReportViewSet.as_view(), name='doctorreport'),
     path('reportsadmin/', AdminReportViewSet.as_view(), name='adminreport'),
+    path('reports/timeseries/', views.ReportTimeSeriesView.as_view(), name='report_timeseries'),
     # Tạo url cho upload license, duyệt bác sĩ
     path('doctor/upload-license/', UploadLicenseViewSet.as_view(), name='upload_license'),
     path('admin/doctors/pending/', PendingDoctorsViewSet.as_view(), name='pending_doctors'),
@@ -7,10 +7,13 @@ import random
 
 from django.dispatch import receiver
 from django.shortcuts import get_object_or_404
+from django.core.files.uploadedfile import UploadedFile
 from django.core.mail import send_mail, EmailMultiAlternatives
 from django.conf import settings
+from django.db import transaction
 from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from oauthlib.uri_validate import query
@@ -19,44 +22,65 @@ from requests_toolbelt.multipart.encoder import total_len
 from rest_framework.decorators import action, permission_classes, api_view
 from rest_framework.exceptions import PermissionDenied, AuthenticationFailed, ValidationError
 from rest_framework.views import APIView
-from clinic import serializers, paginators
+from clinic import serializers, paginators, booking, caching, availability, scheduling, reports, \
+    notifications, uploads, search, autocomplete
+from clinic.fieldsets import SparseQuerysetMixin
+from clinic.media import ImageVariantMixin
 from rest_framework import viewsets, generics, status, parsers, permissions
 from clinic.models import (User, Doctor, Payment, Appointment, Review,
                            Schedule, Notification, HealthRecord, Message, TestResult,
-                           Hospital, Specialization, PasswordResetOTP)
+                           Hospital, Specialization, PasswordResetOTP, ScheduleTemplate, UserNotification)
 from rest_framework.permissions import IsAdminUser
 from rest_framework.parsers import MultiPartParser, FormParser
 from decimal import Decimal
 from django.db.models import Q, Count, Sum, F, DecimalField
-from django.db.models.functions import Coalesce
+from django.db.models.functions import Coalesce, NullIf
 from rest_framework.response import Response
+from clinic.email import send_payment_success_email
 from clinic.permissions import IsDoctorOrSelf
 from clinic.serializers import AppointmentSerializer, PaymentSerializer, NotificationSerializer, UserSerializer, \
     OTPRequestSerializer, OTPConfirmResetSerializer, MessageSerializer, DoctorSerializer
 
 
-class HospitalViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
+class HospitalViewSet(caching.CatalogCacheMixin, ImageVariantMixin, SparseQuerysetMixin, viewsets.ViewSet,
+                      generics.ListAPIView, generics.RetrieveAPIView):
     queryset = Hospital.objects.filter(active=True)
     serializer_class = serializers.HospitalSerializer
+    cache_namespace = caching.HOSPITALS
+    image_variants = {'list': 'thumbnail', 'retrieve': 'card'}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Lấy các bệnh viện theo tên (không phân biệt dấu)
+        if self.action == 'list' and (hospital_name := self.request.query_params.get('name')):
+            queryset = search.filter_queryset(queryset, 'hospital', hospital_name)
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        build = super().retrieve
+        return caching.cached_response(self.cache_namespace, request, lambda: build(request, *args, **kwargs))
 
 
-class SpecializationViewSet(viewsets.ViewSet, generics.ListAPIView):
+class SpecializationViewSet(caching.CatalogCacheMixin, SparseQuerysetMixin, viewsets.ViewSet, generics.ListAPIView):
     queryset = Specialization.objects.filter(active=True)
     serializer_class = serializers.SpecializationSerializer
+    cache_namespace = caching.SPECIALIZATIONS
 
     def get_queryset(self):
         queryset = self.queryset
-        # Lấy các chuyên khoa theo tên chuyên khoa
+        # Lấy các chuyên khoa theo tên chuyên khoa (không phân biệt dấu)
         specialization_name = self.request.query_params.get('name')
         if specialization_name:
-            queryset = queryset.filter(name__icontains=specialization_name)
+            queryset = search.filter_queryset(queryset, 'specialization', specialization_name)
         return queryset
 
 
-class UserViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView):
+class UserViewSet(ImageVariantMixin, SparseQuerysetMixin, viewsets.ViewSet, generics.ListAPIView,
+                  generics.CreateAPIView):
     queryset = User.objects.filter(is_active=True)
     serializer_class = serializers.UserSerializer
     parser_classes = [parsers.MultiPartParser]
+    image_variants = {action: 'thumbnail' for action in ['list', 'get_doctors', 'get_patients', 'get_admin']}
 
     # Chứng thực user để xem thông tin user và chỉnh sửa thông tin user
     @action(methods=['get', 'patch'], url_path='current-user', detail=False,
@@ -72,23 +96,22 @@ class UserViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView
             u.save()
         return Response(serializers.UserSerializer(u).data)
 
+    def _paginated(self, queryset):
+        page = self.paginate_queryset(self.filter_queryset(queryset))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(methods=['get'], detail=False, url_path='doctors')
     def get_doctors(self, request):
-        doctors = User.objects.filter(role='doctor')
-        serializer = self.get_serializer(doctors, many=True)
-        return Response(serializer.data)
+        return self._paginated(User.objects.filter(role='doctor').order_by('id'))
 
     @action(methods=['get'], detail=False, url_path='patients')
     def get_patients(self, request):
-        patients = User.objects.filter(role='patient')
-        serializer = self.get_serializer(patients, many=True)
-        return Response(serializer.data)
+        return self._paginated(User.objects.filter(role='patient').order_by('id'))
 
     @action(methods=['get'], detail=False, url_path='admin')
     def get_admin(self, request):
-        admin = User.objects.filter(role='admin')
-        serializer = self.get_serializer(admin, many=True)
-        return Response(serializer.data)
+        return self._paginated(User.objects.filter(role='admin').order_by('id'))
 
 
 class PasswordResetSendOTPViewSet(APIView):
@@ -113,17 +136,24 @@ class PasswordResetConfirmOTPViewSet(APIView):
         return Response(serializer.errors, status=400)
 
 
-class PatientViewSet(viewsets.ViewSet, generics.ListAPIView):
+class PatientViewSet(ImageVariantMixin, SparseQuerysetMixin, viewsets.ViewSet, generics.ListAPIView):
     queryset = User.objects.filter(role='patient')
     serializer_class = serializers.UserSerializer
+    image_variants = {'list': 'thumbnail'}
 
 
-class DoctorViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,
-                    generics.UpdateAPIView, generics.RetrieveAPIView):
-    queryset = Doctor.objects.select_related('user', 'hospital', 'specialization').all()
+class DoctorViewSet(caching.CatalogCacheMixin, ImageVariantMixin, SparseQuerysetMixin, viewsets.ViewSet,
+                    generics.ListAPIView, generics.CreateAPIView, generics.UpdateAPIView, generics.RetrieveAPIView):
+    queryset = Doctor.objects.select_related('user', 'hospital', 'specialization').with_rating_stats()
     serializer_class = serializers.DoctorSerializer
     parser_classes = [parsers.MultiPartParser]
     filterset_fields = ['hospital', 'specialization']
+    cache_namespace = caching.DOCTORS
+    image_variants = {'list': 'card'}
+
+    def retrieve(self, request, *args, **kwargs):
+        build = super().retrieve
+        return caching.cached_response(self.cache_namespace, request, lambda: build(request, *args, **kwargs))
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -136,7 +166,7 @@ class DoctorViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIVi
             return Response({'error': 'Missing user_id'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            doctor = Doctor.objects.select_related('user').get(user__id=user_id)
+            doctor = self.get_queryset().get(user__id=user_id)
             serializer = self.get_serializer(doctor)
             return Response(serializer.data)
         except Doctor.DoesNotExist:
@@ -152,13 +182,20 @@ class DoctorViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIVi
         if (specialization_id := params.get('specialization')):
             queryset = queryset.filter(specialization_id=specialization_id)
 
+        # Tìm theo tên không phân biệt dấu, cho phép gõ sai (clinic/search.py)
         if (doctor_name := params.get('name')):
-            queryset = queryset.filter(user__full_name__icontains=doctor_name)
+            queryset = search.filter_queryset(queryset, 'doctor', doctor_name)
+
+        # Sắp xếp bác sĩ theo số sao trung bình (đọc từ bảng thống kê DoctorRatingStats)
+        if params.get('ordering') == 'rating':
+            queryset = queryset.annotate(
+                rating_avg=F('user__rating_stats__rating_sum') * 1.0 / NullIf(F('user__rating_stats__review_count'), 0)
+            ).order_by(F('rating_avg').desc(nulls_last=True), '-user__rating_stats__review_count', 'id')
 
         return queryset
 
 
-class HealthRecordViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
+class HealthRecordViewSet(SparseQuerysetMixin, viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
     queryset = HealthRecord.objects.filter(active=True)
     serializer_class = serializers.HealthRecordSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -228,8 +265,9 @@ class HealthRecordViewSet(viewsets.ViewSet, generics.ListAPIView, generics.Retri
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TestResultViewSet(viewsets.ModelViewSet):
+class TestResultViewSet(ImageVariantMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = serializers.TestResultSerializer
+    image_variants = {'list': 'card'}
 
     def get_queryset(self):
         queryset = TestResult.objects.filter(active=True)
@@ -253,10 +291,12 @@ def is_more_than_24_hours_ahead(schedule_date, schedule_time):
     return schedule_datetime - now >= timedelta(hours=24)
 
 
-class AppointmentViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView, generics.UpdateAPIView):
+class AppointmentViewSet(SparseQuerysetMixin, viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView,
+                         generics.UpdateAPIView, generics.RetrieveAPIView):
     queryset = Appointment.objects.filter().all()
     serializer_class = serializers.AppointmentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = paginators.AppointmentPagination
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
@@ -265,10 +305,25 @@ class AppointmentViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.List
         # Lấy các lịch hẹn của user đăng nhập
         # user là bệnh nhân: Lấy lịch khám do user đó đặt
         if user.role == 'patient':
-            return Appointment.objects.filter(healthrecord__user=user)
+            queryset = Appointment.objects.filter(healthrecord__user=user)
         # user là bác sĩ: Lấy các lịch khám các user đặt bác sĩ đó
-        if user.role == 'doctor':
-            return Appointment.objects.filter(schedule__doctor=user)
+        elif user.role == 'doctor':
+            queryset = Appointment.objects.filter(schedule__doctor=user)
+        else:
+            return Appointment.objects.none()
+
+        if self.action == 'list':
+            # Lấy lịch khám, bác sĩ, bệnh viện, chuyên khoa, hồ sơ trong cùng một truy vấn,
+            # bỏ qua cột medical_history (HTML) không dùng trong danh sách
+            return queryset.select_related('schedule__doctor__doctor__hospital',
+                                           'schedule__doctor__doctor__specialization',
+                                           'healthrecord').defer('healthrecord__medical_history')
+        return queryset.select_related('schedule', 'healthrecord')
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return serializers.AppointmentListSerializer
+        return self.serializer_class
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -278,76 +333,40 @@ class AppointmentViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.List
 
     @action(detail=True, methods=["patch"], permission_classes=[permissions.IsAuthenticated])
     def cancel(self, request, pk=None):
-        appointment = Appointment.objects.get(pk=pk)
-        schedule_date = appointment.schedule.date
-        schedule_time = appointment.schedule.start_time
+        appointment = get_object_or_404(Appointment.objects.select_related('schedule'), pk=pk)
         reason_cancel = request.data.get('reason')
-        if not appointment:
-            return Response({'detail': 'Không tìm thấy lịch khám!'}, status=status.HTTP_404_NOT_FOUND)
 
         if appointment.cancel:
             return Response({'detail': 'Lịch khám này đã bị huỷ'}, status=status.HTTP_400_BAD_REQUEST)
-        if not is_more_than_24_hours_ahead(schedule_date, schedule_time):
+        if not is_more_than_24_hours_ahead(appointment.schedule.date, appointment.schedule.start_time):
             return Response({'error': 'Bạn chỉ được huỷ lịch trước 24 tiếng'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Huỷ lịch
-        appointment.cancel = True
-        appointment.status = "cancelled"
-        appointment.reason = reason_cancel
-        appointment.save()
-
-        # Giảm số lượng đặt lịch khám của bác sĩ
-        schedule = appointment.schedule
-        if schedule.sum_booking > 0:
-            schedule.sum_booking -= 1
-        else:
-            schedule.sum_booking = 0
-        schedule.save()
+        # Huỷ lịch và giảm số lượng đặt lịch khám của bác sĩ
+        booking.cancel_appointment(appointment, reason_cancel)
 
         return Response('Huỷ lịch khám thành công', status=status.HTTP_200_OK)
 
     @action(detail=True, methods=["patch"], permission_classes=[permissions.IsAuthenticated])
     def reschedule(self, request, pk=None):
-        appointment = Appointment.objects.get(pk=pk)
-        schedule_date = appointment.schedule.date
-        schedule_time = appointment.schedule.start_time
+        appointment = get_object_or_404(Appointment.objects.select_related('schedule'), pk=pk)
 
-        if not appointment:
-            return Response("Không tìm thấy lịch khám", status=status.HTTP_404_NOT_FOUND)
         if appointment.cancel:
             return Response("Lịch khám đã bị huỷ", status=status.HTTP_404_NOT_FOUND)
 
-        if not is_more_than_24_hours_ahead(schedule_date, schedule_time):
+        if not is_more_than_24_hours_ahead(appointment.schedule.date, appointment.schedule.start_time):
             return Response({'error': 'Bạn chỉ được đổi lịch trước 24 tiếng'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Lấy id của lịch mới
         new_schedule_id = request.data.get('new_schedule_id')
         if not new_schedule_id:
             return Response("Thiếu thông tin của lịch hẹn mới", status=status.HTTP_400_BAD_REQUEST)
-        new_schedule = Schedule.objects.get(pk=new_schedule_id)
-        print(new_schedule)
-        # Kiểm tra lịch mới còn chỗ không
-        if new_schedule.sum_booking >= new_schedule.capacity:
-            return Response({"error": 'Lịch khám mới đã đầy.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Kiểm tra trùng lịch (bệnh nhân đã có lịch với new_schedule chưa)
-        if Appointment.objects.filter(healthrecord=appointment.healthrecord, schedule=new_schedule,
-                                      cancel=False).exists():
-            return Response({'error': 'Bạn đã có lịch khám trong khoảng thời gian này.'},
-                            status=status.HTTP_400_BAD_REQUEST)
-
-        # Giảm số lượng booking của lịch cũ
-        old_schedule = appointment.schedule
-        if old_schedule.sum_booking > 0:
-            old_schedule.sum_booking -= 1
-            old_schedule.save()
+        new_schedule = get_object_or_404(Schedule, pk=new_schedule_id)
 
-        # Cập nhật lịch mới và tăng sum_booking
-        appointment.schedule = new_schedule
-        appointment.save()
-
-        new_schedule.sum_booking += 1
-        new_schedule.save()
+        # Giữ chỗ ở lịch mới (kiểm tra còn chỗ, trùng lịch) và trả chỗ ở lịch cũ
+        try:
+            booking.reschedule_appointment(appointment, new_schedule)
+        except ValidationError as ex:
+            return Response({'error': ex.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({'detail': 'Đổi lịch khám thành công.'}, status=status.HTTP_200_OK)
 
@@ -364,7 +383,7 @@ class AppointmentViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.List
         return Response({"error": "Không tìm thấy lịch khám!"}, status=status.HTTP_404_NOT_FOUND)
 
 
-class ScheduleViewSet(viewsets.ViewSet, generics.ListAPIView,
+class ScheduleViewSet(SparseQuerysetMixin, viewsets.ViewSet, generics.ListAPIView,
                       generics.CreateAPIView, generics.UpdateAPIView, generics.RetrieveAPIView):
     queryset = Schedule.objects.all()
     serializer_class = serializers.ScheduleSerializer
@@ -390,11 +409,76 @@ class ScheduleViewSet(viewsets.ViewSet, generics.ListAPIView,
 
         return queryset
 
+    def perform_create(self, serializer):
+        # Bác sĩ tạo lịch cho chính mình, admin chọn bác sĩ qua doctor_id
+        if self.request.user.is_authenticated and self.request.user.role == 'doctor':
+            serializer.save(doctor=self.request.user)
+        else:
+            serializer.save()
+
+
+class ScheduleTemplateViewSet(viewsets.ModelViewSet):
+    """
+    Lịch làm việc mẫu hằng tuần: bác sĩ quản lý lịch mẫu của mình, admin quản lý của tất cả bác sĩ
+    """
+    queryset = ScheduleTemplate.objects.all()
+    serializer_class = serializers.ScheduleTemplateSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = self.queryset.order_by('doctor_id', 'weekday', 'start_time')
+        if user.role == 'doctor':
+            return queryset.filter(doctor=user)
+        if user.is_staff or user.role == 'admin':
+            if (doctor_id := self.request.query_params.get('doctor_id')):
+                queryset = queryset.filter(doctor_id=doctor_id)
+            return queryset
+        return queryset.none()
+
+    def perform_create(self, serializer):
+        user = self.request.user
+        if user.role == 'doctor':
+            serializer.save(doctor=user)
+        elif user.is_staff or user.role == 'admin':
+            if 'doctor' not in serializer.validated_data:
+                raise ValidationError("Cần chọn bác sĩ (doctor_id).")
+            serializer.save()
+        else:
+            raise PermissionDenied("Chỉ bác sĩ hoặc quản trị viên được tạo lịch mẫu.")
+
+    def perform_update(self, serializer):
+        # Bác sĩ không được chuyển lịch mẫu sang bác sĩ khác
+        if self.request.user.role == 'doctor':
+            serializer.save(doctor=self.request.user)
+        else:
+            serializer.save()
+
+    @action(methods=['post'], detail=False, url_path='generate')
+    def generate(self, request):
+        """
+        Sinh lịch khám từ các lịch mẫu (đang active) cho khoảng ngày start_date - end_date
+        """
+        params = serializers.ScheduleGenerateSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        templates = self.get_queryset().filter(active=True)
+        if (template_ids := params.validated_data.get('template_ids')):
+            templates = templates.filter(pk__in=template_ids)
+
+        created, skipped = scheduling.generate_schedules(templates, params.validated_data['start_date'],
+                                                         params.validated_data['end_date'])
+        return Response({'created': created, 'skipped': skipped}, status=status.HTTP_201_CREATED)
 
-class MessageViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView, generics.UpdateAPIView):
+
+class MessageViewSet(ImageVariantMixin, viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,
+                     generics.UpdateAPIView):
     queryset = Message.objects.all().order_by('created_date')
     serializer_class = serializers.MessageSerializer
+    image_variants = {'list': 'thumbnail'}
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = paginators.MessagePagination
+    SYNC_LIMIT = 100
+    SYNC_MAX_LIMIT = 500
 
     def get_queryset(self):
         user = self.request.user
@@ -410,7 +494,8 @@ class MessageViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIV
         except User.DoesNotExist:
             raise ValidationError("Người dùng không tồn tại")
         messages = Message.objects.filter(
-            Q(sender=user, receiver=participant) | Q(sender=participant, receiver=user)).order_by('created_date')
+            Q(sender=user, receiver=participant) | Q(sender=participant, receiver=user)) \
+            .select_related('sender', 'receiver').order_by('created_date')
 
         return messages
 
@@ -438,10 +523,56 @@ class MessageViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIV
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    # Đồng bộ tin nhắn mới: chỉ trả về các tin nhắn sau after_id (hoặc sau thời điểm after)
+    # Method: GET, URL: /messages/sync/?participant_id=&after_id=&after=&limit=
+    @action(methods=['get'], detail=False, url_path='sync')
+    def sync(self, request):
+        user = request.user
+        params = request.query_params
+        participant_id = params.get('participant_id')
+        if not participant_id:
+            raise ValidationError("participant_id is required")
+
+        try:
+            participant_id = int(participant_id)
+            after_id = int(params.get('after_id', 0))
+            limit = min(int(params.get('limit', self.SYNC_LIMIT)), self.SYNC_MAX_LIMIT)
+        except ValueError:
+            raise ValidationError("participant_id, after_id và limit phải là số.")
+        if limit < 1:
+            raise ValidationError("limit phải lớn hơn 0.")
+
+        messages = Message.objects.filter(
+            Q(sender=user, receiver_id=participant_id) | Q(sender_id=participant_id, receiver=user),
+            id__gt=after_id).order_by('id')
+        if (after := params.get('after')):
+            after = parse_datetime(after)
+            if not after:
+                raise ValidationError("after phải có định dạng ISO 8601.")
+            messages = messages.filter(created_date__gt=after)
+
+        messages = list(messages[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        last_id = messages[-1].id if messages else after_id
+
+        # Đánh dấu đã đọc tất cả tin nhắn người kia gửi đến mà client đã nhận
+        if messages:
+            Message.objects.filter(sender_id=participant_id, receiver=user, is_read=False,
+                                   id__lte=last_id).update(is_read=True)
+
+        return Response({
+            'messages': serializers.MessageSyncSerializer(messages, many=True).data,
+            'last_id': last_id,
+            'has_more': has_more,
+        })
+
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(ImageVariantMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = Review.objects.all().order_by('created_date')
     serializer_class = serializers.ReviewSerializer
+    image_variants = {'list': 'thumbnail'}
+    pagination_class = paginators.ReviewPagination
 
     def get_queryset(self):
         doctor_id = self.request.query_params.get('doctor')
@@ -454,6 +585,20 @@ class ReviewViewSet(viewsets.ModelViewSet):
             return [permissions.IsAuthenticated()]
         return [permissions.AllowAny()]
 
+    # Thống kê đánh giá của bác sĩ được cập nhật qua signal của Review (clinic/signals.py),
+    # bọc trong transaction để Review và thống kê luôn được lưu cùng nhau
+    @transaction.atomic
+    def perform_create(self, serializer):
+        serializer.save()
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        serializer.save()
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
     @action(detail=True, methods=['patch'], permission_classes=[permissions.IsAuthenticated])
     def reply(self, request, pk=None):
         review = self.get_object()
@@ -475,28 +620,24 @@ class ReviewViewSet(viewsets.ModelViewSet):
 def create_payment_url(request):
     # Lấy thông tin từ request
     appointment_id = request.data.get('appointment_id')
-    appointment = Appointment.objects.get(pk=appointment_id)
-    doctor_user = appointment.schedule.doctor
-    doctor = Doctor.objects.get(user=doctor_user)
-    amount = doctor.consultation_fee
-    print(amount)
     order_info = request.data.get('order_info', 'Thanh toan lich kham')
-
-    if not appointment_id or not amount:
+    if not appointment_id:
         return JsonResponse({'error': 'Thiếu appointment_id hoặc amount'}, status=400)
 
     try:
-        appointment = Appointment.objects.get(id=appointment_id)
-    except Appointment.DoesNotExist:
+        appointment = Appointment.objects.select_related('schedule__doctor__doctor').get(id=appointment_id)
+    except (Appointment.DoesNotExist, ValueError):
         return JsonResponse({'error': 'Lịch hẹn không tồn tại'}, status=404)
 
-    # Tạo payment object
-    payment = Payment.objects.create(
-        appointment=appointment,
-        method='vnpay',
-        amount=amount,
-        status='pending'
-    )
+    amount = appointment.schedule.doctor.doctor.consultation_fee
+    if not amount:
+        return JsonResponse({'error': 'Thiếu appointment_id hoặc amount'}, status=400)
+
+    # Tạo payment object (lịch hẹn đã bị huỷ/quá hạn hoặc đã thanh toán thì không tạo)
+    try:
+        payment = booking.start_payment(appointment, amount)
+    except ValidationError as e:
+        return JsonResponse({'error': e.detail[0]}, status=400)
 
     # Tạo các tham số cho VNPay
     vnpay_params = {
@@ -553,61 +694,43 @@ def vnpay_return(request):
     payment_id = vnpay_params.get('vnp_TxnRef')
     response_code = vnpay_params.get('vnp_ResponseCode')
 
+    # Cập nhật trạng thái thanh toán (khoá lịch hẹn và hoá đơn, clinic/booking.py)
     try:
-        payment = Payment.objects.get(id=payment_id)
-    except Payment.DoesNotExist:
+        if response_code != '00':
+            booking.fail_payment(payment_id)
+            return JsonResponse({'error': 'Thanh toán thất bại', 'response_code': response_code}, status=400)
+        payment = booking.confirm_payment(payment_id, vnpay_params.get('vnp_TransactionNo'),
+                                          refund_if_unpayable=True)
+    except (Payment.DoesNotExist, ValueError):
         return JsonResponse({'error': 'Giao dịch không tồn tại'}, status=404)
+    except ValidationError as e:
+        return JsonResponse({'error': e.detail[0]}, status=400)
 
-    # Cập nhật trạng thái thanh toán
-    if response_code == '00':
-        payment.status = Payment.PaymentStatus.PAID
-        payment.transaction_id = vnpay_params.get('vnp_TransactionNo')
-        payment.appointment.status = 'paid'
-        payment.appointment.save()
-        payment.save()
+    # Lịch hẹn đã bị huỷ (quá hạn thanh toán) trước khi VNPay báo thành công: chỗ đã được trả lại nên cần hoàn tiền
+    if payment.status == Payment.PaymentStatus.REFUND:
+        return JsonResponse({'error': 'Lịch hẹn đã bị huỷ do quá hạn thanh toán, số tiền sẽ được hoàn lại'},
+                            status=409)
 
-        # Gửi email xác nhận
-        send_payment_success_email(payment)
-        return JsonResponse({'message': 'Thanh toán thành công'}, status=200)
-    else:
-        payment.status = Payment.PaymentStatus.FAILED
-        payment.save()
-        return JsonResponse({'error': 'Thanh toán thất bại', 'response_code': response_code}, status=400)
+    # Gửi email xác nhận
+    send_payment_success_email(payment)
+    return JsonResponse({'message': 'Thanh toán thành công'}, status=200)
 
 
-def send_payment_success_email(payment):
-    subject = 'Xác nhận thanh toán thành công'
-    message = f"""
-    Kính gửi {payment.appointment.healthrecord.full_name},
-
-    Thanh toán của bạn cho lịch hẹn #{payment.appointment.id} đã được thực hiện thành công.
-    - Số tiền: {payment.amount} VND
-    - Mã giao dịch: {payment.transaction_id}
-    - Thời gian: {payment.created_date.strftime('%d/%m/%Y %H:%M:%S')}
-
-    Cảm ơn bạn đã sử dụng dịch vụ của chúng tôi!
-    """
-    from_email = settings.DEFAULT_FROM_EMAIL
-    recipient_list = [payment.appointment.healthrecord.email]
-    send_mail(subject, message, from_email, recipient_list)
-
-
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
+    pagination_class = paginators.PaymentPagination
 
     @action(detail=True, methods=['post'], url_path='process')
     def process_payment(self, request, pk=None):
         payment = get_object_or_404(Payment, pk=pk)
 
-        if payment.status == Payment.PaymentStatus.PAID:
-            return Response({'message': 'Hóa đơn đã được thanh toán trước đó.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        payment.status = Payment.PaymentStatus.PAID
-        payment.transaction_id = request.data.get('transaction_id', '')
-        payment.save()
+        try:
+            payment = booking.confirm_payment(payment.pk, request.data.get('transaction_id', ''))
+        except ValidationError as e:
+            return Response({'message': e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
 
-        self.send_payment_success_email(payment)
+        send_payment_success_email(payment)
 
         return Response({'message': 'Thanh toán thành công.'}, status=status.HTTP_200_OK)
 
@@ -617,6 +740,10 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
 
 class DoctorReportViewSet(APIView):
+    """
+    Thống kê của bác sĩ đăng nhập theo tháng/quý của năm (?month=&year=, ?quarter=&year=), mặc định là toàn bộ.
+    Số liệu được cộng từ bảng thống kê theo ngày DoctorDailyReport (clinic/reports.py).
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
@@ -631,40 +758,29 @@ class DoctorReportViewSet(APIView):
             quarter = int(request.query_params.get('quarter')) if request.query_params.get('quarter') else None
         except ValueError:
             return Response({'detail': 'Tham số tháng/năm không hợp lệ.'}, status=400)
+        if (month and not 1 <= month <= 12) or (quarter and not 1 <= quarter <= 4):
+            return Response({'detail': 'Tham số tháng/năm không hợp lệ.'}, status=400)
 
-        total_appointment = Appointment.objects.filter(schedule__doctor=doctor.user).count()
-        queryset = Appointment.objects.filter(schedule__doctor=doctor.user, status='completed')
-
-        if month and year:
-            queryset = queryset.filter(schedule__date__year=year, schedule__date__month=month)
-        elif quarter and year:
-            start_month = (quarter - 1) * 3 + 1
-            end_month = start_month + 2
-            queryset = queryset.filter(schedule__date__year=year,
-                                       schedule__date__month__range=(start_month, end_month))
-
-        examined = queryset.count()
-        top_diseases = queryset.values('disease_type').annotate(count=Count('disease_type')).order_by('-count')[:5]
-
-        # 👉 Sửa ở đây: doctor → doctor.user
-        unexamined = Appointment.objects.filter(schedule__doctor=doctor.user, status='paid')
-        if month and year:
-            unexamined = unexamined.filter(schedule__date__year=year, schedule__date__month=month)
-        elif quarter and year:
-            unexamined = unexamined.filter(schedule__date__year=year,
-                                           schedule__date__month__range=(start_month, end_month))
+        start = end = None
+        if year and (month or quarter):
+            start, end = reports.period_range(year, month=month, quarter=None if month else quarter)
 
-        unexamined_count = unexamined.count()
+        all_time = reports.totals(doctor_id=user.id)
+        period = reports.totals(start, end, doctor_id=user.id)
 
         return Response({
-            'total_appointment': total_appointment,
-            'examined_count': examined,
-            'unexamined_count': unexamined_count,
-            'top_disease': top_diseases,
+            'total_appointment': all_time['booked'] + all_time['cancelled'],
+            'examined_count': period['completed'],
+            'unexamined_count': period['paid'],
+            'top_disease': reports.top_diseases(start, end, doctor_id=user.id),
         })
 
 
 class AdminReportViewSet(APIView):
+    """
+    Số lịch khám đã hoàn tất và doanh thu toàn hệ thống theo tháng/quý/năm (mặc định là năm hiện tại),
+    cộng từ bảng thống kê theo ngày DoctorDailyReport (clinic/reports.py).
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
@@ -689,59 +805,182 @@ class AdminReportViewSet(APIView):
         if quarter and (quarter < 1 or quarter > 4):
             return Response({'detail': 'Quý không hợp lệ (1-4).'}, status=400)
 
-        # Filter các cuộc hẹn đã hoàn tất
-        appt_queryset = Appointment.objects.filter(status='completed')
-
-        if month:
-            appt_queryset = appt_queryset.filter(schedule__date__year=year, schedule__date__month=month)
-        elif quarter:
-            start_month = (quarter - 1) * 3 + 1
-            end_month = start_month + 2
-            appt_queryset = appt_queryset.filter(
-                schedule__date__year=year,
-                schedule__date__month__range=(start_month, end_month)
-            )
-        else:
-            appt_queryset = appt_queryset.filter(schedule__date__year=year)
-
-        # annotate consultation_fee từ Doctor -> User -> Schedule
-        appt_queryset = appt_queryset.select_related(
-            'schedule__doctor__doctor'
-        ).annotate(
-            fee=F('schedule__doctor__doctor__consultation_fee')
-        )
-
-        # tính tổng doanh thu
-        total_revenue = appt_queryset.aggregate(
-            total=Coalesce(Sum('fee', output_field=DecimalField()), Decimal('0.00'))
-        )['total']
+        start, end = reports.period_range(year, month=month, quarter=None if month else quarter)
+        period = reports.totals(start, end)
 
         return Response({
-            'appointment_count': appt_queryset.count(),
-            'revenue': total_revenue
+            'appointment_count': period['completed'],
+            'revenue': period['revenue']
         })
 
 
+class ReportTimeSeriesView(APIView):
+    """
+    Thống kê theo thời gian cho biểu đồ:
+    /reports/timeseries/?start=YYYY-MM-DD&end=YYYY-MM-DD&granularity=day|week|month|quarter
+    &hospital_id=&specialization_id=&doctor_id=
+    Quản trị viên xem toàn hệ thống, bác sĩ chỉ xem số liệu của mình.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        params = serializers.ReportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+
+        user = request.user
+        if user.role == 'doctor' and not user.is_staff:
+            data['doctor_id'] = user.id
+        elif not user.is_staff:
+            return Response({'detail': 'Không phải quản trị viên.'}, status=403)
+
+        result = reports.timeseries(data['start'], data['end'], data['granularity'],
+                                    doctor_id=data.get('doctor_id'), hospital_id=data.get('hospital_id'),
+                                    specialization_id=data.get('specialization_id'))
+        return Response({'start': data['start'], 'end': data['end'], 'granularity': data['granularity'], **result})
+
+
 class ScheduleAvailableDatesView(APIView):
+    MAX_DAYS = 365
+
     def get(self, request):
         doctor_id = request.query_params.get('doctor_id')
 
         if not doctor_id:
             return Response({"error": "Missing doctor_id"}, status=status.HTTP_400_BAD_REQUEST)
 
-        dates = (
-            Schedule.objects.filter(doctor_id=doctor_id, is_available=True)
+        # Các ngày (từ hôm nay) bác sĩ còn ít nhất một khung giờ trống
+        today = timezone.localdate()
+        dates = availability.available_days(today, today + timedelta(days=self.MAX_DAYS), doctor_id=doctor_id) \
             .values_list('date', flat=True)
-            .distinct()
-            .order_by('date')
-        )
 
         return Response(dates)
 
 
-class NotificationViewSet(viewsets.ModelViewSet):
+class AvailabilityView(APIView):
+    """
+    Lịch trống theo ngày của một bác sĩ, một chuyên khoa hoặc một bệnh viện trong một lần gọi:
+    /availability/?doctor_id=|specialization_id=|hospital_id=&start=YYYY-MM-DD&days=30
+    """
+    DEFAULT_DAYS = 30
+    MAX_DAYS = 90
+
+    def get(self, request):
+        params = request.query_params
+        doctor_id = params.get('doctor_id')
+        specialization_id = params.get('specialization_id')
+        hospital_id = params.get('hospital_id')
+        if not (doctor_id or specialization_id or hospital_id):
+            return Response({"error": "Cần truyền doctor_id, specialization_id hoặc hospital_id"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        start = timezone.localdate()
+        if params.get('start'):
+            start = parse_date(params['start'])
+            if not start:
+                raise ValidationError("start phải có dạng YYYY-MM-DD")
+        try:
+            days = min(int(params.get('days', self.DEFAULT_DAYS)), self.MAX_DAYS)
+        except ValueError:
+            raise ValidationError("days phải là số nguyên")
+        end = start + timedelta(days=max(days, 1) - 1)
+
+        doctors = {}
+        for row in availability.available_days(start, end, doctor_id=doctor_id,
+                                               specialization_id=specialization_id, hospital_id=hospital_id):
+            doctors.setdefault(row.pop('doctor_id'), []).append(row)
+
+        return Response({
+            'start': start,
+            'end': end,
+            'doctors': [{'doctor_id': key, 'days': value} for key, value in doctors.items()],
+        })
+
+
+class SearchView(APIView):
+    """
+    Tìm bác sĩ, bệnh viện, chuyên khoa theo tên không phân biệt dấu, cho phép gõ sai:
+    /search/?q=nguyen van a&type=doctor,hospital,specialization&limit=10
+    """
+    MAX_LIMIT = 50
+
+    def get(self, request):
+        params = request.query_params
+        text = params.get('q', '').strip()
+        if not text:
+            return Response({"error": "Cần truyền q"}, status=status.HTTP_400_BAD_REQUEST)
+
+        kinds = [kind for kind in params.get('type', '').split(',') if kind] or None
+        try:
+            limit = min(int(params.get('limit', settings.SEARCH_RESULT_LIMIT)), self.MAX_LIMIT)
+        except ValueError:
+            raise ValidationError("limit phải là số nguyên")
+
+        return Response({'results': search.search(text, kinds=kinds, limit=max(limit, 1))})
+
+
+class AutocompleteView(APIView):
+    """
+    Gợi ý tên bác sĩ, bệnh viện, chuyên khoa khi đang gõ, đọc từ cây gợi ý trong bộ nhớ (không truy vấn database):
+    /autocomplete/?q=nguyen v&type=doctor&limit=8
+    """
+
+    def get(self, request):
+        params = request.query_params
+        kinds = [kind for kind in params.get('type', '').split(',') if kind] or None
+        try:
+            limit = int(params.get('limit', settings.AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            raise ValidationError("limit phải là số nguyên")
+
+        return Response({'results': autocomplete.suggest(params.get('q', ''), kinds=kinds, limit=max(limit, 1))})
+
+
+class NotificationViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
+    """
+    Quản trị viên tạo/sửa/xoá thông báo, user đăng nhập chỉ xem được các thông báo gửi cho mình.
+    Thông báo được gửi khi tới send_at bởi worker (python manage.py dispatch_notifications).
+    Hộp thư của user đăng nhập:
+    - GET /notifications/inbox/: phân trang keyset (?cursor=), mới nhất trước
+    - GET /notifications/unread-count/: số thông báo chưa đọc
+    - POST /notifications/mark-all-read/, POST /notifications/{id}/read/
+    """
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
+    user_actions = ['list', 'retrieve', 'inbox', 'unread_count', 'mark_all_read', 'read']
+
+    def get_permissions(self):
+        if self.action in self.user_actions:
+            return [permissions.IsAuthenticated()]
+        return [permissions.IsAdminUser()]
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_staff:
+            return self.queryset
+        return self.queryset.filter(deliveries__user=user)
+
+    @action(methods=['get'], detail=False, url_path='inbox', pagination_class=paginators.InboxPagination)
+    def inbox(self, request):
+        queryset = UserNotification.objects.filter(user=request.user).select_related('notification')
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(serializers.InboxSerializer(page, many=True).data)
+
+    @action(methods=['get'], detail=False, url_path='unread-count')
+    def unread_count(self, request):
+        return Response({'count': notifications.unread_count(request.user)})
+
+    @action(methods=['post'], detail=False, url_path='mark-all-read')
+    def mark_all_read(self, request):
+        updated = notifications.mark_all_read(request.user)
+        return Response({'updated': updated, 'count': 0})
+
+    @action(methods=['post'], detail=True, url_path='read')
+    def read(self, request, pk=None):
+        if not UserNotification.objects.filter(user=request.user, notification_id=pk).exists():
+            return Response({'detail': 'Không tìm thấy thông báo.'}, status=status.HTTP_404_NOT_FOUND)
+        notifications.mark_read(request.user, pk)
+        return Response({'count': notifications.unread_count(request.user)})
 
 
 class UploadLicenseViewSet(APIView):
@@ -756,10 +995,15 @@ class UploadLicenseViewSet(APIView):
 
             if license_number:
                 doctor.license_number = license_number
-            if license_image:
+            files = {}
+            if isinstance(license_image, UploadedFile):
+                # Ảnh giấy phép được tải lên Cloudinary ở background (clinic/uploads.py)
+                files['license_image'] = license_image
+            elif license_image:
                 doctor.license_image = license_image
             doctor.is_verified = False  # Khi upload mới, phải chờ xác minh lại
             doctor.save()
+            uploads.stage_files(doctor, files)
 
             return Response({"message": "Đã gửi giấy phép thành công. Vui lòng chờ quản trị viên xác minh."},
                             status=200)
@@ -768,7 +1012,8 @@ class UploadLicenseViewSet(APIView):
 
 
 class PendingDoctorsViewSet(generics.ListAPIView):
-    queryset = Doctor.objects.filter(is_verified=False, license_image__isnull=False)
+    queryset = Doctor.objects.filter(is_verified=False, license_image__isnull=False) \
+        .select_related('user', 'hospital', 'specialization').with_rating_stats()
     serializer_class = serializers.DoctorSerializer
     permission_classes = [IsAdminUser]
 
@@ -0,0 +1,45 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from oauth2_provider.models import AccessToken
+
+
+@database_sync_to_async
+def get_token_user(token):
+    """
+    Lấy user từ access token OAuth2 (giống OAuth2Authentication của REST API)
+    :param token: access token
+    :return: User hoặc AnonymousUser nếu token không hợp lệ/hết hạn
+    """
+    try:
+        access_token = AccessToken.objects.select_related('user').get(token=token)
+    except AccessToken.DoesNotExist:
+        return AnonymousUser()
+    if not access_token.is_valid() or not access_token.user or not access_token.user.is_active:
+        return AnonymousUser()
+    return access_token.user
+
+
+class OAuth2TokenAuthMiddleware(BaseMiddleware):
+    """
+    Chứng thực kết nối WebSocket bằng access token OAuth2, lấy từ header
+    "Authorization: Bearer <token>" hoặc query string ?token=<token>
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = AnonymousUser()
+        if (token := self.get_token(scope)):
+            scope['user'] = await get_token_user(token)
+        return await super().__call__(scope, receive, send)
+
+    @staticmethod
+    def get_token(scope):
+        headers = dict(scope.get('headers', []))
+        authorization = headers.get(b'authorization', b'').decode()
+        if authorization.lower().startswith('bearer '):
+            return authorization[7:].strip()
+        query = parse_qs(scope.get('query_string', b'').decode())
+        return query.get('token', [None])[0]
@@ -13,4 +13,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'clinicbooking.settings')
 
-application = get_asgi_application()
+# Khởi tạo Django trước khi import các module dùng model (consumers, middleware)
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+
+from clinic.routing import websocket_urlpatterns  # noqa: E402
+from clinic.ws_auth import OAuth2TokenAuthMiddleware  # noqa: E402
+from clinic import autocomplete, caching  # noqa: E402
+
+# Kiểm tra cache dùng chung và tạo sẵn cây gợi ý tìm kiếm khi tiến trình khởi động
+caching.require_shared()
+autocomplete.warm_up()
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': OAuth2TokenAuthMiddleware(URLRouter(websocket_urlpatterns)),
+})
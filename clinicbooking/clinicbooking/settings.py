@@ -28,6 +28,59 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')  # Email của bạn
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')  # Mật khẩu của email (hoặc App password nếu dùng 2FA)
 DEFAULT_FROM_EMAIL = os.getenv('EMAIL_HOST_USER')  # Email gửi đi mặc định
 
+# Hàng đợi email (EmailOutbox): số lần gửi tối đa và thời gian chờ giữa các lần thử lại (tăng gấp đôi mỗi lần)
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = 60
+EMAIL_OUTBOX_BATCH_SIZE = 50
+# Thời gian một worker giữ lô email đang gửi, hết hạn thì worker khác được gửi lại
+EMAIL_OUTBOX_LEASE_SECONDS = 300
+
+# Hàng đợi tải ảnh (MediaUpload): thư mục lưu file tạm, backend lưu trữ, số file tải lên song song,
+# số lần thử tối đa và thời gian chờ giữa các lần thử lại (tăng gấp đôi mỗi lần)
+MEDIA_STAGING_ROOT = os.getenv('MEDIA_STAGING_ROOT', str(BASE_DIR / 'media' / 'staging'))
+MEDIA_UPLOAD_BACKEND = 'clinic.uploads.CloudinaryBackend'
+MEDIA_UPLOAD_CONCURRENCY = 4
+MEDIA_UPLOAD_BATCH_SIZE = 20
+MEDIA_UPLOAD_MAX_ATTEMPTS = 5
+MEDIA_UPLOAD_RETRY_BASE_SECONDS = 30
+# Thời gian một worker giữ lô file đang nén/tải lên, hết hạn thì worker khác được xử lý lại
+MEDIA_UPLOAD_LEASE_SECONDS = 600
+
+# Ảnh chụp được nén trước khi tải lên (clinic/imaging.py, cần Pillow):
+# {model.trường ảnh: trường lưu ảnh thu nhỏ}, cạnh dài tối đa, chất lượng JPEG, cỡ ảnh thu nhỏ, số process nén
+MEDIA_COMPRESS_FIELDS = {'clinic.testresult.image': 'thumbnail'}
+MEDIA_IMAGE_MAX_SIZE = 2048
+MEDIA_IMAGE_QUALITY = 82
+MEDIA_THUMBNAIL_SIZE = 320
+MEDIA_IMAGE_WORKERS = 2
+
+# Số URL ảnh Cloudinary được ghi nhớ trong mỗi tiến trình (clinic/media.py)
+MEDIA_URL_CACHE_SIZE = 10000
+
+# Tìm kiếm bác sĩ/bệnh viện/chuyên khoa (clinic/search.py): số kết quả mặc định, số ứng viên đọc từ chỉ mục
+# trước khi xếp hạng, số từ tối đa được gợi ý từ một tiền tố đang gõ dở
+SEARCH_RESULT_LIMIT = 10
+SEARCH_CANDIDATES = 200
+SEARCH_MAX_EXPANSIONS = 50
+
+# Gợi ý khi gõ (clinic/autocomplete.py): số gợi ý mặc định, số thay đổi tối đa được cập nhật dần vào cây gợi ý
+# của mỗi tiến trình (nhiều hơn thì tải lại toàn bộ) và thời gian giữ nhật ký thay đổi trong cache (giây)
+AUTOCOMPLETE_LIMIT = 8
+AUTOCOMPLETE_MAX_PENDING_CHANGES = 1000
+AUTOCOMPLETE_CHANGE_TTL = 86400
+
+# Lịch hẹn chưa thanh toán sau APPOINTMENT_PAYMENT_TIMEOUT phút bị huỷ để trả chỗ
+# (python manage.py expire_appointments), mỗi lô tối đa APPOINTMENT_EXPIRY_BATCH_SIZE lịch hẹn
+APPOINTMENT_PAYMENT_TIMEOUT = int(os.getenv('APPOINTMENT_PAYMENT_TIMEOUT', 30))
+APPOINTMENT_EXPIRY_BATCH_SIZE = 500
+
+# Gửi thông báo (python manage.py dispatch_notifications): các kênh gửi, số thông báo mỗi lần nhận,
+# số giây trước khi thông báo đang gửi dở được worker khác nhận lại, và backend push
+NOTIFICATION_CHANNELS = ['inbox', 'email', 'push']
+NOTIFICATION_DISPATCH_BATCH_SIZE = 10
+NOTIFICATION_CLAIM_TIMEOUT = 600
+NOTIFICATION_PUSH_BACKEND = 'clinic.notifications.ChannelsPushBackend'
+
 # Cấu hình celery giúp gửi email và push notification theo lich hẹn
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
@@ -52,6 +105,7 @@ ALLOWED_HOSTS = ['*']
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',  # runserver phục vụ ASGI (HTTP + WebSocket)
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -73,7 +127,10 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
     ),
-    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
+    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # Phân trang mặc định cho mọi API danh sách (client có thể đổi bằng ?page_size=, tối đa 100)
+    'DEFAULT_PAGINATION_CLASS': 'clinic.paginators.StandardPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', 20)),
 }
 
 USE_TZ = True  # vẫn bật timezone
@@ -127,7 +184,34 @@ TEMPLATES = [
     },
 ]
 
+# Cache: dùng Redis nếu có CACHE_REDIS_URL, mặc định là bộ nhớ cục bộ của tiến trình (dùng khi dev/test)
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+    } if CACHE_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'clinic',
+    }
+}
+# Thời gian (giây) giữ response của các API danh mục bệnh viện/chuyên khoa/bác sĩ (clinic/caching.py)
+CATALOG_CACHE_TTL = 300
+# Số liệu trang thống kê admin được tính sẵn (StatsSnapshot), cũ hơn số giây này thì được tính lại
+ADMIN_STATS_MAX_AGE = int(os.getenv('ADMIN_STATS_MAX_AGE', 900))
+
 WSGI_APPLICATION = 'clinicbooking.wsgi.application'
+ASGI_APPLICATION = 'clinicbooking.asgi.application'
+
+# Channel layer cho chat realtime qua WebSocket (clinic/consumers.py)
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            'hosts': [os.getenv('CHANNEL_REDIS_URL', 'redis://localhost:6379/1')],
+        },
+    },
+}
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'clinicbooking.settings')
 
 application = get_wsgi_application()
+
+# Kiểm tra cache dùng chung và tạo sẵn cây gợi ý tìm kiếm khi tiến trình khởi động
+from clinic import autocomplete, caching  # noqa: E402
+
+caching.require_shared()
+autocomplete.warm_up()